@@ -0,0 +1,316 @@
+# Приблизително търсене: кандидати от плътни вектори, точен score само върху тях.
+#   1. text и legal TF-IDF векторите се нормират и се хешират със знак (signed
+#      hashing) в TEXT_DIM + LEGAL_DIM измерения, умножени по sqrt(W_TEXT) и
+#      sqrt(W_LEGAL) – скаларното произведение приближава W_TEXT*cos + W_LEGAL*cos;
+#   2. IVF: сферичен k-means на nlist центъра; заявката обхожда nprobe-те най-близки
+#      списъка и продължава със следващите, докато не събере top_k*rerank кандидата;
+#   3. кандидатите се оценяват точно с engine.score_documents – само те, без
+#      обхождане на целия индекс.
+# nprobe и rerank са копчетата recall/latency (вж. "ann" етапа в benchmark.py).
+# Фиксиран nprobe не пази recall-а при растящ индекс (при ~sqrt(N) списъка 8 от
+# тях са все по-малка част), затова при строенето nprobe се калибрира: най-малкият,
+# при който recall@10 на извадка документи-заявки спрямо точния score е RECALL_TARGET.
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+import math
+import zlib
+
+import numpy as np
+
+from tf_idf_engine import W_LEGAL, W_TEXT, QueryNorms
+
+TEXT_DIM = 1024
+LEGAL_DIM = 256
+# None -> ~sqrt(N) списъка
+NLIST: Optional[int] = None
+# nprobe без калибриране (recall_target=None)
+NPROBE = 8
+RERANK = 10
+RECALL_TARGET = 0.9
+CALIBRATION_QUERIES = 50
+KMEANS_ITERATIONS = 10
+SEED = 1
+
+
+class HashingProjector:
+    """
+    Разреден вектор -> плътен: всеки токен отива в едно измерение със знак ±1
+    (crc32, стабилно между пусканията).
+    """
+
+    def __init__(self, text_dim: int = TEXT_DIM, legal_dim: int = LEGAL_DIM):
+        self.text_dim = text_dim
+        self.legal_dim = legal_dim
+        self.dim = text_dim + legal_dim
+        self._slots: Dict[str, Tuple[int, float]] = {}
+
+    def _slot(self, token: str, offset: int, dim: int) -> Tuple[int, float]:
+        key = token if offset == 0 else "\x00" + token
+        slot = self._slots.get(key)
+        if slot is None:
+            h = zlib.crc32(key.encode("utf-8"))
+            slot = self._slots[key] = (offset + h % dim, 1.0 if h & 0x80000000 else -1.0)
+        return slot
+
+    def project(self, text_vec: Mapping[str, float], legal_vec: Mapping[str, float]) -> np.ndarray:
+        out = np.zeros(self.dim, dtype=np.float32)
+        for vec, offset, dim, weight in (
+            (text_vec, 0, self.text_dim, W_TEXT),
+            (legal_vec, self.text_dim, self.legal_dim, W_LEGAL),
+        ):
+            norm = math.sqrt(sum(w * w for w in vec.values()))
+            if not norm:
+                continue
+            scale = math.sqrt(weight) / norm
+            for token, w in vec.items():
+                slot, sign = self._slot(token, offset, dim)
+                out[slot] += sign * w * scale
+        return out
+
+
+def _spherical_kmeans(vectors: np.ndarray, k: int, iterations: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (центрове k x dim с единична норма, номер на списък за всеки вектор)
+    """
+    rng = np.random.default_rng(seed)
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    centroids = unit[rng.choice(len(unit), size=k, replace=False)].copy()
+
+    assign = np.zeros(len(unit), dtype=np.int64)
+    for _ in range(iterations):
+        assign = np.argmax(unit @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, unit)
+        counts = np.bincount(assign, minlength=k)
+        # празен списък – нов център от случаен вектор
+        empty = counts == 0
+        sums[empty] = unit[rng.choice(len(unit), size=int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32), assign
+
+
+class AnnIndex:
+    def __init__(self, doc_ids: List[str], projector: HashingProjector, vectors: np.ndarray,
+                 centroids: np.ndarray, lists: List[np.ndarray], nprobe: int = NPROBE):
+        self.doc_ids = doc_ids
+        self.projector = projector
+        self.vectors = vectors
+        self.centroids = centroids
+        self.lists = lists
+        # по подразбиране за candidates/approximate_search (вж. calibrate)
+        self.nprobe = nprobe
+        # средният recall@10 при калибрирането; под целта, ако и всички списъци не стигат
+        self.calibrated_recall: Optional[float] = None
+
+    @classmethod
+    def from_engine(
+        cls,
+        engine,
+        text_dim: int = TEXT_DIM,
+        legal_dim: int = LEGAL_DIM,
+        nlist: Optional[int] = NLIST,
+        iterations: int = KMEANS_ITERATIONS,
+        seed: int = SEED,
+        recall_target: Optional[float] = RECALL_TARGET,
+        calibration_queries: int = CALIBRATION_QUERIES,
+    ) -> "AnnIndex":
+        """
+        engine: всеки engine с tfidf_docs_text/tfidf_docs_legal (JSON, компактен, сегментиран)
+        recall_target: None – nprobe=NPROBE; иначе nprobe се калибрира (calibrate)
+        върху calibration_queries случайни документа от индекса като заявки.
+        """
+        projector = HashingProjector(text_dim, legal_dim)
+        doc_ids = list(engine.tfidf_docs_text)
+        vectors = np.zeros((len(doc_ids), projector.dim), dtype=np.float32)
+        for idx, doc_id in enumerate(doc_ids):
+            vectors[idx] = projector.project(engine.tfidf_docs_text[doc_id], engine.tfidf_docs_legal.get(doc_id, {}))
+
+        if nlist is None:
+            nlist = int(math.sqrt(len(doc_ids)))
+        nlist = max(1, min(nlist, len(doc_ids)))
+        if doc_ids:
+            centroids, assign = _spherical_kmeans(vectors, nlist, iterations, seed)
+        else:
+            centroids, assign = np.zeros((0, projector.dim), dtype=np.float32), np.zeros(0, dtype=np.int64)
+        lists = [np.flatnonzero(assign == c) for c in range(len(centroids))]
+        ann = cls(doc_ids, projector, vectors, centroids, lists)
+
+        if recall_target is not None and doc_ids:
+            rng = np.random.default_rng(seed)
+            sample = rng.choice(len(doc_ids), size=min(calibration_queries, len(doc_ids)), replace=False)
+            sample = [doc_ids[i] for i in sorted(sample.tolist())]
+            queries = [(engine.tfidf_docs_text[d], engine.tfidf_docs_legal.get(d, {})) for d in sample]
+            # самият документ се намира тривиално – броят се само съседите му
+            ann.calibrate(engine, queries, recall_target, exclude=sample)
+        return ann
+
+    def calibrate(
+        self,
+        engine,
+        queries: List[Tuple[Dict[str, float], Dict[str, float]]],
+        recall_target: float = RECALL_TARGET,
+        top_k: int = 10,
+        rerank: int = RERANK,
+        exclude: Optional[List[Optional[str]]] = None,
+    ) -> int:
+        """
+        Най-малкият nprobe (1, 2, 4, ..., всички списъци), при който средният
+        recall@top_k на queries спрямо точния score е поне recall_target; записва
+        се в self.nprobe. queries: вече векторизирани (text_vec, legal_vec);
+        exclude[i]: документ, който не се брои за i-тата заявка.
+        Точните score-ове са през компактния индекс (CSR, векторизирано) – и за
+        всички документи, и за кандидатите, – а не с engine.score_documents
+        документ по документ.
+        """
+        from compact_store import CompactTfidfEngine
+
+        exact = engine if isinstance(engine, CompactTfidfEngine) else CompactTfidfEngine.from_engine(engine)
+        exact_index = {d: i for i, d in enumerate(exact.doc_ids)}
+
+        def scores(query_vectors, idxs=None) -> np.ndarray:
+            (q_text, q_legal), fields = query_vectors, exact.fields
+            if idxs is None:
+                return W_TEXT * fields["text"].cosines(q_text)[0] + W_LEGAL * fields["legal"].cosines(q_legal)[0]
+            return (
+                W_TEXT * fields["text"].cosines_for(q_text, idxs)[0]
+                + W_LEGAL * fields["legal"].cosines_for(q_legal, idxs)[0]
+            )
+
+        def top(idxs: np.ndarray, values: np.ndarray) -> set:
+            order = np.argsort(-values, kind="stable")[:top_k]
+            return {int(idxs[i]) for i in order.tolist() if values[i] > 0}
+
+        exclude = exclude or [None] * len(queries)
+        skip_idx = [exact_index.get(skip, -1) for skip in exclude]
+        expected = []
+        for query_vectors, skip in zip(queries, skip_idx):
+            values = scores(query_vectors)
+            if skip >= 0:
+                values[skip] = 0.0
+            expected.append(top(np.arange(len(values)), values))
+
+        nprobe = 1
+        while True:
+            recalls = []
+            for query_vectors, exp, skip in zip(queries, expected, skip_idx):
+                candidates = self.candidates(engine, [], [], top_k * rerank, nprobe, query_vectors=query_vectors)
+                idxs = np.sort(np.array([exact_index[d] for d in candidates], dtype=np.int64))
+                idxs = idxs[idxs != skip]
+                got = top(idxs, scores(query_vectors, idxs))
+                recalls.append(len(exp & got) / len(exp) if exp else 1.0)
+            recall = sum(recalls) / max(len(recalls), 1)
+            if recall >= recall_target or nprobe >= len(self.lists):
+                break
+            nprobe = min(nprobe * 2, len(self.lists))
+        self.nprobe = nprobe
+        self.calibrated_recall = recall
+        return nprobe
+
+    def candidates(
+        self,
+        engine,
+        query_text_tokens: List[str],
+        query_legal_tokens: List[str],
+        limit: int,
+        nprobe: Optional[int] = None,
+        stats: Optional[Dict[str, int]] = None,
+        query_vectors: Optional[Tuple[Dict[str, float], Dict[str, float]]] = None,
+    ) -> List[str]:
+        """
+        До limit документа с най-висок плътен score, в реда на индекса. Обхождат се
+        поне nprobe списъка (по близост на центъра), а докато кандидатите са под
+        limit – и следващите, така че по-голям nprobe никога не дава по-малко.
+        nprobe: None – self.nprobe.
+        query_vectors: вече векторизираната заявка (engine.vectorize_query).
+        """
+        if not self.doc_ids:
+            return []
+        if query_vectors is None:
+            query_vectors = engine.vectorize_query(query_text_tokens, query_legal_tokens)
+        q = self.projector.project(*query_vectors)
+        if nprobe is None:
+            nprobe = self.nprobe
+
+        order = np.argsort(-(self.centroids @ q), kind="stable")
+        sizes = np.array([len(self.lists[c]) for c in order])
+        # най-малкият брой списъци с поне limit вектора (или всички)
+        enough = int(np.searchsorted(np.cumsum(sizes), limit)) + 1
+        probed = order[:max(min(nprobe, len(order)), min(enough, len(order)))]
+        idx = np.concatenate([self.lists[c] for c in probed])
+
+        if len(idx) > limit:
+            dense = self.vectors[idx] @ q
+            idx = idx[np.argpartition(-dense, limit - 1)[:limit]]
+
+        if stats is not None:
+            stats["lists_probed"] = len(probed)
+            stats["vectors_scanned"] = int(sizes[:len(probed)].sum())
+        return [self.doc_ids[i] for i in np.sort(idx).tolist()]
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.centroids.nbytes + sum(l.nbytes for l in self.lists)
+
+
+def approximate_search(
+    engine,
+    ann: AnnIndex,
+    query_text_tokens: List[str],
+    query_legal_tokens: List[str],
+    top_k: int = 5,
+    min_score: float = 0.0,
+    stats: Optional[Dict[str, int]] = None,
+    nprobe: Optional[int] = None,
+    rerank: int = RERANK,
+    query_norms: QueryNorms = None,
+) -> List[Tuple[str, float]]:
+    """
+    ANN кандидати -> точният score (engine.score_documents) само върху тях.
+    Подредба като engine.search: score desc, после реда на документите.
+    nprobe: None – калибрираният ann.nprobe. query_norms: вж. engine.search.
+    """
+    query_vectors = engine.vectorize_query(query_text_tokens, query_legal_tokens)
+    candidates = ann.candidates(
+        engine, query_text_tokens, query_legal_tokens, top_k * rerank, nprobe, stats, query_vectors
+    )
+    scores, touched = engine.score_documents(*query_vectors, candidates, query_norms)
+
+    ranked = sorted(
+        ((doc_id, float(score)) for doc_id, score in zip(candidates, scores) if score >= min_score),
+        key=lambda x: x[1],
+        reverse=True,
+    )
+
+    if stats is not None:
+        stats["candidates"] = len(candidates)
+        stats["documents_scored"] = len(candidates)
+        stats["postings_touched"] = touched
+    return ranked[:top_k]
+
+
+def ann_recall(
+    engine,
+    ann: AnnIndex,
+    queries: Iterable[Tuple[List[str], List[str]]],
+    top_k: int = 10,
+    nprobe: Optional[int] = None,
+    rerank: int = RERANK,
+) -> Dict[str, float]:
+    """
+    recall@top_k спрямо изчерпателното engine.search (само документи със score > 0).
+    """
+    recalls = []
+    candidates = []
+    for text_tokens, legal_tokens in queries:
+        expected = {d for d, s in engine.search(text_tokens, legal_tokens, top_k=top_k) if s > 0}
+        stats = {}
+        got = {d for d, _ in approximate_search(engine, ann, text_tokens, legal_tokens, top_k,
+                                                stats=stats, nprobe=nprobe, rerank=rerank)}
+        recalls.append(len(expected & got) / len(expected) if expected else 1.0)
+        candidates.append(stats["candidates"] / max(len(ann.doc_ids), 1))
+
+    n = max(len(recalls), 1)
+    return {
+        f"recall_at_{top_k}": sum(recalls) / n,
+        "min_recall": min(recalls, default=1.0),
+        "candidate_ratio": sum(candidates) / n,
+    }
@@ -1,33 +1,159 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from fastapi import APIRouter, Depends, FastAPI, UploadFile, File, HTTPException, Query, Request
 from pathlib import Path
+from typing import Dict, List, Optional
+import hmac
+import os
 import shutil
+import threading
+import time
 import uuid
 
-from starlette.responses import FileResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 
-from search import tf_idf_search
+from document_metadata import MetadataFilter
+from document_store import DocumentManifest, document_response
+from metrics import REQUEST_SECONDS, format_profile, render_prometheus, request_profile
+from legal_trie import parse_cites
+from engine_holder import IndexValidationError
+from search import HOLDER, QUERY_PRUNING, legal_trie, tf_idf_search_with_highlights
+from text_preprocessing import get_stemmer, stemmer_loaded
 
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI(title="TF-IDF Legal Search")
-
 UPLOAD_DIR = Path("tmp")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
 DOCUMENTS_DIR = Path("Data/Documents")
 
+# filename -> path/size/etag, сканиран веднъж (при старт) вместо stat при всяка заявка
+DOCUMENT_MANIFEST = DocumentManifest(DOCUMENTS_DIR)
+
+# времена на зареждането при старт (секунди от началото на lifespan-а)
+STARTUP: Dict[str, Optional[float]] = {"documents": None, "stemmer": None, "index": None, "ready": None}
+STARTUP_ERROR: Optional[str] = None
+
+
+def warm_up() -> None:
+    """
+    Документи, stemmer и индекс – във фонов thread, докато сървърът вече
+    отговаря (/healthz). При gunicorn индексът идва зареден от master-а.
+    """
+    global STARTUP_ERROR
+    t0 = time.perf_counter()
+    try:
+        DOCUMENT_MANIFEST.refresh()
+        STARTUP["documents"] = time.perf_counter() - t0
+        get_stemmer()
+        STARTUP["stemmer"] = time.perf_counter() - t0
+        HOLDER.ensure_loaded()
+        STARTUP["index"] = time.perf_counter() - t0
+    except Exception as e:
+        STARTUP_ERROR = f"{type(e).__name__}: {e}"
+        return
+    STARTUP["ready"] = time.perf_counter() - t0
+
+
+def is_ready() -> bool:
+    # не STARTUP["ready"]: индекс, който не е успял да се зареди при старт, може да дойде с /admin/reload
+    return HOLDER.loaded and stemmer_loaded() and STARTUP["documents"] is not None
+
+
+def require_ready() -> None:
+    if not is_ready():
+        raise HTTPException(status_code=503, detail="index is loading", headers={"Retry-After": "1"})
+
+
+def require_documents() -> None:
+    # за /documents стига manifest-ът – не чака индекса и stemmer-а
+    if STARTUP["documents"] is None:
+        raise HTTPException(status_code=503, detail="documents are loading", headers={"Retry-After": "1"})
+
+
+# /admin/* само с "Authorization: Bearer <ADMIN_TOKEN>"; без ADMIN_TOKEN изобщо не се
+# регистрират. Адресът на клиента не е критерий – зад reverse proxy всички идват от 127.0.0.1.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
+
+
+def require_admin(request: Request) -> None:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if (
+        ADMIN_TOKEN is None
+        or scheme.lower() != "bearer"
+        or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+    ):
+        raise HTTPException(status_code=401, detail="admin token required", headers={"WWW-Authenticate": "Bearer"})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    # всеки worker следи за /admin/reload, обслужен от друг worker
+    HOLDER.watch_reload_requests()
+    yield
+
+
+app = FastAPI(title="TF-IDF Legal Search", lifespan=lifespan)
+
+# opt-in: "X-Profile: 1" връща разбивка по етапи в отговора
+PROFILE_HEADER = "x-profile"
+
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
     allow_credentials=True,
+    expose_headers=["ETag", "Last-Modified", "Content-Range", "Accept-Ranges"],
 )
 
+# обикновен def: FastAPI го пуска в threadpool-а, така че извличането от PDF-а и
+# оценяването не блокират event loop-а (/healthz, /readyz, /documents отговарят междувременно)
 @app.post("/search/pdf")
-async def search_by_pdf(file: UploadFile = File(...)):
+def search_by_pdf(
+    request: Request,
+    file: UploadFile = File(...),
+    cites: Optional[List[str]] = Query(None, description="e.g. АПК:чл:145 – only decisions citing it at any sub-level"),
+    include_duplicates: bool = Query(False, description="list near-duplicate decisions collapsed into each result"),
+    prune_top_n: Optional[int] = Query(None, ge=1, description="keep only the N heaviest query text terms"),
+    prune_mass: Optional[float] = Query(None, gt=0, le=1, description="keep query text terms covering this share of L2 mass"),
+    court: Optional[List[str]] = Query(None, description="e.g. Пловдив – court name contains it (any of several)"),
+    act_type: Optional[List[str]] = Query(None, description="e.g. решение, определение (any of several)"),
+    year_from: Optional[int] = Query(None, ge=1900, le=2100),
+    year_to: Optional[int] = Query(None, ge=1900, le=2100),
+    law: Optional[List[str]] = Query(None, description="e.g. АПК – only decisions citing all of them"),
+):
+    require_ready()
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
 
+    pruning = QUERY_PRUNING["/search/pdf"]
+    if prune_top_n is not None or prune_mass is not None:
+        pruning = replace(
+            pruning,
+            text_top_n=prune_top_n if prune_top_n is not None else pruning.text_top_n,
+            text_mass=prune_mass if prune_mass is not None else pruning.text_mass,
+        )
+
+    try:
+        for c in cites or ():
+            parse_cites(c)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if year_from is not None and year_to is not None and year_from > year_to:
+        raise HTTPException(status_code=400, detail="year_from must not be after year_to")
+    filters = MetadataFilter(
+        courts=tuple(court or ()),
+        act_types=tuple(act_type or ()),
+        year_from=year_from,
+        year_to=year_to,
+        laws=tuple(law or ()),
+    )
+
+    started = time.perf_counter()
+    profile_enabled = request.headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes")
+
     # Save uploaded PDF temporarily
     tmp_filename = f"{uuid.uuid4()}.pdf"
     tmp_path = UPLOAD_DIR / tmp_filename
@@ -36,31 +162,116 @@ async def search_by_pdf(file: UploadFile = File(...)):
         shutil.copyfileobj(file.file, buffer)
 
     try:
-        results = tf_idf_search(tmp_path, top_k=5)
+        with request_profile(profile_enabled) as profile:
+            results = tf_idf_search_with_highlights(
+                tmp_path, top_k=5, cites=cites, include_duplicates=include_duplicates, pruning=pruning,
+                filters=filters,
+            )
     finally:
         tmp_path.unlink(missing_ok=True)  # cleanup
 
+    REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint="/search/pdf")
+
+    response = {"results": []}
+    for r in results:
+        item = {
+            "document": r["document"],
+            "score": round(r["score"], 4),
+            "download_url": f"http://localhost:8000/documents/{r['document']}",
+            "references": r["references"],
+        }
+        if include_duplicates:
+            item["duplicates"] = [
+                {"document": d, "download_url": f"http://localhost:8000/documents/{d}"}
+                for d in r["duplicates"]
+            ]
+        response["results"].append(item)
+
+    if profile is not None:
+        response["profile"] = format_profile(profile)
+
+    return response
+
+
+@app.get("/references")
+def references(cites: str = Query(..., description="e.g. АПК:чл:145")):
+    require_ready()
+    try:
+        path = parse_cites(cites)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    trie = legal_trie()
     return {
-        "results": [
-            {
-                "document": doc_id,
-                "score": round(score, 4),
-                "download_url": f"http://localhost:8000/documents/{doc_id}"
-            }
-            for doc_id, score in results
-        ]
+        "reference": cites,
+        "documents": bin(trie.citing(path)).count("1"),
+        "ancestors": trie.ancestors(path),
+        "children": [{"token": t, "documents": n} for t, n in trie.children(path)],
     }
 
 
-@app.get("/documents/{filename}")
-def get_document(filename: str):
-    file_path = DOCUMENTS_DIR / filename
+admin = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+
+@admin.post("/reload")
+def admin_reload(wait: bool = False, force: bool = False):
+    """
+    Зарежда индекса наново и го сменя атомарно; текущите заявки довършват върху
+    старата версия. wait=true чака и връща резултата (409 при невалиден индекс).
+    Останалите worker-и се презареждат през reload_request.json (до
+    RELOAD_POLL_SECONDS по-късно); wait чака само този worker.
+    """
+    HOLDER.request_reload(force=force)
+    if not wait:
+        started = HOLDER.reload_in_background(force=force)
+        return {"started": started, **HOLDER.status()}
+
+    try:
+        HOLDER.reload(force=force)
+    except IndexValidationError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {e}")
+    return HOLDER.status()
+
 
-    if not file_path.exists():
+@admin.get("/index")
+def admin_index():
+    return HOLDER.status()
+
+
+if ADMIN_TOKEN is not None:
+    app.include_router(admin)
+
+
+@app.get("/healthz")
+def healthz():
+    """
+    Liveness: процесът отговаря, независимо дали индексът е зареден.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    """
+    Readiness: 200 едва когато индексът, stemmer-ът и документите са заредени.
+    """
+    body = {"ready": is_ready(), "startup_seconds": STARTUP, "error": STARTUP_ERROR or HOLDER.last_error}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.api_route("/documents/{filename}", methods=["GET", "HEAD"])
+def get_document(filename: str, request: Request):
+    require_documents()
+    entry = DOCUMENT_MANIFEST.resolve(filename)
+
+    if entry is None:
         raise HTTPException(status_code=404, detail="File not found")
 
-    return FileResponse(
-        path=file_path,
-        media_type="application/pdf",
-        filename=filename
-    )
+    return document_response(request, entry)
@@ -0,0 +1,1165 @@
+from __future__ import annotations
+
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from ann_index import AnnIndex, ann_recall, approximate_search
+from compact_store import QUANTIZATION, CompactTfidfEngine, ranking_drift
+from document_metadata import DocumentMetadataStore, MetadataFilter
+from domain_entities_extraction import extract_domain_entities
+from postings_store import CODECS, PostingsTfidfEngine, postings_dir
+from query_pruning import QueryPruning, pruning_report
+from domain_entities_normalization import extract_text_from_pdf
+from evaluation import legal_tokens_from_decision, legal_tokens_from_text
+from index_store import load_engine, load_json_engine, save_engine
+from near_duplicates import find_duplicates
+from pdf_extraction import PAGE_WORKERS, available_backends, extract_text, get_backend
+from synthetic_corpus import generate_corpus
+from text_preprocessing import extract_metadata, get_stemmer, preprocess, remove_text_before_marker_safe
+from tf_idf_engine import TfidfSearchEngine
+from tf_idf_index_builder import COUNTS_DIR_NAME, write_counts_record, write_index_from_counts
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_BASELINE = BASE_DIR / "benchmarks" / "baseline.json"
+
+# относително влошаване, над което метриката се маркира като регресия
+DEFAULT_TOLERANCE = 0.25
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """
+    samples в секунди -> p50/p99/mean в милисекунди (nearest-rank)
+    """
+    if not samples:
+        return {"p50_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0}
+    ordered = sorted(samples)
+    n = len(ordered)
+
+    def q(p: float) -> float:
+        return ordered[min(n - 1, int(round(p * (n - 1))))] * 1000.0
+
+    return {
+        "p50_ms": q(0.50),
+        "p99_ms": q(0.99),
+        "mean_ms": sum(ordered) / n * 1000.0,
+    }
+
+
+@dataclass
+class BenchContext:
+    corpus: Dict[str, str]
+    queries: Dict[str, str]
+    workdir: Path
+    repeats: int = 3
+
+    _doc_tokens: Optional[Dict[str, Tuple[List[str], List[str]]]] = field(default=None, repr=False)
+    _query_tokens: Optional[List[Tuple[List[str], List[str]]]] = field(default=None, repr=False)
+    _engine: Optional[TfidfSearchEngine] = field(default=None, repr=False)
+
+    @staticmethod
+    def _tokens(text: str) -> Tuple[List[str], List[str]]:
+        trimmed = remove_text_before_marker_safe(text)
+        body, legal_tokens = extract_domain_entities(trimmed)
+        tokens = [t for t in preprocess(body) if len(t) > 2 and not t.isdigit()]
+        stem = get_stemmer()
+        return [stem(t) for t in tokens], legal_tokens
+
+    def doc_tokens(self) -> Dict[str, Tuple[List[str], List[str]]]:
+        if self._doc_tokens is None:
+            self._doc_tokens = {doc_id: self._tokens(text) for doc_id, text in self.corpus.items()}
+        return self._doc_tokens
+
+    def query_tokens(self) -> List[Tuple[List[str], List[str]]]:
+        if self._query_tokens is None:
+            self._query_tokens = [self._tokens(text) for text in self.queries.values()]
+        return self._query_tokens
+
+    def engine(self) -> TfidfSearchEngine:
+        if self._engine is None:
+            docs = self.doc_tokens()
+            self._engine = TfidfSearchEngine()
+            self._engine.build_index(
+                {d: t for d, (t, _) in docs.items()},
+                {d: l for d, (_, l) in docs.items()},
+            )
+        return self._engine
+
+
+STAGES: Dict[str, Callable[[BenchContext], Dict[str, Dict[str, float]]]] = {}
+
+
+def stage(name: str):
+    def register(fn):
+        STAGES[name] = fn
+        return fn
+    return register
+
+
+@stage("extraction")
+def bench_extraction(ctx: BenchContext) -> Dict[str, Dict[str, float]]:
+    entity_times, preprocess_times = [], []
+    chars = 0
+
+    for text in ctx.corpus.values():
+        trimmed = remove_text_before_marker_safe(text)
+        chars += len(trimmed)
+
+        t0 = time.perf_counter()
+        body, _ = extract_domain_entities(trimmed)
+        t1 = time.perf_counter()
+        preprocess(body)
+        t2 = time.perf_counter()
+
+        entity_times.append(t1 - t0)
+        preprocess_times.append(t2 - t1)
+
+    mb = chars / 1e6
+    out = {}
+    for name, samples in (("extract_domain_entities", entity_times), ("preprocess", preprocess_times)):
+        total = sum(samples) or 1e-12
+        out[f"extraction.{name}"] = {
+            "docs_per_s": len(samples) / total,
+            "mchars_per_s": mb / total,
+            **percentiles(samples),
+        }
+    return out
+
+
+@stage("stemming")
+def bench_stemming(ctx: BenchContext) -> Dict[str, Dict[str, float]]:
+    stemmer = get_stemmer()
+    per_doc = []
+    n_tokens = 0
+    for text in ctx.corpus.values():
+        body, _ = extract_domain_entities(remove_text_before_marker_safe(text))
+        tokens = [t for t in preprocess(body) if len(t) > 2 and not t.isdigit()]
+
+        t0 = time.perf_counter()
+        for t in tokens:
+            stemmer(t)
+        per_doc.append(time.perf_counter() - t0)
+        n_tokens += len(tokens)
+
+    total = sum(per_doc) or 1e-12
+    return {"stemming": {"tokens_per_s": n_tokens / total, "docs_per_s": len(per_doc) / total, **percentiles(per_doc)}}
+
+
+@stage("build_index")
+def bench_build_index(ctx: BenchContext) -> Dict[str, Dict[str, float]]:
+    docs = ctx.doc_tokens()
+    text_tokens = {d: t for d, (t, _) in docs.items()}
+    legal_tokens = {d: l for d, (_, l) in docs.items()}
+
+    times = []
+    for _ in range(ctx.repeats):
+        engine = TfidfSearchEngine()
+        t0 = time.perf_counter()
+        engine.build_index(text_tokens, legal_tokens)
+        times.append(time.perf_counter() - t0)
+
+    # цикли на Python по термин (без vectorized_index.py)
+    python_times = []
+    for _ in range(ctx.repeats):
+        reference = TfidfSearchEngine()
+        t0 = time.perf_counter()
+        reference.build_index(text_tokens, legal_tokens, vectorized=False)
+        python_times.append(time.perf_counter() - t0)
+    identical = float(
+        reference.tfidf_docs_text == engine.tfidf_docs_text
+        and reference.tfidf_docs_legal == engine.tfidf_docs_legal
+        and reference.idf_text == engine.idf_text
+        and reference.idf_legal == engine.idf_legal
+    )
+
+    tracemalloc.start()
+    TfidfSearchEngine().build_index(text_tokens, legal_tokens)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # streaming builder-ът от term counts (DF pass + pass 2)
+    index_dir = ctx.workdir / "streaming_index"
+    (index_dir / COUNTS_DIR_NAME).mkdir(parents=True, exist_ok=True)
+    with (index_dir / COUNTS_DIR_NAME / "base.jsonl").open("w", encoding="utf-8") as f:
+        for doc_id, (t, l) in docs.items():
+            write_counts_record(f, doc_id, t, l)
+
+    streaming_times = []
+    for _ in range(ctx.repeats):
+        t0 = time.perf_counter()
+        write_index_from_counts(index_dir)
+        streaming_times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    write_index_from_counts(index_dir)
+    _, streaming_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n = len(docs)
+    return {
+        "build_index": {
+            "docs_per_s": n / (min(times) or 1e-12),
+            "peak_mb": peak / 2 ** 20,
+            **percentiles(times),
+        },
+        "build_index.python": {
+            "docs_per_s": n / (min(python_times) or 1e-12),
+            **percentiles(python_times),
+            "identical": identical,
+        },
+        "build_index.streaming": {
+            "docs_per_s": n / (min(streaming_times) or 1e-12),
+            "peak_mb": streaming_peak / 2 ** 20,
+            **percentiles(streaming_times),
+        },
+    }
+
+
+@stage("near_duplicates")
+def bench_near_duplicates(ctx: BenchContext, dup_ratio: float = 0.2, edit_ratio: float = 0.03) -> Dict[str, Dict[str, float]]:
+    """
+    MinHash/LSH върху корпуса плюс копия на dup_ratio от документите с edit_ratio
+    сменени токена (поправки/преиздадени актове): точност, пълнота, кандидат двойки.
+    """
+    rng = random.Random(7)
+    docs = dict(ctx.doc_tokens())
+    originals = list(docs)
+    vocabulary = sorted({t for text_tokens, _ in docs.values() for t in text_tokens})
+
+    expected = set()
+    for doc_id in originals[:int(len(originals) * dup_ratio)]:
+        text_tokens, legal_tokens = docs[doc_id]
+        copy = [rng.choice(vocabulary) if rng.random() < edit_ratio else t for t in text_tokens]
+        docs[f"{doc_id}.copy"] = (copy, legal_tokens)
+        expected.add(frozenset((doc_id, f"{doc_id}.copy")))
+
+    stats = {}
+    t0 = time.perf_counter()
+    clusters = find_duplicates(((d, t) for d, (t, _) in docs.items()), stats=stats)
+    elapsed = time.perf_counter() - t0
+
+    found = set()
+    for rep, dups in clusters.items():
+        members = [rep] + dups
+        found.update(frozenset((a, b)) for i, a in enumerate(members) for b in members[i + 1:])
+
+    n = len(docs)
+    return {
+        "near_duplicates": {
+            "docs_per_s": n / (elapsed or 1e-12),
+            "precision": len(found & expected) / max(len(found), 1),
+            "recall": len(found & expected) / max(len(expected), 1),
+            "candidate_pair_ratio": stats["candidate_pairs"] / max(n * (n - 1) / 2, 1),
+            "collapsed_ratio": stats["duplicates"] / n,
+        },
+    }
+
+
+@stage("load_engine")
+def bench_load_engine(ctx: BenchContext) -> Dict[str, Dict[str, float]]:
+    index_dir = ctx.workdir / "index"
+    save_engine(ctx.engine(), index_dir)
+
+    times = []
+    for _ in range(ctx.repeats):
+        t0 = time.perf_counter()
+        load_engine(index_dir)
+        times.append(time.perf_counter() - t0)
+
+    # студен старт в нов процес: интерпретатор + import + зареждане
+    code = (
+        "import time; t0 = time.perf_counter();"
+        "from pathlib import Path; from index_store import load_engine;"
+        f"load_engine(Path({str(index_dir)!r}));"
+        "print(time.perf_counter() - t0)"
+    )
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=BASE_DIR, capture_output=True, text=True, check=True)
+    process_total = time.perf_counter() - t0
+
+    index_bytes = sum(p.stat().st_size for p in index_dir.glob("*.json"))
+    return {
+        "load_engine": {
+            "index_mb": index_bytes / 2 ** 20,
+            "cold_start_ms": float(out.stdout.strip()) * 1000.0,
+            "process_cold_start_ms": process_total * 1000.0,
+            **percentiles(times),
+        }
+    }
+
+
+@stage("search")
+def bench_search(ctx: BenchContext) -> Dict[str, Dict[str, float]]:
+    engine = ctx.engine()
+    queries = ctx.query_tokens()
+
+    single = []
+    for _ in range(ctx.repeats):
+        for text_tokens, legal_tokens in queries:
+            t0 = time.perf_counter()
+            engine.search(text_tokens, legal_tokens, top_k=10)
+            single.append(time.perf_counter() - t0)
+
+    # postings се строят при първата batch заявка – не ги мерим
+    engine.search_batch(queries[:1], top_k=10)
+    batch = []
+    for _ in range(ctx.repeats):
+        t0 = time.perf_counter()
+        engine.search_batch(queries, top_k=10)
+        batch.append(time.perf_counter() - t0)
+
+    per_query_batch = [t / max(len(queries), 1) for t in batch]
+    return {
+        "search.single": {
+            "queries_per_s": len(single) / (sum(single) or 1e-12),
+            **percentiles(single),
+        },
+        "search.batch": {
+            "queries_per_s": len(queries) / (min(batch) or 1e-12),
+            **percentiles(per_query_batch),
+        },
+    }
+
+
+@stage("prefilter")
+def bench_prefilter(ctx: BenchContext) -> Dict[str, Dict[str, float]]:
+    """
+    Двуетапно търсене (LEGAL кандидати -> пълен score) срещу изчерпателното search().
+    """
+    engine = ctx.engine()
+    queries = ctx.query_tokens()
+    top_k = 10
+
+    engine.search_two_stage(*queries[0], top_k=top_k)
+
+    exhaustive, two_stage = [], []
+    recalls, candidate_ratios = [], []
+    fallbacks = 0
+    for _ in range(ctx.repeats):
+        for text_tokens, legal_tokens in queries:
+            t0 = time.perf_counter()
+            full = engine.search(text_tokens, legal_tokens, top_k=top_k)
+            t1 = time.perf_counter()
+            stats = {}
+            pre = engine.search_two_stage(text_tokens, legal_tokens, top_k=top_k, stats=stats)
+            t2 = time.perf_counter()
+
+            exhaustive.append(t1 - t0)
+            two_stage.append(t2 - t1)
+
+            expected = {d for d, _ in full}
+            recalls.append(len(expected & {d for d, _ in pre}) / max(len(expected), 1))
+            candidate_ratios.append(stats["candidates"] / max(len(engine.tfidf_docs_text), 1))
+            if stats["candidates"] == len(engine.tfidf_docs_text):
+                fallbacks += 1
+
+    n = len(recalls)
+    return {
+        "prefilter.exhaustive": {
+            "queries_per_s": n / (sum(exhaustive) or 1e-12),
+            **percentiles(exhaustive),
+        },
+        "prefilter.two_stage": {
+            "queries_per_s": n / (sum(two_stage) or 1e-12),
+            **percentiles(two_stage),
+            f"recall_at_{top_k}": sum(recalls) / n,
+            "min_recall": min(recalls),
+            "candidate_ratio": sum(candidate_ratios) / n,
+            "fallback_ratio": fallbacks / n,
+        },
+    }
+
+
+@stage("ann")
+def bench_ann(ctx: BenchContext, nprobes: Tuple[int, ...] = (1, 4, 8, 16), rerank: int = 10) -> Dict[str, Dict[str, float]]:
+    """
+    IVF кандидати + точен rerank срещу изчерпателното search(): recall@10 и
+    латентност за няколко стойности на nprobe и за калибрирания при строенето.
+    """
+    engine = ctx.engine()
+    queries = ctx.query_tokens()
+    top_k = 10
+
+    t0 = time.perf_counter()
+    ann = AnnIndex.from_engine(engine)
+    build_s = time.perf_counter() - t0
+
+    exhaustive = []
+    for _ in range(ctx.repeats):
+        for text_tokens, legal_tokens in queries:
+            t0 = time.perf_counter()
+            engine.search(text_tokens, legal_tokens, top_k=top_k)
+            exhaustive.append(time.perf_counter() - t0)
+
+    out = {
+        "ann.exhaustive": {"queries_per_s": len(exhaustive) / (sum(exhaustive) or 1e-12), **percentiles(exhaustive)},
+        "ann.index": {
+            "build_docs_per_s": len(ann.doc_ids) / (build_s or 1e-12),
+            "lists": len(ann.lists),
+            "calibrated_nprobe": ann.nprobe,
+            "calibrated_recall": ann.calibrated_recall,
+            "array_mb": ann.nbytes / 2 ** 20,
+        },
+    }
+    for nprobe in (*nprobes, None):
+        times = []
+        for _ in range(ctx.repeats):
+            for text_tokens, legal_tokens in queries:
+                t0 = time.perf_counter()
+                approximate_search(engine, ann, text_tokens, legal_tokens, top_k=top_k, nprobe=nprobe, rerank=rerank)
+                times.append(time.perf_counter() - t0)
+        out["ann.nprobe_calibrated" if nprobe is None else f"ann.nprobe_{nprobe}"] = {
+            "queries_per_s": len(times) / (sum(times) or 1e-12),
+            **percentiles(times),
+            **ann_recall(engine, ann, queries, top_k=top_k, nprobe=nprobe, rerank=rerank),
+        }
+    return out
+
+
+@stage("query_pruning")
+def bench_query_pruning(
+    ctx: BenchContext,
+    top_ns: Tuple[int, ...] = (100, 50, 25),
+    masses: Tuple[float, ...] = (0.95, 0.9, 0.8),
+) -> Dict[str, Dict[str, float]]:
+    """
+    Подрязване на text полето на заявката: латентност и припокриване на top10
+    с неподрязаното търсене.
+    """
+    engine = ctx.engine()
+    queries = ctx.query_tokens() * ctx.repeats
+
+    out = {}
+    for top_n in top_ns:
+        out[f"query_pruning.top_{top_n}"] = pruning_report(engine, queries, QueryPruning(text_top_n=top_n))
+    for mass in masses:
+        out[f"query_pruning.mass_{mass}"] = pruning_report(engine, queries, QueryPruning(text_mass=mass))
+    return out
+
+
+@stage("index_pruning")
+def bench_index_pruning(
+    ctx: BenchContext,
+    settings: Tuple[Tuple[Optional[float], Optional[int]], ...] = ((0.01, None), (0.02, None), (0.04, None), (None, 200)),
+) -> Dict[str, Dict[str, float]]:
+    """
+    Статично подрязване на text векторите: ненулеви тегла, латентност и
+    припокриване на top10 с неподрязания индекс.
+    """
+    docs = ctx.doc_tokens()
+    queries = ctx.query_tokens()
+    text = {d: t for d, (t, _) in docs.items()}
+    legal = {d: l for d, (_, l) in docs.items()}
+
+    def measure(engine: TfidfSearchEngine) -> Tuple[List[List[Tuple[str, float]]], List[float]]:
+        results, times = [], []
+        for _ in range(ctx.repeats):
+            results = []
+            for text_tokens, legal_tokens in queries:
+                t0 = time.perf_counter()
+                results.append(engine.search(text_tokens, legal_tokens, top_k=10))
+                times.append(time.perf_counter() - t0)
+        return results, times
+
+    full = ctx.engine()
+    full_terms = sum(len(v) for v in full.tfidf_docs_text.values())
+    expected, full_times = measure(full)
+    out = {"index_pruning.full": {"text_terms": full_terms, **percentiles(full_times)}}
+
+    for min_weight, max_terms in settings:
+        engine = TfidfSearchEngine()
+        engine.build_index(text, legal, prune_min_relative_weight=min_weight, prune_max_terms=max_terms)
+        got, times = measure(engine)
+        overlap = [len({d for d, _ in e} & {d for d, _ in g}) / max(len(e), 1) for e, g in zip(expected, got)]
+        name = f"w_{min_weight}" if max_terms is None else f"top_{max_terms}"
+        out[f"index_pruning.{name}"] = {
+            "terms_kept": sum(len(v) for v in engine.tfidf_docs_text.values()) / (full_terms or 1),
+            **percentiles(times),
+            "overlap_at_10": sum(overlap) / max(len(overlap), 1),
+            "min_overlap": min(overlap, default=1.0),
+        }
+    return out
+
+
+def _retained(load: Callable[[], object]) -> Tuple[object, float]:
+    """
+    (обект, MB заделена памет, която остава след зареждането)
+    """
+    tracemalloc.start()
+    obj = load()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, current / 2 ** 20
+
+
+@stage("compact")
+def bench_compact(ctx: BenchContext) -> Dict[str, Dict[str, float]]:
+    """
+    Памет и отклонение в подредбата на компактните вектори спрямо dict векторите.
+    """
+    index_dir = ctx.workdir / "compact_index"
+    save_engine(ctx.engine(), index_dir)
+    queries = ctx.query_tokens()
+
+    reference, dict_mb = _retained(lambda: load_json_engine(index_dir))
+    nnz = sum(len(v) for vectors in (reference.tfidf_docs_text, reference.tfidf_docs_legal) for v in vectors.values())
+
+    out = {"compact.dict": {"retained_mb": dict_mb, "bytes_per_weight": dict_mb * 2 ** 20 / max(nnz, 1)}}
+
+    for dtype in QUANTIZATION:
+        CompactTfidfEngine.from_engine(reference, dtype).save(index_dir)
+        compact, compact_mb = _retained(lambda: CompactTfidfEngine.load(index_dir))
+
+        times = []
+        for _ in range(ctx.repeats):
+            for text_tokens, legal_tokens in queries:
+                t0 = time.perf_counter()
+                compact.search(text_tokens, legal_tokens, top_k=10)
+                times.append(time.perf_counter() - t0)
+
+        out[f"compact.{dtype}"] = {
+            "retained_mb": compact_mb,
+            "array_mb": compact.nbytes / 2 ** 20,
+            "bytes_per_weight": compact.nbytes / max(nnz, 1),
+            "queries_per_s": len(times) / (sum(times) or 1e-12),
+            **percentiles(times),
+            **ranking_drift(reference, compact, queries, top_k=10),
+        }
+
+    return out
+
+
+@stage("postings")
+def bench_postings(ctx: BenchContext) -> Dict[str, Dict[str, float]]:
+    """
+    Байтове на posting, зареждане и декодиране на компресираните postings
+    спрямо JSON индекса; отклонение в подредбата от квантизираните impact-и.
+    """
+    index_dir = ctx.workdir / "postings_index"
+    save_engine(ctx.engine(), index_dir)
+    queries = ctx.query_tokens()
+
+    json_bytes = sum((index_dir / name).stat().st_size for name in ("tfidf_docs_text.json", "tfidf_docs_legal.json"))
+    load_s = []
+    for _ in range(ctx.repeats):
+        t0 = time.perf_counter()
+        reference = load_json_engine(index_dir)
+        load_s.append(time.perf_counter() - t0)
+    nnz = sum(len(v) for vectors in (reference.tfidf_docs_text, reference.tfidf_docs_legal) for v in vectors.values())
+
+    out = {
+        "postings.json": {
+            "bytes_per_posting": json_bytes / max(nnz, 1),
+            "load_s": min(load_s),
+            "decode_postings_per_s": nnz / (min(load_s) or 1e-12),
+        }
+    }
+
+    for codec in CODECS:
+        PostingsTfidfEngine.from_engine(reference, codec).save(index_dir)
+        disk_bytes = sum(p.stat().st_size for p in postings_dir(index_dir).iterdir())
+
+        load_s, decode_s = [], []
+        for _ in range(ctx.repeats):
+            t0 = time.perf_counter()
+            engine = PostingsTfidfEngine.load(index_dir, mmap_mode="r")
+            load_s.append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            for field in engine.fields.values():
+                field.decode_all()
+            decode_s.append(time.perf_counter() - t0)
+
+        times = []
+        for _ in range(ctx.repeats):
+            for text_tokens, legal_tokens in queries:
+                t0 = time.perf_counter()
+                engine.search(text_tokens, legal_tokens, top_k=10)
+                times.append(time.perf_counter() - t0)
+
+        out[f"postings.{codec}"] = {
+            "bytes_per_posting": disk_bytes / max(nnz, 1),
+            "array_bytes_per_posting": engine.nbytes / max(nnz, 1),
+            "doc_id_bytes_per_posting": sum(f.docs.nbytes for f in engine.fields.values()) / max(nnz, 1),
+            "load_s": min(load_s),
+            "decode_postings_per_s": nnz / (min(decode_s) or 1e-12),
+            "queries_per_s": len(times) / (sum(times) or 1e-12),
+            **percentiles(times),
+            **ranking_drift(reference, engine, queries, top_k=10),
+        }
+
+    return out
+
+
+# Пуска се в отделен процес: зарежда индекса (или не), fork-ва N worker-а,
+# всеки пуска заявките, и отпечатва сумарния PSS (MB) на всички процеси.
+@stage("metadata_filter")
+def bench_metadata_filter(ctx: BenchContext) -> Dict[str, Dict[str, float]]:
+    """
+    Филтър по метаданни преди оценяването (candidates) срещу филтриране на
+    готовия top-k: латентност и колко от top_k местата остават запълнени.
+    """
+    engine = ctx.engine()
+    queries = ctx.query_tokens()
+    docs = ctx.doc_tokens()
+    top_k = 10
+
+    t0 = time.perf_counter()
+    store = DocumentMetadataStore.from_records(
+        engine.tfidf_docs_text,
+        {doc_id: extract_metadata(text, docs[doc_id][1]) for doc_id, text in ctx.corpus.items()},
+    )
+    build_s = time.perf_counter() - t0
+
+    # най-честият закон и годината по средата – различна селективност
+    years = sorted(int(y) for y in store.years if y)
+    law = max(store.laws, key=lambda l: len(store.documents(MetadataFilter(laws=(l,)))), default="")
+    filters = {
+        "year": MetadataFilter(year_from=years[len(years) // 2], year_to=years[len(years) // 2]),
+        "law": MetadataFilter(laws=(law,)),
+        "year_law": MetadataFilter(year_from=years[len(years) // 2], laws=(law,)),
+    }
+
+    unfiltered = []
+    for _ in range(ctx.repeats):
+        for text_tokens, legal_tokens in queries:
+            t0 = time.perf_counter()
+            engine.search(text_tokens, legal_tokens, top_k=top_k)
+            unfiltered.append(time.perf_counter() - t0)
+
+    out = {
+        "metadata_filter.unfiltered": {
+            "queries_per_s": len(unfiltered) / (sum(unfiltered) or 1e-12),
+            **percentiles(unfiltered),
+            "store_build_ms": build_s * 1000.0,
+        },
+    }
+    for name, f in filters.items():
+        pushdown, postfilter = [], []
+        filled_post, filled_push = [], []
+        selectivity = len(store.documents(f)) / max(len(store), 1)
+        for _ in range(ctx.repeats):
+            for text_tokens, legal_tokens in queries:
+                t0 = time.perf_counter()
+                got = engine.search(text_tokens, legal_tokens, top_k=top_k, candidates=store.documents(f))
+                t1 = time.perf_counter()
+                allowed = store.documents(f)
+                post = [d for d, _ in engine.search(text_tokens, legal_tokens, top_k=top_k) if d in allowed]
+                t2 = time.perf_counter()
+
+                pushdown.append(t1 - t0)
+                postfilter.append(t2 - t1)
+                filled_push.append(len(got) / top_k)
+                filled_post.append(len(post) / top_k)
+
+        n = len(pushdown)
+        out[f"metadata_filter.{name}"] = {
+            "queries_per_s": n / (sum(pushdown) or 1e-12),
+            **percentiles(pushdown),
+            "selectivity": selectivity,
+            "filled": sum(filled_push) / n,
+            "postfilter_ms": 1000.0 * sum(postfilter) / n,
+            "postfilter_filled": sum(filled_post) / n,
+        }
+    return out
+
+
+_SHARED_MEMORY_PROBE = r"""
+import gc, json, os, sys, time
+from pathlib import Path
+from index_store import load_engine, load_json_engine
+
+mode, index_dir, workers, queries_path = sys.argv[1], Path(sys.argv[2]), int(sys.argv[3]), sys.argv[4]
+with open(queries_path, encoding="utf-8") as f:
+    queries = json.load(f)
+
+def pss_kb(pid):
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1])
+    return 0
+
+def load():
+    return load_engine(index_dir, mmap=True) if mode == "preload_mmap" else load_json_engine(index_dir)
+
+engine = load() if mode.startswith("preload") else None
+gc.freeze()
+
+r, w = os.pipe()
+children = []
+for _ in range(workers):
+    pid = os.fork()
+    if pid == 0:
+        e = load() if mode == "per_worker" else engine
+        if e is not None:
+            for t, l in queries:
+                e.search(t, l, top_k=10)
+        os.write(w, b"x")
+        time.sleep(300)
+        os._exit(0)
+    children.append(pid)
+
+for _ in children:
+    os.read(r, 1)
+total = pss_kb(os.getpid()) + sum(pss_kb(p) for p in children)
+for p in children:
+    os.kill(p, 9)
+    os.waitpid(p, 0)
+print(total / 1024)
+"""
+
+
+@stage("shared_memory")
+def bench_shared_memory(ctx: BenchContext, workers: int = 4) -> Dict[str, Dict[str, float]]:
+    """
+    Сумарен PSS на master + N worker-а (Linux): всеки worker зарежда своя JSON индекс,
+    JSON индекс зареден преди fork, и компактен индекс mmap-нат преди fork.
+    index_mb е разликата спрямо същите процеси без индекс.
+    """
+    if not hasattr(os, "fork") or not Path("/proc/self/smaps_rollup").exists():
+        print("[bench] shared_memory needs fork and /proc/<pid>/smaps_rollup; skipped")
+        return {}
+
+    json_dir = ctx.workdir / "shared_json"
+    mmap_dir = ctx.workdir / "shared_mmap"
+    save_engine(ctx.engine(), json_dir)
+    save_engine(ctx.engine(), mmap_dir)
+    CompactTfidfEngine.from_engine(ctx.engine()).save(mmap_dir)
+
+    queries_path = ctx.workdir / "shared_queries.json"
+    queries_path.write_text(json.dumps(ctx.query_tokens(), ensure_ascii=False), encoding="utf-8")
+
+    def probe(mode: str, n: int) -> float:
+        index_dir = mmap_dir if mode == "preload_mmap" else json_dir
+        out = subprocess.run(
+            [sys.executable, "-c", _SHARED_MEMORY_PROBE, mode, str(index_dir), str(n), str(queries_path)],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        )
+        return float(out.stdout.strip().splitlines()[-1])
+
+    empty = {n: probe("empty", n) for n in (1, workers)}
+    out = {}
+    for mode in ("per_worker", "preload_json", "preload_mmap"):
+        one, many = probe(mode, 1), probe(mode, workers)
+        out[f"shared_memory.{mode}"] = {
+            "index_1_worker_mb": one - empty[1],
+            f"index_{workers}_workers_mb": many - empty[workers],
+            f"total_{workers}_workers_mb": many,
+        }
+    return out
+
+
+# Пуска api.py под uvicorn. "eager" зарежда индекса и stemmer-а преди сървърът
+# да отвори порта (както беше при зареждане при import), "lazy" – чрез lifespan-а.
+_STARTUP_PROBE = r"""
+import sys
+from pathlib import Path
+mode, index_dir, port = sys.argv[1], Path(sys.argv[2]), int(sys.argv[3])
+
+import search
+search.HOLDER.index_dir = index_dir
+if mode == "eager":
+    from text_preprocessing import get_stemmer
+    search.HOLDER.ensure_loaded()
+    get_stemmer()
+
+import api, uvicorn
+uvicorn.run(api.app, host="127.0.0.1", port=port, log_level="warning")
+"""
+
+
+def _free_port() -> int:
+    import socket
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url: str, deadline: float) -> float:
+    """
+    perf_counter() на първия 200 отговор
+    """
+    import urllib.error
+    import urllib.request
+
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resp:
+                if resp.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(url)
+
+
+@stage("startup")
+def bench_startup(ctx: BenchContext, timeout_s: float = 120.0) -> Dict[str, Dict[str, float]]:
+    """
+    От стартирането на процеса до първия байт (/healthz) и до готовност (/readyz).
+    """
+    try:
+        import fastapi  # noqa: F401
+        import uvicorn  # noqa: F401
+    except ImportError:
+        print("[bench] startup needs fastapi and uvicorn; skipped")
+        return {}
+
+    index_dir = ctx.workdir / "startup_index"
+    save_engine(ctx.engine(), index_dir)
+    env = dict(os.environ, PYTHONPATH=str(BASE_DIR))
+
+    out = {}
+    for mode in ("eager", "lazy"):
+        ttfb, ready = [], []
+        for _ in range(ctx.repeats):
+            port = _free_port()
+            t0 = time.perf_counter()
+            proc = subprocess.Popen(
+                [sys.executable, "-c", _STARTUP_PROBE, mode, str(index_dir), str(port)],
+                cwd=ctx.workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                deadline = t0 + timeout_s
+                ttfb.append(_wait_for(f"http://127.0.0.1:{port}/healthz", deadline) - t0)
+                ready.append(_wait_for(f"http://127.0.0.1:{port}/readyz", deadline) - t0)
+            finally:
+                proc.kill()
+                proc.wait()
+        out[f"startup.{mode}"] = {"time_to_first_byte_s": min(ttfb), "time_to_ready_s": min(ready)}
+    return out
+
+
+PDF_FONT = Path("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+
+
+def _write_pdf(path: Path, text: str) -> int:
+    """
+    Текст -> PDF с fpdf2 (само за бенчмарка). Връща броя страници.
+    """
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.add_font("DejaVu", fname=str(PDF_FONT))
+    pdf.set_font("DejaVu", size=10)
+    pdf.add_page()
+    pdf.multi_cell(0, 5, text)
+    pdf.output(str(path))
+    return pdf.page_no()
+
+
+def _can_write_pdfs(stage_name: str) -> bool:
+    try:
+        import fpdf  # noqa: F401
+    except ImportError:
+        print(f"[bench] {stage_name} needs fpdf2 to generate PDFs; skipped")
+        return False
+    if not PDF_FONT.exists():
+        print(f"[bench] {stage_name} needs a Cyrillic font at {PDF_FONT}; skipped")
+        return False
+    return True
+
+
+def _corpus_pdfs(ctx: BenchContext, n_docs: int) -> Tuple[Dict[Path, str], int]:
+    """
+    Първите n_docs документа от корпуса като PDF: ({път: изходен текст}, общо страници)
+    """
+    pdf_dir = ctx.workdir / "pdfs"
+    pdf_dir.mkdir(exist_ok=True)
+    sources, pages = {}, 0
+    for doc_id, text in list(ctx.corpus.items())[:n_docs]:
+        path = pdf_dir / f"{doc_id}.pdf"
+        pages += _write_pdf(path, text)
+        sources[path] = text
+    return sources, pages
+
+
+def _token_agreement(extracted: str, source: str) -> Tuple[float, float]:
+    """
+    (дял от думите на източника, които backend-ът е върнал; Jaccard на LEGAL токените)
+    """
+    got, expected = Counter(preprocess(extracted)), Counter(preprocess(source))
+    words = sum((got & expected).values()) / max(sum(expected.values()), 1)
+
+    got_legal = set(extract_domain_entities(re.sub(r"\s+", " ", extracted))[1])
+    expected_legal = set(extract_domain_entities(source)[1])
+    union = got_legal | expected_legal
+    return words, (len(got_legal & expected_legal) / len(union) if union else 1.0)
+
+
+@stage("pdf_extraction")
+def bench_pdf_extraction(ctx: BenchContext, n_docs: int = 30, large_docs: int = 40) -> Dict[str, Dict[str, float]]:
+    """
+    Скорост и съвпадение с изходния текст за всеки инсталиран PDF backend,
+    и последователно срещу паралелно извличане на един голям документ.
+    """
+    if not _can_write_pdfs("pdf_extraction"):
+        return {}
+
+    sources, pages = _corpus_pdfs(ctx, n_docs)
+    large = ctx.workdir / "pdfs" / "large.pdf"
+    large_pages = _write_pdf(large, "\n".join(list(ctx.corpus.values())[:large_docs]))
+
+    out = {}
+    for name in available_backends():
+        times, words, legal = [], [], []
+        for path, source in sources.items():
+            t0 = time.perf_counter()
+            text = extract_text(path, backend=name, workers=1)
+            times.append(time.perf_counter() - t0)
+            w, l = _token_agreement(text, source)
+            words.append(w)
+            legal.append(l)
+
+        total = sum(times) or 1e-12
+        out[f"pdf_extraction.{name}"] = {
+            "docs_per_s": len(times) / total,
+            "pages_per_s": pages / total,
+            **percentiles(times),
+            "word_agreement": sum(words) / len(words),
+            "legal_agreement": sum(legal) / len(legal),
+            "min_legal_agreement": min(legal),
+        }
+
+        extract_text(large, backend=name)  # загрява pool-а
+        t0 = time.perf_counter()
+        sequential = extract_text(large, backend=name, workers=1)
+        t1 = time.perf_counter()
+        parallel = extract_text(large, backend=name, workers=PAGE_WORKERS)
+        t2 = time.perf_counter()
+        out[f"pdf_extraction.{name}.large"] = {
+            "pages": large_pages,
+            "sequential_pages_per_s": large_pages / ((t1 - t0) or 1e-12),
+            "parallel_pages_per_s": large_pages / ((t2 - t1) or 1e-12),
+            "identical": float(sequential == parallel),
+        }
+    return out
+
+
+@stage("decision_tail")
+def bench_decision_tail(ctx: BenchContext, n_docs: int = 30, merged_docs: int = 8) -> Dict[str, Dict[str, float]]:
+    """
+    LEGAL токените от диспозитива: пълно извличане срещу четене от края назад.
+    "merged" са по merged_docs документа в един PDF – по-дълги решения.
+    """
+    if not _can_write_pdfs("decision_tail"):
+        return {}
+
+    sources, _ = _corpus_pdfs(ctx, n_docs)
+    texts = list(ctx.corpus.values())
+    merged = []
+    for i in range(0, min(len(texts), n_docs), merged_docs):
+        path = ctx.workdir / "pdfs" / f"merged_{i}.pdf"
+        _write_pdf(path, "\n".join(texts[i:i + merged_docs]))
+        merged.append(path)
+
+    out = {}
+    for name, paths in (("single", list(sources)), ("merged", merged)):
+        full_times, tail_times = [], []
+        pages_read = pages_total = same = 0
+        for path in paths:
+            t0 = time.perf_counter()
+            full = legal_tokens_from_text(extract_text_from_pdf(path))
+            t1 = time.perf_counter()
+            stats = {}
+            tail = legal_tokens_from_decision(path, stats)
+            t2 = time.perf_counter()
+
+            full_times.append(t1 - t0)
+            tail_times.append(t2 - t1)
+            pages_read += stats["pages_read"]
+            pages_total += get_backend().page_count(path)
+            same += full == tail
+
+        out[f"decision_tail.{name}"] = {
+            "full_docs_per_s": len(paths) / (sum(full_times) or 1e-12),
+            "tail_docs_per_s": len(paths) / (sum(tail_times) or 1e-12),
+            "tail_p50_ms": percentiles(tail_times)["p50_ms"],
+            "pages_read_ratio": pages_read / max(pages_total, 1),
+            "identical": same / len(paths),
+        }
+    return out
+
+
+def run_benchmarks(
+    n_docs: int = 300,
+    n_queries: int = 30,
+    seed: int = 13,
+    repeats: int = 3,
+    stages: Optional[List[str]] = None,
+) -> Dict:
+    corpus = generate_corpus(n_docs, seed=seed)
+    queries = generate_corpus(n_queries, seed=seed + 1, prefix="Query")
+
+    results = {}
+    # етап -> редовете му; празен списък – етапът е пропуснат (липсваща зависимост)
+    stage_rows: Dict[str, List[str]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        ctx = BenchContext(corpus=corpus, queries=queries, workdir=Path(tmp), repeats=repeats)
+        for name in stages or list(STAGES):
+            print(f"[bench] {name} ...", flush=True)
+            rows = STAGES[name](ctx)
+            stage_rows[name] = sorted(rows)
+            results.update(rows)
+
+    return {
+        "meta": {
+            "docs": n_docs,
+            "queries": n_queries,
+            "seed": seed,
+            "repeats": repeats,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "stages": stage_rows,
+        },
+        "stages": results,
+    }
+
+
+def _direction(metric: str) -> int:
+    """
+    +1 по-голямото е по-добро, -1 по-малкото е по-добро, 0 не се сравнява
+    """
+    if metric.endswith("_per_s"):
+        return 1
+    if metric.endswith(("_ms", "_mb")):
+        return -1
+    return 0
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float = DEFAULT_TOLERANCE) -> List[Dict]:
+    regressions = []
+    for stage_name, metrics in baseline.get("stages", {}).items():
+        now = current.get("stages", {}).get(stage_name)
+        if now is None:
+            continue
+        for metric, base_value in metrics.items():
+            direction = _direction(metric)
+            value = now.get(metric)
+            if direction == 0 or value is None or not base_value:
+                continue
+
+            change = (value - base_value) / base_value
+            if -direction * change > tolerance:
+                regressions.append({
+                    "stage": stage_name,
+                    "metric": metric,
+                    "baseline": base_value,
+                    "current": value,
+                    "change": change,
+                })
+    return regressions
+
+
+def missing_rows(current: Dict, baseline: Dict) -> List[str]:
+    """
+    Редове (и метрики) от baseline-а, които това пускане не е дало, за етапите,
+    които е пуснало. Пропуснат етап (липсваща зависимост, празен резултат) е
+    провал, а не "без регресии". Baseline без meta.stages – всичките му редове.
+    """
+    ran = current.get("meta", {}).get("stages", {})
+    base_stages = baseline.get("meta", {}).get("stages")
+    if base_stages is None:
+        required = list(baseline.get("stages", {}))
+    else:
+        required = [row for name, rows in base_stages.items() if name in ran for row in rows]
+
+    missing = []
+    for row in required:
+        now = current.get("stages", {}).get(row)
+        if now is None:
+            missing.append(row)
+            continue
+        missing.extend(f"{row}.{metric}" for metric in baseline["stages"].get(row, {}) if metric not in now)
+    return missing
+
+
+def print_results(results: Dict) -> None:
+    for stage_name, metrics in results["stages"].items():
+        parts = ", ".join(f"{k}={v:.3f}" for k, v in metrics.items())
+        print(f"  {stage_name}: {parts}")
+
+
+def main():
+    import argparse
+
+    p = argparse.ArgumentParser("Reproducible indexing/search benchmarks on a synthetic corpus")
+    p.add_argument("--docs", type=int, default=300)
+    p.add_argument("--queries", type=int, default=30)
+    p.add_argument("--seed", type=int, default=13)
+    p.add_argument("--repeats", type=int, default=3)
+    p.add_argument("--stages", type=str, default="", help=f"Comma-separated subset of: {', '.join(STAGES)}")
+    p.add_argument("--out_json", type=str, default="bench_results.json")
+    p.add_argument("--baseline", type=str, default=str(DEFAULT_BASELINE))
+    p.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    p.add_argument("--save_baseline", action="store_true", help="Overwrite the baseline with this run")
+    p.add_argument("--fail_on_regression", action="store_true")
+    args = p.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()] or None
+    results = run_benchmarks(args.docs, args.queries, args.seed, args.repeats, stages)
+
+    print("\nResults:")
+    print_results(results)
+    skipped = [name for name, rows in results["meta"]["stages"].items() if not rows]
+    if skipped:
+        print(f"Skipped (no rows): {', '.join(skipped)}")
+
+    Path(args.out_json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\nSaved: {args.out_json}")
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Baseline updated: {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        print("No baseline to compare against (use --save_baseline).")
+        return
+
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    if baseline.get("meta", {}).get("docs") != args.docs:
+        print("Warning: baseline was recorded with a different corpus size.")
+
+    missing = missing_rows(results, baseline)
+    if missing:
+        print(f"\nMissing from this run but present in {baseline_path}:")
+        for row in missing:
+            print(f"  {row}")
+
+    regressions = compare(results, baseline, args.tolerance)
+    if not regressions:
+        print(f"No regressions against {baseline_path} (tolerance {args.tolerance:.0%}).")
+        if missing:
+            sys.exit(1)
+        return
+
+    print(f"\nRegressions against {baseline_path}:")
+    for r in regressions:
+        print(
+            f"  {r['stage']}.{r['metric']}: {r['baseline']:.3f} -> {r['current']:.3f} "
+            f"({r['change']:+.1%})"
+        )
+    if missing or args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,662 @@
+# Компактни документни вектори: CSR по документи вместо dict на документ.
+#   index/compact/<field>.terms.json   речник (term id -> term)
+#   index/compact/<field>.indptr.npy   int64, документ i е в [indptr[i], indptr[i+1])
+#   index/compact/<field>.indices.npy  int32 term id-та
+#   index/compact/<field>.data.npy     float32, или uint16/uint8 с мащаб на документ
+#   index/compact/<field>.scales.npy   float32 (само при квантизация)
+#   index/compact/<field>.norms.npy    float32 норми на документите
+#   index/compact/docs.json, idf_*.json
+# index/compact е symlink към index/compact.v-<build_id> (вж. save_dir_atomic).
+# Вместо ~100+ байта на ненулево тегло (boxed float в dict) – 8, 6 или 5 байта.
+from pathlib import Path
+from typing import Callable, Collection, Dict, Iterator, List, Mapping, Optional, Set, Tuple, TypeVar
+import json
+import math
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+from tf_idf_engine import (
+    W_LEGAL,
+    W_TEXT,
+    BatchQuery,
+    QueryNorms,
+    compute_tfidf_vector,
+    split_batch_query,
+    two_stage_search,
+)
+
+T = TypeVar("T")
+
+COMPACT_DIR_NAME = "compact"
+FIELDS = ("text", "legal")
+
+# максимална стойност на квантизираното тегло
+QUANTIZATION = {"float32": None, "uint16": 65535, "uint8": 255}
+
+
+def compact_dir(index_dir: Path) -> Path:
+    return index_dir / COMPACT_DIR_NAME
+
+
+def has_compact(index_dir: Path) -> bool:
+    return (compact_dir(index_dir) / "docs.json").exists()
+
+
+# JSON индексът, от който се строят производните индекси (compact, postings)
+SOURCE_FILES = ("idf_text.json", "idf_legal.json", "tfidf_docs_text.json", "tfidf_docs_legal.json", "doc_norms_text.json")
+BUILD_INFO = "build.json"
+
+
+def source_generation(index_dir: Path) -> Optional[str]:
+    """
+    Размер + mtime на файловете на JSON индекса; None, ако го няма (тогава
+    производният индекс няма с какво да се сравни и се приема за актуален).
+    """
+    if not (index_dir / "tfidf_docs_text.json").exists():
+        return None
+    parts = []
+    for name in SOURCE_FILES:
+        path = index_dir / name
+        if path.exists():
+            st = path.stat()
+            parts.append(f"{name}:{st.st_size:x}:{st.st_mtime_ns:x}")
+    return ";".join(parts)
+
+
+def read_build_info(out_dir: Path) -> dict:
+    path = out_dir / BUILD_INFO
+    if not path.exists():
+        return {}
+    with path.open(encoding="utf-8") as f:
+        return json.load(f)
+
+
+def stale_reason(index_dir: Path, out_dir: Path) -> Optional[str]:
+    """
+    Защо производният индекс в out_dir не съответства на JSON индекса (None – съответства).
+    """
+    return source_mismatch(index_dir, read_build_info(out_dir).get("source"))
+
+
+def source_mismatch(index_dir: Path, built_from: Optional[str]) -> Optional[str]:
+    """
+    Като stale_reason, за отпечатък source_generation, записан другаде (напр. в
+    manifest-а на сегментите).
+    """
+    source = source_generation(index_dir)
+    if source is None:
+        return None
+    if built_from is None:
+        return "no source stamp (built before stamping)"
+    if built_from != source:
+        return "JSON index was rebuilt after it"
+    return None
+
+
+def save_dir_atomic(out_dir: Path, write: Callable[[Path], None], source: Optional[str]) -> None:
+    """
+    write(version_dir) пише целия индекс в нова <out_dir>.v-<build_id>; после
+    out_dir – symlink към текущата версия – се пренасочва с един os.replace.
+    out_dir не липсва нито за миг: зареждане по това време вижда старата или
+    новата версия (вж. load_dir_consistent), никога смесица или празнота.
+    """
+    build_id = uuid.uuid4().hex
+    version_dir = out_dir.with_name(f"{out_dir.name}.v-{build_id[:12]}")
+    version_dir.mkdir(parents=True)
+    try:
+        write(version_dir)
+        _write_json_atomic(version_dir / BUILD_INFO, {"build_id": build_id, "source": source})
+    except BaseException:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+
+    if out_dir.is_dir() and not out_dir.is_symlink():
+        # индекс отпреди symlink-а: директория не се заменя атомарно със symlink,
+        # така че само при тази първа смяна out_dir за кратко липсва
+        os.replace(out_dir, out_dir.with_name(f"{out_dir.name}.v-{uuid.uuid4().hex[:12]}"))
+    tmp_link = out_dir.with_name(f"{out_dir.name}.link-{build_id[:12]}")
+    os.symlink(version_dir.name, tmp_link)
+    os.replace(tmp_link, out_dir)
+
+    # mmap-натите стари файлове остават валидни до затварянето си; зареждане,
+    # започнало върху изтритата версия, се повтаря
+    for old_dir in out_dir.parent.glob(f"{out_dir.name}.v-*"):
+        if old_dir != version_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def load_dir_consistent(in_dir: Path, load: Callable[[], T], attempts: int = 3) -> T:
+    """
+    load() и проверка, че build_id не се е сменил междувременно (save_dir_atomic);
+    иначе – наново. FileNotFoundError означава, че версията, върху която е
+    започнало зареждането, е изтрита след смяната.
+    """
+    for attempt in range(attempts):
+        try:
+            before = read_build_info(in_dir).get("build_id")
+            result = load()
+            if read_build_info(in_dir).get("build_id") == before:
+                return result
+        except FileNotFoundError:
+            if attempt == attempts - 1:
+                raise
+        time.sleep(0.05)
+    raise RuntimeError(f"{in_dir} kept changing while loading")
+
+
+def _write_json_atomic(path: Path, obj) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _save_npy_atomic(path: Path, arr: np.ndarray) -> None:
+    # никога не презаписваме на място – работещ процес може да е mmap-нал стария файл
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as f:
+        np.save(f, arr)
+    os.replace(tmp_path, path)
+
+
+class CompactField:
+    def __init__(
+        self,
+        terms: List[str],
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        data: np.ndarray,
+        scales: Optional[np.ndarray] = None,
+        norms: Optional[np.ndarray] = None,
+    ):
+        self.terms = terms
+        self.term_id = {t: i for i, t in enumerate(terms)}
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.scales = scales
+        self.norms = norms if norms is not None else self._compute_norms()
+
+    def _compute_norms(self) -> np.ndarray:
+        # нормите са от (деквантизираните) съхранени тегла, за да е косинусът консистентен
+        data, indptr, scales = self.data, self.indptr, self.scales
+        sq = data.astype(np.float32) ** 2
+        cs = np.zeros(len(sq) + 1)
+        np.cumsum(sq, out=cs[1:])
+        norms = np.sqrt(cs[indptr[1:]] - cs[indptr[:-1]])
+        if scales is not None:
+            norms *= scales
+        return norms.astype(np.float32)
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.indptr, self.indices, self.data, self.norms)
+        extra = self.scales.nbytes if self.scales is not None else 0
+        return sum(a.nbytes for a in arrays) + extra
+
+    @classmethod
+    def build(
+        cls,
+        doc_ids: List[str],
+        vectors: Mapping[str, Dict[str, float]],
+        dtype: str = "float32",
+        doc_norms: Optional[Mapping[str, float]] = None,
+    ) -> "CompactField":
+        """
+        doc_norms: нормите отпреди статично подрязване (TfidfSearchEngine.doc_norms_text);
+        за липсващите документи нормата се смята от съхранените тегла.
+        """
+        if dtype not in QUANTIZATION:
+            raise ValueError(f"dtype must be one of {sorted(QUANTIZATION)}")
+
+        terms = sorted({t for doc_id in doc_ids for t in vectors.get(doc_id, {})})
+        term_id = {t: i for i, t in enumerate(terms)}
+
+        indptr = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+        for i, doc_id in enumerate(doc_ids):
+            indptr[i + 1] = indptr[i] + len(vectors.get(doc_id, {}))
+
+        nnz = int(indptr[-1])
+        indices = np.empty(nnz, dtype=np.int32)
+        weights = np.empty(nnz, dtype=np.float64)
+        for i, doc_id in enumerate(doc_ids):
+            vec = vectors.get(doc_id, {})
+            s = indptr[i]
+            # сортирани term id-та в документа – по-добра локалност при gather
+            ordered = sorted((term_id[t], w) for t, w in vec.items())
+            indices[s:s + len(ordered)] = [t for t, _ in ordered]
+            weights[s:s + len(ordered)] = [w for _, w in ordered]
+
+        qmax = QUANTIZATION[dtype]
+        if qmax is None:
+            field = cls(terms, indptr, indices, weights.astype(np.float32))
+            return field._with_doc_norms(doc_ids, doc_norms)
+
+        # мащаб на документ: най-голямото тегло -> qmax
+        doc_max = np.zeros(len(doc_ids))
+        nonempty = indptr[1:] > indptr[:-1]
+        doc_max[nonempty] = np.maximum.reduceat(np.abs(weights), indptr[:-1][nonempty]) if nnz else 0.0
+        scales = np.where(doc_max > 0, doc_max / qmax, 1.0).astype(np.float32)
+
+        row_scale = np.repeat(scales, np.diff(indptr))
+        data = np.rint(weights / row_scale).clip(0, qmax).astype(np.dtype(dtype))
+        return cls(terms, indptr, indices, data, scales)._with_doc_norms(doc_ids, doc_norms)
+
+    def _with_doc_norms(self, doc_ids: List[str], doc_norms: Optional[Mapping[str, float]]) -> "CompactField":
+        if doc_norms:
+            for i, doc_id in enumerate(doc_ids):
+                norm = doc_norms.get(doc_id)
+                if norm is not None:
+                    self.norms[i] = norm
+        return self
+
+    def dots(self, q_vec: Dict[str, float]) -> Tuple[np.ndarray, int]:
+        """
+        Скаларно произведение на заявката с всеки документ: (n_docs,) и брой
+        ненулеви приноси. Заявката се разгъва в плътен масив по речника.
+        """
+        q = np.zeros(len(self.terms), dtype=np.float32)
+        for token, w in q_vec.items():
+            tid = self.term_id.get(token)
+            if tid is not None:
+                q[tid] = w
+
+        contrib = q[self.indices] * self.data
+        cs = np.zeros(len(contrib) + 1)
+        np.cumsum(contrib, out=cs[1:])
+        dots = cs[self.indptr[1:]] - cs[self.indptr[:-1]]
+        if self.scales is not None:
+            dots *= self.scales
+        return dots, int(np.count_nonzero(contrib))
+
+    def cosines(self, q_vec: Dict[str, float], q_norm: Optional[float] = None) -> Tuple[np.ndarray, int]:
+        """
+        q_norm: нормата на заявката преди подрязване (None – от q_vec).
+        """
+        if q_norm is None:
+            q_norm = math.sqrt(sum(v ** 2 for v in q_vec.values()))
+        if q_norm == 0:
+            return np.zeros(self.n_docs), 0
+        dots, touched = self.dots(q_vec)
+        out = np.zeros(self.n_docs)
+        np.divide(dots, q_norm * self.norms, out=out, where=self.norms > 0)
+        return out, touched
+
+    def cosines_for(self, q_vec: Dict[str, float], idxs: np.ndarray, q_norm: Optional[float] = None) -> Tuple[np.ndarray, int]:
+        """
+        cosines само за документите idxs: обхождат се само техните редове.
+        """
+        out = np.zeros(len(idxs))
+        if q_norm is None:
+            q_norm = math.sqrt(sum(v ** 2 for v in q_vec.values()))
+        q = sorted((self.term_id[t], w) for t, w in q_vec.items() if t in self.term_id)
+        if q_norm == 0 or not q or not len(idxs):
+            return out, 0
+        q_tids = np.array([t for t, _ in q], dtype=self.indices.dtype)
+        q_w = np.array([w for _, w in q], dtype=np.float64)
+
+        starts, ends = self.indptr[idxs], self.indptr[idxs + 1]
+        lengths = ends - starts
+        owner = np.repeat(np.arange(len(idxs)), lengths)
+        # позициите на всички редове idxs една след друга
+        pos = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+
+        tids = self.indices[pos]
+        loc = np.minimum(np.searchsorted(q_tids, tids), len(q_tids) - 1)
+        hit = q_tids[loc] == tids
+        contrib = q_w[loc[hit]] * self.data[pos[hit]]
+        dots = np.bincount(owner[hit], weights=contrib, minlength=len(idxs)).astype(np.float64, copy=False)
+        if self.scales is not None:
+            dots *= self.scales[idxs]
+
+        norms = self.norms[idxs]
+        np.divide(dots, q_norm * norms, out=out, where=norms > 0)
+        return out, int(hit.sum())
+
+    def doc_vector(self, idx: int) -> Dict[str, float]:
+        s, e = self.indptr[idx], self.indptr[idx + 1]
+        values = self.data[s:e].astype(np.float64)
+        if self.scales is not None:
+            values *= self.scales[idx]
+        return {self.terms[t]: float(w) for t, w in zip(self.indices[s:e].tolist(), values.tolist())}
+
+    def docs_with_any(self, tokens: Collection[str]) -> np.ndarray:
+        """
+        Булева маска на документите, съдържащи някой от токените.
+        """
+        tids = [self.term_id[t] for t in tokens if t in self.term_id]
+        mask = np.zeros(self.n_docs, dtype=bool)
+        if not tids:
+            return mask
+        hits = np.flatnonzero(np.isin(self.indices, tids))
+        mask[np.searchsorted(self.indptr, hits, side="right") - 1] = True
+        return mask
+
+    def save(self, out_dir: Path, field: str) -> None:
+        _write_json_atomic(out_dir / f"{field}.terms.json", self.terms)
+        _save_npy_atomic(out_dir / f"{field}.indptr.npy", self.indptr)
+        _save_npy_atomic(out_dir / f"{field}.indices.npy", self.indices)
+        _save_npy_atomic(out_dir / f"{field}.data.npy", self.data)
+        _save_npy_atomic(out_dir / f"{field}.norms.npy", self.norms)
+        scales_path = out_dir / f"{field}.scales.npy"
+        if self.scales is not None:
+            _save_npy_atomic(scales_path, self.scales)
+        elif scales_path.exists():
+            scales_path.unlink()
+
+    @classmethod
+    def load(cls, in_dir: Path, field: str, mmap_mode: Optional[str] = None) -> "CompactField":
+        with (in_dir / f"{field}.terms.json").open(encoding="utf-8") as f:
+            terms = json.load(f)
+        scales_path = in_dir / f"{field}.scales.npy"
+        return cls(
+            terms,
+            np.load(in_dir / f"{field}.indptr.npy", mmap_mode=mmap_mode),
+            np.load(in_dir / f"{field}.indices.npy", mmap_mode=mmap_mode),
+            np.load(in_dir / f"{field}.data.npy", mmap_mode=mmap_mode),
+            np.load(scales_path, mmap_mode=mmap_mode) if scales_path.exists() else None,
+            np.load(in_dir / f"{field}.norms.npy", mmap_mode=mmap_mode),
+        )
+
+
+class _CompactVectors(Mapping):
+    """
+    Read-only doc_id -> вектор, за код, който очаква engine.tfidf_docs_*.
+    """
+
+    def __init__(self, engine: "CompactTfidfEngine", field: str):
+        self.engine = engine
+        self.field = field
+
+    def __getitem__(self, doc_id: str) -> Dict[str, float]:
+        idx = self.engine.doc_index.get(doc_id)
+        if idx is None:
+            raise KeyError(doc_id)
+        return self.engine.fields[self.field].doc_vector(idx)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.engine.doc_ids)
+
+    def __len__(self) -> int:
+        return len(self.engine.doc_ids)
+
+
+class CompactTfidfEngine:
+    """
+    Същото API за търсене като TfidfSearchEngine върху CompactField масиви.
+    """
+
+    def __init__(
+        self,
+        doc_ids: List[str],
+        idf_text: Dict[str, float],
+        idf_legal: Dict[str, float],
+        fields: Dict[str, CompactField],
+    ):
+        self.doc_ids = doc_ids
+        self.doc_index = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        self.idf_text = idf_text
+        self.idf_legal = idf_legal
+        self.fields = fields
+
+        self.tfidf_docs_text = _CompactVectors(self, "text")
+        self.tfidf_docs_legal = _CompactVectors(self, "legal")
+
+    @classmethod
+    def from_engine(cls, engine, dtype: str = "float32") -> "CompactTfidfEngine":
+        doc_ids = list(engine.tfidf_docs_text.keys())
+        fields = {
+            "text": CompactField.build(doc_ids, engine.tfidf_docs_text, dtype, getattr(engine, "doc_norms_text", None)),
+            "legal": CompactField.build(doc_ids, engine.tfidf_docs_legal, dtype),
+        }
+        return cls(doc_ids, dict(engine.idf_text), dict(engine.idf_legal), fields)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(f.nbytes for f in self.fields.values())
+
+    def save(self, index_dir: Path, source: Optional[str] = None) -> None:
+        """
+        source: source_generation() на JSON индекса, от който е построен
+        engine-ът (по подразбиране – текущият в момента на записа).
+        """
+        def write(out_dir: Path) -> None:
+            for field, compact in self.fields.items():
+                compact.save(out_dir, field)
+            _write_json_atomic(out_dir / "idf_text.json", self.idf_text)
+            _write_json_atomic(out_dir / "idf_legal.json", self.idf_legal)
+            _write_json_atomic(out_dir / "docs.json", self.doc_ids)
+
+        if source is None:
+            source = source_generation(index_dir)
+        save_dir_atomic(compact_dir(index_dir), write, source)
+
+    @classmethod
+    def load(cls, index_dir: Path, mmap_mode: Optional[str] = None) -> "CompactTfidfEngine":
+        return load_dir_consistent(compact_dir(index_dir), lambda: cls._load(index_dir, mmap_mode))
+
+    @classmethod
+    def _load(cls, index_dir: Path, mmap_mode: Optional[str] = None) -> "CompactTfidfEngine":
+        in_dir = compact_dir(index_dir)
+        with (in_dir / "docs.json").open(encoding="utf-8") as f:
+            doc_ids = json.load(f)
+        with (in_dir / "idf_text.json").open(encoding="utf-8") as f:
+            idf_text = json.load(f)
+        with (in_dir / "idf_legal.json").open(encoding="utf-8") as f:
+            idf_legal = json.load(f)
+        fields = {field: CompactField.load(in_dir, field, mmap_mode) for field in FIELDS}
+        return cls(doc_ids, idf_text, idf_legal, fields)
+
+    def vectorize_query(self, text_tokens: List[str], legal_tokens: List[str]) -> Tuple[Dict[str, float], Dict[str, float]]:
+        q_text = compute_tfidf_vector(text_tokens, self.idf_text, is_legal_field=False)
+        q_legal = compute_tfidf_vector(legal_tokens, self.idf_legal, is_legal_field=True)
+        return q_text, q_legal
+
+    def scores(
+        self,
+        query_text_tokens: List[str],
+        query_legal_tokens: List[str],
+        query_norms: QueryNorms = None,
+        idxs: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, int]:
+        """
+        Score-ове на всички документи или, при idxs, само на тези документи
+        (по реда на idxs) – останалите не се оценяват изобщо.
+        """
+        q_text_vec, q_legal_vec = self.vectorize_query(query_text_tokens, query_legal_tokens)
+        q_text_norm, q_legal_norm = query_norms or (None, None)
+        if idxs is None:
+            text_cos, t1 = self.fields["text"].cosines(q_text_vec, q_text_norm)
+            legal_cos, t2 = self.fields["legal"].cosines(q_legal_vec, q_legal_norm)
+        else:
+            text_cos, t1 = self.fields["text"].cosines_for(q_text_vec, idxs, q_text_norm)
+            legal_cos, t2 = self.fields["legal"].cosines_for(q_legal_vec, idxs, q_legal_norm)
+        return W_TEXT * text_cos + W_LEGAL * legal_cos, t1 + t2
+
+    def search(
+        self,
+        query_text_tokens: List[str],
+        query_legal_tokens: List[str],
+        top_k: int = 5,
+        min_score: float = 0.0,
+        stats: Optional[Dict[str, int]] = None,
+        candidates: Optional[Collection[str]] = None,
+        query_norms: QueryNorms = None
+    ) -> List[Tuple[str, float]]:
+        """
+        candidates (cites/метаданни) се оценяват само те: редовете/postings
+        на останалите документи не се обхождат.
+        """
+        if candidates is None:
+            idxs = np.arange(len(self.doc_ids))
+            scores, touched = self.scores(query_text_tokens, query_legal_tokens, query_norms)
+        else:
+            idxs = np.array(sorted(self.doc_index[d] for d in candidates if d in self.doc_index), dtype=np.int64)
+            scores, touched = self.scores(query_text_tokens, query_legal_tokens, query_norms, idxs)
+
+        keep = np.flatnonzero(scores >= min_score)
+        # score desc, после реда на документите – като TfidfSearchEngine.search()
+        best = keep[np.argsort(-scores[keep], kind="stable")[:top_k]]
+
+        if stats is not None:
+            stats["documents_scored"] = len(idxs)
+            stats["postings_touched"] = touched
+
+        return [(self.doc_ids[i], float(scores[j])) for i, j in zip(idxs[best].tolist(), best.tolist())]
+
+    def score_documents(
+        self,
+        q_text_vec: Dict[str, float],
+        q_legal_vec: Dict[str, float],
+        doc_ids: List[str],
+        query_norms: QueryNorms = None
+    ) -> Tuple[np.ndarray, int]:
+        """
+        Вж. TfidfSearchEngine.score_documents.
+        """
+        q_text_norm, q_legal_norm = query_norms or (None, None)
+        known = np.array([doc_id in self.doc_index for doc_id in doc_ids], dtype=bool)
+        idxs = np.array([self.doc_index[d] for d in doc_ids if d in self.doc_index], dtype=np.int64)
+        text_cos, t1 = self.fields["text"].cosines_for(q_text_vec, idxs, q_text_norm)
+        legal_cos, t2 = self.fields["legal"].cosines_for(q_legal_vec, idxs, q_legal_norm)
+        scores = np.zeros(len(doc_ids))
+        scores[known] = W_TEXT * text_cos + W_LEGAL * legal_cos
+        return scores, t1 + t2
+
+    def search_batch(
+        self,
+        queries: List[BatchQuery],
+        top_k: int = 5,
+        min_score: float = 0.0,
+        stats: Optional[Dict[str, int]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        results = []
+        totals = {"documents_scored": 0, "postings_touched": 0}
+        for query in queries:
+            query_text_tokens, query_legal_tokens, query_norms = split_batch_query(query)
+            query_stats = {}
+            results.append(
+                self.search(query_text_tokens, query_legal_tokens, top_k, min_score, query_stats, query_norms=query_norms)
+            )
+            for key in totals:
+                totals[key] += query_stats[key]
+        if stats is not None:
+            stats.update(totals)
+        return results
+
+    def legal_candidates(self, query_legal_tokens: List[str]) -> Optional[Set[str]]:
+        mask = self.fields["legal"].docs_with_any(set(query_legal_tokens))
+        if not mask.any():
+            return None
+        return {self.doc_ids[i] for i in np.flatnonzero(mask).tolist()}
+
+    def search_two_stage(
+        self,
+        query_text_tokens: List[str],
+        query_legal_tokens: List[str],
+        top_k: int = 5,
+        min_score: float = 0.0,
+        stats: Optional[Dict[str, int]] = None,
+        candidates: Optional[Collection[str]] = None,
+        query_norms: QueryNorms = None
+    ) -> List[Tuple[str, float]]:
+        return two_stage_search(
+            self, query_text_tokens, query_legal_tokens, top_k, min_score, stats, candidates, query_norms
+        )
+
+    def field_similarities(
+        self,
+        query_text_tokens: List[str],
+        query_legal_tokens: List[str]
+    ) -> Tuple[List[str], Dict[int, float], Dict[int, float]]:
+        q_text_vec, q_legal_vec = self.vectorize_query(query_text_tokens, query_legal_tokens)
+        out = []
+        for field, q_vec in (("text", q_text_vec), ("legal", q_legal_vec)):
+            cos, _ = self.fields[field].cosines(q_vec)
+            hit = np.flatnonzero(cos)
+            out.append(dict(zip(hit.tolist(), cos[hit].tolist())))
+        return self.doc_ids, out[0], out[1]
+
+
+def kendall_tau(a: List[float], b: List[float]) -> float:
+    """
+    Kendall tau-b между две оценявания на едни и същи елементи.
+    """
+    n = len(a)
+    concordant = discordant = ties_a = ties_b = 0
+    for i in range(n):
+        for j in range(i + 1, n):
+            da = a[i] - a[j]
+            db = b[i] - b[j]
+            if da == 0 and db == 0:
+                continue
+            if da == 0:
+                ties_a += 1
+            elif db == 0:
+                ties_b += 1
+            elif (da > 0) == (db > 0):
+                concordant += 1
+            else:
+                discordant += 1
+
+    denom = math.sqrt((concordant + discordant + ties_a) * (concordant + discordant + ties_b))
+    return (concordant - discordant) / denom if denom else 1.0
+
+
+def ranking_drift(
+    reference,
+    compact: CompactTfidfEngine,
+    queries: List[Tuple[List[str], List[str]]],
+    top_k: int = 10,
+) -> Dict[str, float]:
+    """
+    За всяка заявка: Kendall tau на score-овете на top_k на reference engine-а
+    според двата engine-а, и припокриване на двата top_k списъка.
+    """
+    taus, overlaps = [], []
+    for text_tokens, legal_tokens in queries:
+        expected = reference.search(text_tokens, legal_tokens, top_k=top_k)
+        got = compact.search(text_tokens, legal_tokens, top_k=top_k)
+
+        all_scores, _ = compact.scores(text_tokens, legal_tokens)
+        compact_scores = [float(all_scores[compact.doc_index[d]]) for d, _ in expected]
+        taus.append(kendall_tau([s for _, s in expected], compact_scores))
+
+        overlaps.append(len({d for d, _ in expected} & {d for d, _ in got}) / max(len(expected), 1))
+
+    n = max(len(taus), 1)
+    return {
+        f"kendall_tau_at_{top_k}": sum(taus) / n,
+        "min_kendall_tau": min(taus) if taus else 1.0,
+        f"overlap_at_{top_k}": sum(overlaps) / n,
+    }
+
+
+def main():
+    import argparse
+
+    from index_store import load_json_engine
+    from tf_idf_index_builder import INDEX_DIR
+
+    p = argparse.ArgumentParser("Convert the JSON index into the compact vector store")
+    p.add_argument("--index_dir", type=str, default=str(INDEX_DIR))
+    p.add_argument("--dtype", type=str, default="float32", choices=sorted(QUANTIZATION))
+    args = p.parse_args()
+
+    index_dir = Path(args.index_dir)
+    source = source_generation(index_dir)
+    engine = CompactTfidfEngine.from_engine(load_json_engine(index_dir), args.dtype)
+    engine.save(index_dir, source)
+    print(f"Compact index ({args.dtype}): {len(engine.doc_ids)} documents, {engine.nbytes / 2 ** 20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,14 @@
+import asyncio
+import hashlib
+import json
 import os
-import requests
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 import time
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urljoin, urlparse
+
+import aiohttp
 
 BASE_URL = "https://search-sofia-adms-g.justice.bg/Acts/ActsIndex?page=200"
 PAGES_TO_CRAWL = 5
@@ -17,31 +17,21 @@ CHROMEDRIVER_PATH = (
     r"C:\Users\dimit\Downloads\chromedriver-win64\chromedriver-win64\chromedriver.exe"
 )
 
-os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-
-options = Options()
-options.add_argument("--headless=new")
-options.add_argument("--disable-gpu")
-
-service = Service(CHROMEDRIVER_PATH)
-driver = webdriver.Chrome(service=service, options=options)
-wait = WebDriverWait(driver, 20)
-
-download_dir = os.path.abspath(DOWNLOAD_DIR)
-
-session = requests.Session()
+# паралелни изтегляния общо и минимален интервал между заявки към един host
+CONCURRENCY = 4
+PER_HOST_INTERVAL = 1.5
 
 # Retry стратегия
-retries = Retry(
-    total=5,
-    backoff_factor=1.5,
-    status_forcelist=[429, 500, 502, 503, 504],
-    allowed_methods=["GET"]
-)
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 1.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+REQUEST_TIMEOUT = 30
+
+CHUNK_SIZE = 64 * 1024
+MANIFEST_NAME = "manifest.json"
 
-adapter = HTTPAdapter(max_retries=retries)
-session.mount("https://", adapter)
-session.mount("http://", adapter)
+LINK_TEXT = "Решение"
+NEXT_PAGE_CLASS = "PagedList-skipToNext"
 
 HEADERS = {
     "User-Agent": (
@@ -53,71 +43,380 @@ HEADERS = {
     "Referer": "https://search-sofia-adms-g.justice.bg/Acts/Actsindex"
 }
 
-def download_file(url: str, index: int):
-    try:
-        r = session.get(url, headers=HEADERS, timeout=30)
-        r.raise_for_status()
 
-        cd = r.headers.get("Content-Disposition", "")
-        if "filename=" in cd:
-            base_name = cd.split("filename=")[-1].strip('"; ')
+class DownloadManifest:
+    """
+    url -> {"file", "sha256", "size"} на диска до изтеглените файлове.
+    Позволява продължаване след прекъсване и пропускане на дубликати по съдържание.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self.by_hash: Dict[str, str] = {}
+        self.next_index = 0
+
+        if path.exists():
+            with path.open(encoding="utf-8") as f:
+                data = json.load(f)
+            self.entries = data.get("entries", {})
+            self.next_index = data.get("next_index", len(self.entries))
+            for entry in self.entries.values():
+                if entry.get("file") and not entry.get("duplicate_of"):
+                    self.by_hash.setdefault(entry["sha256"], entry["file"])
+
+    def seen(self, url: str) -> bool:
+        entry = self.entries.get(url)
+        if entry is None:
+            return False
+        # файлът е изтрит ръчно – тегли се отново
+        if entry.get("file") and not entry.get("duplicate_of"):
+            return (self.path.parent / entry["file"]).exists()
+        return True
+
+    def take_index(self) -> int:
+        index = self.next_index
+        self.next_index += 1
+        return index
+
+    def record(self, url: str, filename: str, sha256: str, size: int, duplicate_of: Optional[str] = None) -> None:
+        entry = {"file": filename, "sha256": sha256, "size": size}
+        if duplicate_of:
+            entry["duplicate_of"] = duplicate_of
         else:
-            base_name = f"reshenie_{index}.bin"
+            self.by_hash.setdefault(sha256, filename)
+        self.entries[url] = entry
 
-        name, ext = os.path.splitext(base_name)
-        filename = f"{name}_{index}{ext}"
+    def save(self) -> None:
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump({"next_index": self.next_index, "entries": self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
 
-        path = os.path.join(DOWNLOAD_DIR, filename)
 
-        print("Изтегляне:", filename)
-        with open(path, "wb") as f:
-            f.write(r.content)
+class HostRateLimiter:
+    """
+    Минимален интервал между началата на заявки към един и същи host.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._last: Dict[str, float] = {}
 
-        time.sleep(1.5)
+    async def wait(self, url: str) -> None:
+        host = urlparse(url).netloc
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            delay = self._last.get(host, 0.0) + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._last[host] = time.monotonic()
 
-    except requests.exceptions.RequestException as e:
-        print(f" Пропуснат файл {index}: {e}")
 
-counter = 0
-try:
-    driver.get(BASE_URL)
+def filename_from_disposition(cd: str) -> Optional[str]:
+    for part in cd.split(";"):
+        key, _, value = part.strip().partition("=")
+        if key.lower() == "filename*" and "''" in value:
+            return unquote(value.split("''", 1)[1]).strip('"')
+    if "filename=" in cd:
+        return cd.split("filename=")[-1].strip('"; ')
+    return None
 
-    for page in range(1, PAGES_TO_CRAWL + 1):
-        print(f"\n Страница {page}")
 
-        wait.until(
-            EC.presence_of_element_located(
-                (By.XPATH, "//a[contains(normalize-space(.), 'Решение')]")
-            )
-        )
+class _ListingParser(HTMLParser):
+    """
+    Линковете към решения (<a> с текст "Решение") и линкът към следващата страница.
+    """
 
-        download_urls = [
-            link.get_attribute("href")
-            for link in driver.find_elements(
-                By.XPATH,
-                "//a[contains(normalize-space(.), 'Решение')]"
-            )
-            if link.get_attribute("href")
-        ]
+    def __init__(self):
+        super().__init__()
+        self.links: List[str] = []
+        self.next_page: Optional[str] = None
+        self._href: Optional[str] = None
+        self._text: List[str] = []
+        self._in_next = False
 
-        print(f"Намерени линкове: {len(download_urls)}")
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "li" and NEXT_PAGE_CLASS in (attrs.get("class") or ""):
+            self._in_next = True
+        elif tag == "a":
+            self._href = attrs.get("href")
+            self._text = []
+            if self._in_next and self._href:
+                self.next_page = self._href
 
+    def handle_data(self, data):
+        if self._href is not None:
+            self._text.append(data)
 
-        for url in download_urls:
-            if type(url) == str:
-                download_file(url,counter)
-                counter+=1
+    def handle_endtag(self, tag):
+        if tag == "a" and self._href is not None:
+            if LINK_TEXT in " ".join("".join(self._text).split()):
+                self.links.append(self._href)
+            self._href = None
+        elif tag == "li":
+            self._in_next = False
 
-        if page < PAGES_TO_CRAWL:
-            next_button = wait.until(
+
+class HtmlListingDiscovery:
+    """
+    Обхожда листинга с обикновени HTTP заявки – без браузър.
+    """
+
+    def __init__(self, start_url: str = BASE_URL, max_pages: int = PAGES_TO_CRAWL):
+        self.start_url = start_url
+        self.max_pages = max_pages
+
+    async def pages(self, crawler: "AsyncCrawler") -> AsyncIterator[List[str]]:
+        url = self.start_url
+        for _ in range(self.max_pages):
+            html = await crawler.fetch_text(url)
+            parser = _ListingParser()
+            parser.feed(html)
+
+            yield [urljoin(url, href) for href in parser.links]
+
+            if not parser.next_page:
+                break
+            url = urljoin(url, parser.next_page)
+
+
+class SeleniumListingDiscovery:
+    """
+    Старият начин – Chrome + Selenium; за страници, които рендерират листинга с JS.
+    """
+
+    def __init__(self, start_url: str = BASE_URL, max_pages: int = PAGES_TO_CRAWL, driver_path: str = CHROMEDRIVER_PATH):
+        self.start_url = start_url
+        self.max_pages = max_pages
+        self.driver_path = driver_path
+
+    async def pages(self, crawler: "AsyncCrawler") -> AsyncIterator[List[str]]:
+        from selenium import webdriver
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.chrome.service import Service
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+
+        options = Options()
+        options.add_argument("--headless=new")
+        options.add_argument("--disable-gpu")
+
+        driver = await asyncio.to_thread(webdriver.Chrome, service=Service(self.driver_path), options=options)
+        wait = WebDriverWait(driver, 20)
+        link_xpath = f"//a[contains(normalize-space(.), '{LINK_TEXT}')]"
+
+        def read_page() -> List[str]:
+            wait.until(EC.presence_of_element_located((By.XPATH, link_xpath)))
+            return [
+                link.get_attribute("href")
+                for link in driver.find_elements(By.XPATH, link_xpath)
+                if link.get_attribute("href")
+            ]
+
+        def next_page():
+            wait.until(
                 EC.element_to_be_clickable(
-                    (By.XPATH, "//li[contains(@class,'PagedList-skipToNext')]/a")
+                    (By.XPATH, f"//li[contains(@class,'{NEXT_PAGE_CLASS}')]/a")
                 )
-            )
+            ).click()
+
+        try:
+            await asyncio.to_thread(driver.get, self.start_url)
+            for page in range(1, self.max_pages + 1):
+                yield await asyncio.to_thread(read_page)
+                if page < self.max_pages:
+                    await asyncio.to_thread(next_page)
+        finally:
+            await asyncio.to_thread(driver.quit)
+
+
+class AsyncCrawler:
+    def __init__(
+        self,
+        download_dir: str = DOWNLOAD_DIR,
+        concurrency: int = CONCURRENCY,
+        per_host_interval: float = PER_HOST_INTERVAL,
+        headers: Optional[Dict[str, str]] = None,
+        on_download: Optional[Callable[[Path], Awaitable[None]]] = None,
+    ):
+        self.download_dir = Path(download_dir)
+        self.download_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = DownloadManifest(self.download_dir / MANIFEST_NAME)
+        self.concurrency = concurrency
+        self.limiter = HostRateLimiter(per_host_interval)
+        self.headers = headers or HEADERS
+        self.session: Optional[aiohttp.ClientSession] = None
+        # извиква се за всеки нов файл; ако блокира (пълна опашка), тегленето спира
+        self.on_download = on_download
+
+        self.downloaded = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.failed = 0
+
+    async def _request(self, url: str) -> aiohttp.ClientResponse:
+        """
+        GET с retry/backoff; връща отворен response (викащият го затваря).
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            await self.limiter.wait(url)
+            try:
+                resp = await self.session.get(url, headers=self.headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == MAX_RETRIES:
+                    raise
+                await asyncio.sleep(BACKOFF_FACTOR * 2 ** attempt)
+                continue
+
+            if resp.status in RETRY_STATUSES and attempt < MAX_RETRIES:
+                retry_after = resp.headers.get("Retry-After", "")
+                resp.release()
+                delay = float(retry_after) if retry_after.isdigit() else BACKOFF_FACTOR * 2 ** attempt
+                await asyncio.sleep(delay)
+                continue
+
+            resp.raise_for_status()
+            return resp
+
+        raise RuntimeError("unreachable")
+
+    async def fetch_text(self, url: str) -> str:
+        resp = await self._request(url)
+        async with resp:
+            return await resp.text()
+
+    async def download(self, url: str) -> Optional[Path]:
+        if self.manifest.seen(url):
+            self.skipped += 1
+            return None
+
+        index = self.manifest.take_index()
+        part_path: Optional[Path] = None
+        try:
+            resp = await self._request(url)
+            async with resp:
+                base_name = filename_from_disposition(resp.headers.get("Content-Disposition", "")) \
+                    or f"reshenie_{index}.bin"
+                name, ext = os.path.splitext(os.path.basename(base_name))
+                filename = f"{name}_{index}{ext}"
+
+                path = self.download_dir / filename
+                part_path = path.with_name(path.name + ".part")
+                sha = hashlib.sha256()
+                size = 0
+
+                # стрийминг към диска – файлът никога не е изцяло в паметта
+                with part_path.open("wb") as f:
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        sha.update(chunk)
+                        size += len(chunk)
+                        f.write(chunk)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if part_path is not None:
+                part_path.unlink(missing_ok=True)
+            print(f" Пропуснат файл {index}: {e}")
+            self.failed += 1
+            return None
+        except BaseException:
+            # OSError при запис, отказ/cancel – без недописан .part; _worker брои грешката
+            if part_path is not None:
+                part_path.unlink(missing_ok=True)
+            raise
+
+        digest = sha.hexdigest()
+        existing = self.manifest.by_hash.get(digest)
+        if existing is not None:
+            part_path.unlink(missing_ok=True)
+            self.manifest.record(url, existing, digest, size, duplicate_of=existing)
+            self.duplicates += 1
+            return None
+
+        os.replace(part_path, path)
+        self.manifest.record(url, filename, digest, size)
+        self.downloaded += 1
+        print("Изтегляне:", filename)
+
+        if self.on_download is not None:
+            await self.on_download(path)
+        return path
+
+    async def _worker(self, queue: "asyncio.Queue[Optional[str]]") -> None:
+        while True:
+            url = await queue.get()
+            try:
+                if url is None:
+                    return
+                await self.download(url)
+            except Exception as e:
+                # грешка за един URL (невалиден адрес, запис, on_download) не спира
+                # worker-а – иначе crawl() чака вечно на queue.join()
+                print(f" Неуспешен URL {url}: {type(e).__name__}: {e}")
+                self.failed += 1
+            finally:
+                queue.task_done()
+
+    async def crawl(self, discovery) -> Tuple[int, int, int, int]:
+        """
+        Връща (изтеглени, дубликати, пропуснати като вече видени, неуспешни).
+        """
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=REQUEST_TIMEOUT, sock_connect=REQUEST_TIMEOUT)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+
+        queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(maxsize=self.concurrency * 4)
+
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            self.session = session
+            workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+            try:
+                page = 0
+                async for urls in discovery.pages(self):
+                    page += 1
+                    print(f"\n Страница {page}")
+                    print(f"Намерени линкове: {len(urls)}")
+                    for url in urls:
+                        await queue.put(url)
+                    await queue.join()
+                    self.manifest.save()
+            finally:
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers, return_exceptions=True)
+                self.manifest.save()
+                self.session = None
+
+        return self.downloaded, self.duplicates, self.skipped, self.failed
+
+
+def main():
+    import argparse
+
+    p = argparse.ArgumentParser("Download court decisions")
+    p.add_argument("--start_url", type=str, default=BASE_URL)
+    p.add_argument("--pages", type=int, default=PAGES_TO_CRAWL)
+    p.add_argument("--download_dir", type=str, default=DOWNLOAD_DIR)
+    p.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    p.add_argument("--per_host_interval", type=float, default=PER_HOST_INTERVAL)
+    p.add_argument("--selenium", action="store_true", help="Discover listing pages with a headless Chrome")
+    args = p.parse_args()
+
+    if args.selenium:
+        discovery = SeleniumListingDiscovery(args.start_url, args.pages)
+    else:
+        discovery = HtmlListingDiscovery(args.start_url, args.pages)
+
+    crawler = AsyncCrawler(args.download_dir, args.concurrency, args.per_host_interval)
+    downloaded, duplicates, skipped, failed = asyncio.run(crawler.crawl(discovery))
 
-            next_button.click()
+    print(
+        f"\n Решенията са изтеглени успешно: {downloaded} нови, {duplicates} дубликата, "
+        f"{skipped} вече изтеглени, {failed} неуспешни."
+    )
 
-finally:
-    driver.quit()
 
-print("\n Решенията са изтеглени успешно.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# Метаданни на документите (съд, вид акт, година, цитирани закони) като колони
+# по реда на документите в engine-а:
+#   court / act_type – речник от стойности + int16 код на документ (-1 – неизвестно);
+#   year             – int16 (0 – неизвестна);
+#   laws             – по един битмап (np.packbits, bitorder="little") на закон.
+# Филтърът дава маска върху всички документи с няколко векторни операции и
+# се подава на engine.search(candidates=) – оценяват се само минаващите
+# документи, вместо да се филтрира готовият top-k (и да се губи recall).
+# Записите се извличат при индексиране (text_preprocessing.extract_metadata) и
+# се пишат в index/metadata/<part>.jsonl, по една част на counts файл.
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+import json
+import os
+
+import numpy as np
+
+METADATA_DIR_NAME = "metadata"
+
+
+@dataclass(frozen=True)
+class MetadataFilter:
+    """
+    Празен кортеж / None – без ограничение по този критерий. В рамките на
+    courts и act_types е OR, между критериите и между laws – AND.
+    courts съвпада по подниз ("Пловдив"), act_types – точно, без значение от регистъра.
+    """
+    courts: Tuple[str, ...] = ()
+    act_types: Tuple[str, ...] = ()
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    laws: Tuple[str, ...] = ()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.courts or self.act_types or self.laws) or self.year_from is not None or self.year_to is not None
+
+
+class MetadataWriter:
+    """
+    Един JSON ред на документ; файлът се появява под крайното си име едва при close().
+    """
+
+    def __init__(self, index_dir: Path, part: str):
+        metadata_dir = index_dir / METADATA_DIR_NAME
+        metadata_dir.mkdir(parents=True, exist_ok=True)
+
+        self.path = metadata_dir / f"{part}.jsonl"
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self._f = self.tmp_path.open("w", encoding="utf-8")
+
+    def add(self, doc_id: str, metadata: Mapping[str, object]) -> None:
+        self._f.write(json.dumps({"doc": doc_id, **metadata}, ensure_ascii=False))
+        self._f.write("\n")
+
+    def close(self) -> None:
+        self._f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+            self.tmp_path.unlink(missing_ok=True)
+
+
+def iter_metadata(index_dir: Path) -> Iterator[Tuple[str, dict]]:
+    for path in sorted((index_dir / METADATA_DIR_NAME).glob("*.jsonl")):
+        with path.open(encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    yield row.pop("doc"), row
+
+
+def _dictionary_encode(values: List[Optional[str]]) -> Tuple[List[str], np.ndarray]:
+    dictionary = sorted({v for v in values if v is not None})
+    code = {v: i for i, v in enumerate(dictionary)}
+    codes = np.array([code[v] if v is not None else -1 for v in values], dtype=np.int16)
+    return dictionary, codes
+
+
+class DocumentMetadataStore:
+    def __init__(
+        self,
+        doc_ids: List[str],
+        courts: List[str],
+        court_codes: np.ndarray,
+        act_types: List[str],
+        act_type_codes: np.ndarray,
+        years: np.ndarray,
+        laws: Dict[str, np.ndarray],
+    ):
+        self.doc_ids = doc_ids
+        self.courts = courts
+        self.court_codes = court_codes
+        self.act_types = act_types
+        self.act_type_codes = act_type_codes
+        self.years = years
+        self.laws = laws
+
+    @classmethod
+    def from_records(cls, doc_ids: Iterable[str], records: Mapping[str, dict]) -> "DocumentMetadataStore":
+        """
+        records: doc_id -> изхода на extract_metadata; документите без запис са "неизвестни".
+        """
+        doc_ids = list(doc_ids)
+        rows = [records.get(doc_id, {}) for doc_id in doc_ids]
+
+        courts, court_codes = _dictionary_encode([r.get("court") for r in rows])
+        act_types, act_type_codes = _dictionary_encode([r.get("act_type") for r in rows])
+        years = np.array([r.get("year") or 0 for r in rows], dtype=np.int16)
+
+        law_docs: Dict[str, List[int]] = {}
+        for idx, r in enumerate(rows):
+            for law in r.get("laws", ()):
+                law_docs.setdefault(law.upper(), []).append(idx)
+        laws = {}
+        for law, idxs in law_docs.items():
+            mask = np.zeros(len(doc_ids), dtype=bool)
+            mask[idxs] = True
+            laws[law] = np.packbits(mask, bitorder="little")
+
+        return cls(doc_ids, courts, court_codes, act_types, act_type_codes, years, laws)
+
+    @classmethod
+    def load(cls, index_dir: Path, doc_ids: Iterable[str]) -> "DocumentMetadataStore":
+        """
+        Само документите на engine-а, в неговия ред (дубликатите и изтритите отпадат).
+        При повторен doc_id важи последният запис.
+        """
+        return cls.from_records(doc_ids, dict(iter_metadata(index_dir)))
+
+    @classmethod
+    def from_engine(cls, engine, index_dir: Path) -> "DocumentMetadataStore":
+        return cls.load(index_dir, engine.tfidf_docs_text)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def mask(self, filters: MetadataFilter) -> np.ndarray:
+        """
+        bool маска по реда на doc_ids.
+        """
+        n = len(self.doc_ids)
+        mask = np.ones(n, dtype=bool)
+
+        if filters.courts:
+            needles = [c.casefold() for c in filters.courts]
+            wanted = [i for i, court in enumerate(self.courts) if any(s in court.casefold() for s in needles)]
+            mask &= np.isin(self.court_codes, np.array(wanted, dtype=np.int16))
+
+        if filters.act_types:
+            needles = {a.casefold() for a in filters.act_types}
+            wanted = [i for i, act_type in enumerate(self.act_types) if act_type.casefold() in needles]
+            mask &= np.isin(self.act_type_codes, np.array(wanted, dtype=np.int16))
+
+        if filters.year_from is not None or filters.year_to is not None:
+            known = self.years > 0
+            if filters.year_from is not None:
+                known &= self.years >= filters.year_from
+            if filters.year_to is not None:
+                known &= self.years <= filters.year_to
+            mask &= known
+
+        if filters.laws:
+            bits = None
+            for law in filters.laws:
+                law_bits = self.laws.get(law.strip().upper())
+                if law_bits is None:
+                    return np.zeros(n, dtype=bool)
+                bits = law_bits if bits is None else bits & law_bits
+            mask &= np.unpackbits(bits, count=n, bitorder="little").astype(bool)
+
+        return mask
+
+    def documents(self, filters: MetadataFilter) -> Optional[Set[str]]:
+        """
+        Документите, които минават филтъра; None при празен филтър (без ограничение).
+        """
+        if not filters.enabled:
+            return None
+        doc_ids = self.doc_ids
+        return {doc_ids[i] for i in np.flatnonzero(self.mask(filters)).tolist()}
@@ -0,0 +1,270 @@
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+import os
+import time
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+
+# решенията не се променят след публикуване; ETag покрива пре-свалянията
+CACHE_CONTROL = "public, max-age=86400"
+CHUNK_SIZE = 64 * 1024
+
+# колко често най-много да сканираме папката при непознато име
+MANIFEST_REFRESH_INTERVAL = 30.0
+
+
+@dataclass(frozen=True)
+class DocumentEntry:
+    name: str
+    path: str
+    size: int
+    mtime: float
+    etag: str
+    last_modified: str
+
+
+class DocumentManifest:
+    """
+    filename -> DocumentEntry, построен с едно сканиране на папката.
+    Заявките се разрешават само срещу имена от манифеста, така че
+    "../" и подобни никога не стигат до файловата система.
+    """
+
+    def __init__(self, documents_dir: Path, suffix: str = ".pdf"):
+        self.documents_dir = Path(documents_dir)
+        self.suffix = suffix
+        self.entries: Dict[str, DocumentEntry] = {}
+        self._refreshed_at = 0.0
+
+    @staticmethod
+    def _entry(name: str, path: str, st: os.stat_result) -> DocumentEntry:
+        return DocumentEntry(
+            name=name,
+            path=path,
+            size=st.st_size,
+            mtime=st.st_mtime,
+            etag=f'"{st.st_size:x}-{st.st_mtime_ns:x}"',
+            last_modified=formatdate(st.st_mtime, usegmt=True),
+        )
+
+    def refresh(self) -> int:
+        entries = {}
+        if self.documents_dir.is_dir():
+            with os.scandir(self.documents_dir) as it:
+                for de in it:
+                    if not de.name.lower().endswith(self.suffix) or not de.is_file():
+                        continue
+                    entries[de.name] = self._entry(de.name, de.path, de.stat())
+
+        # подменяме целия речник наведнъж
+        self.entries = entries
+        self._refreshed_at = time.monotonic()
+        return len(entries)
+
+    def resolve(self, filename: str) -> Optional[DocumentEntry]:
+        entry = self.entries.get(filename)
+        if entry is not None:
+            return self._revalidate(entry)
+
+        # нов файл (напр. от crawler-а) – пресканираме, но не при всяка заявка
+        if time.monotonic() - self._refreshed_at >= MANIFEST_REFRESH_INTERVAL:
+            self.refresh()
+            return self.entries.get(filename)
+
+        return None
+
+
+    def _revalidate(self, entry: DocumentEntry) -> Optional[DocumentEntry]:
+        """
+        Един stat на заявка: подменен файл (друг размер/mtime) получава нов
+        ETag/Last-Modified/Content-Length, изтрит – 404.
+        """
+        try:
+            st = os.stat(entry.path)
+        except FileNotFoundError:
+            self.entries.pop(entry.name, None)
+            return None
+
+        if st.st_size == entry.size and st.st_mtime == entry.mtime:
+            return entry
+        fresh = self._entry(entry.name, entry.path, st)
+        self.entries[entry.name] = fresh
+        return fresh
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # weak comparison (RFC 9110 13.1.2)
+    bare = etag.removeprefix("W/")
+    for candidate in header.split(","):
+        if candidate.strip().removeprefix("W/") == bare:
+            return True
+    return False
+
+
+def is_not_modified(request: Request, entry: DocumentEntry) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, entry.etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(entry.mtime) <= since
+
+    return False
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    "bytes=a-b" -> (start, end) включително.
+    Връща None при няколко диапазона или невалиден (a > b) – тогава връщаме
+    целия файл (RFC 9110 14.2); RangeNotSatisfiable при a >= size и при всеки
+    диапазон върху празен файл (няма последен байт, който да се върне).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    if "," in spec:
+        return None
+
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+
+    try:
+        if first == "":
+            # suffix range: последните N байта
+            length = int(last)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+
+    if start > end:
+        # невалиден диапазон се игнорира; при "a-" end е size - 1 и това е 416
+        if last:
+            return None
+        raise RangeNotSatisfiable()
+    if start >= size:
+        raise RangeNotSatisfiable()
+
+    return start, min(end, size - 1)
+
+
+def _content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+class PdfFileResponse(Response):
+    """
+    Отговор за (част от) файл, четен на парчета по CHUNK_SIZE. Zero-copy
+    (sendfile) не се ползва: uvicorn не предлага http.response.zerocopysend.
+    """
+
+    media_type = "application/pdf"
+
+    def __init__(
+        self,
+        entry: DocumentEntry,
+        *,
+        start: int = 0,
+        end: Optional[int] = None,
+        status_code: int = 200,
+        headers: Optional[Dict[str, str]] = None,
+        send_body: bool = True,
+    ):
+        self.path = entry.path
+        self.start = start
+        self.end = entry.size - 1 if end is None else end
+        self.send_body = send_body
+
+        all_headers = dict(headers or {})
+        all_headers["content-length"] = str(max(self.end - self.start + 1, 0))
+        super().__init__(status_code=status_code, headers=all_headers)
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+
+        count = self.end - self.start + 1
+        if not self.send_body or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            remaining = count
+            async with await anyio.open_file(self.path, "rb") as f:
+                await f.seek(self.start)
+                while remaining > 0:
+                    chunk = await f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": remaining > 0,
+                    })
+            if remaining > 0:
+                # файлът е скъсен междувременно – затваряме отговора
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+        if self.background is not None:
+            await self.background()
+
+
+def document_response(request: Request, entry: DocumentEntry) -> Response:
+    headers = {
+        "etag": entry.etag,
+        "last-modified": entry.last_modified,
+        "cache-control": CACHE_CONTROL,
+        "accept-ranges": "bytes",
+    }
+
+    if is_not_modified(request, entry):
+        return Response(status_code=304, headers=headers)
+
+    headers["content-disposition"] = _content_disposition(entry.name)
+    send_body = request.method != "HEAD"
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() in (entry.etag, entry.last_modified)):
+        try:
+            byte_range = parse_range(range_header, entry.size)
+        except RangeNotSatisfiable:
+            return Response(
+                status_code=416,
+                headers={"content-range": f"bytes */{entry.size}", "accept-ranges": "bytes"},
+            )
+
+        if byte_range is not None:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{entry.size}"
+            return PdfFileResponse(
+                entry, start=start, end=end, status_code=206, headers=headers, send_body=send_body
+            )
+
+    return PdfFileResponse(entry, headers=headers, send_body=send_body)
@@ -150,7 +150,11 @@ def is_any_abbreviation(text: str, i: int) -> int:
 
 
 # MAIN PARSER
-def extract_domain_entities(text):
+def extract_domain_entities(text, spans=None):
+    """
+    Ако е подаден списък spans, в него се добавя (start, end, tokens) за всяка
+    намерена препратка – позиции в текста със свити whitespace-и.
+    """
     startTrie = constructTrie(terminalStrings)
 
     references_count = 0
@@ -192,12 +196,16 @@ def extract_domain_entities(text):
                             references_count+=1
                             law_reference = text[k:end_abbreviation_idx]
 
-                            tokens.extend(extract_reference_tokens(
+                            reference_tokens = extract_reference_tokens(
                                 text,
                                 start_idx,
                                 k,
                                 law_reference
-                            ))
+                            )
+                            tokens.extend(reference_tokens)
+
+                            if spans is not None:
+                                spans.append((start_idx, end_abbreviation_idx, reference_tokens))
 
                             # remove law reference from text
                             mask_start = start_idx
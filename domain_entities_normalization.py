@@ -1,7 +1,8 @@
 from pathlib import Path
-import PyPDF2
 import re
 
+from pdf_extraction import extract_text
+
 PDF_DIR = Path("Data/Documents")
 SEARCH_WINDOW = 60
 
@@ -43,14 +44,7 @@ SectionEntity.add_child(SubSectionEntity)
 
 
 def extract_text_from_pdf(pdf_path: Path) -> str:
-    chunks = []
-    with open(pdf_path, "rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        for page in reader.pages:
-            t = page.extract_text()
-            if t:
-                chunks.append(t)
-    return " ".join(chunks)
+    return extract_text(pdf_path, sep=" ")
 
 def is_abbreviation(text: str, i: int) -> int:
     n = len(text)
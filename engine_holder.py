@@ -0,0 +1,243 @@
+# Текущата версия на индекса (engine + snippets) зад една референция.
+# Читателите взимат holder.current веднъж в началото на заявката и работят
+# само с нея; reload зарежда новата версия встрани, валидира я и сменя
+# референцията с едно присвояване. Старата версия (и mmap-натите ѝ файлове)
+# се освобождава, когато последната заявка, която я държи, приключи.
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import math
+import os
+import threading
+import time
+
+from index_store import load_engine
+from near_duplicates import load_duplicates
+from snippets import SnippetStore
+
+# нова версия с по-малко от толкова дял от документите на текущата се отхвърля
+MAX_SHRINK = 0.5
+
+# /admin/reload стига само до един процес; той увеличава generation в този файл,
+# а всеки процес (gunicorn worker) го проверява на RELOAD_POLL_SECONDS и се презарежда
+RELOAD_REQUEST_FILE = "reload_request.json"
+RELOAD_POLL_SECONDS = 2.0
+
+
+class IndexValidationError(Exception):
+    pass
+
+
+@dataclass
+class IndexVersion:
+    engine: object
+    snippets: SnippetStore
+    version: int
+    loaded_at: float
+    load_seconds: float
+    # представител -> почти еднаквите документи, които не са индексирани отделно
+    duplicates: Dict[str, List[str]] = field(default_factory=dict, repr=False)
+    # производни структури, които search.py строи мързеливо за тази версия
+    cache: Dict[str, object] = field(default_factory=dict, repr=False)
+
+    @property
+    def documents(self) -> int:
+        return len(self.engine.tfidf_docs_text)
+
+
+def validate_engine(engine, previous: Optional[IndexVersion] = None, max_shrink: float = MAX_SHRINK) -> None:
+    """
+    IndexValidationError, ако индексът е празен, рязко по-малък от текущия
+    или не може да отговори на пробна заявка.
+    """
+    n_docs = len(engine.tfidf_docs_text)
+    if n_docs == 0:
+        raise IndexValidationError("index has no documents")
+    if not engine.idf_text:
+        raise IndexValidationError("index has no text vocabulary")
+
+    if previous is not None and n_docs < previous.documents * (1.0 - max_shrink):
+        raise IndexValidationError(
+            f"index shrank from {previous.documents} to {n_docs} documents"
+        )
+
+    # пробна заявка от термините на първия документ
+    doc_id = next(iter(engine.tfidf_docs_text))
+    text_tokens = list(engine.tfidf_docs_text[doc_id])[:20]
+    legal_tokens = list(engine.tfidf_docs_legal.get(doc_id, {}))[:5]
+    results = engine.search(text_tokens, legal_tokens, top_k=1)
+    if len(results) != 1 or not math.isfinite(results[0][1]):
+        raise IndexValidationError(f"probe query returned {results!r}")
+
+
+class EngineHolder:
+    def __init__(self, index_dir: Path, loader: Callable[[Path], object] = load_engine):
+        self.index_dir = index_dir
+        self.loader = loader
+        self._current: Optional[IndexVersion] = None
+        # сериализира само reload-ите; четенето на current е без lock
+        self._reload_lock = threading.Lock()
+        self._reload_thread: Optional[threading.Thread] = None
+        self._watch_thread: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+        # generation на reload_request.json, която текущата версия вече отразява
+        self.reload_generation = 0
+
+    @property
+    def current(self) -> IndexVersion:
+        current = self._current
+        if current is None:
+            raise RuntimeError("index is not loaded")
+        return current
+
+    @property
+    def engine(self):
+        return self.current.engine
+
+    @property
+    def loaded(self) -> bool:
+        return self._current is not None
+
+    def reload(self, force: bool = False) -> IndexVersion:
+        """
+        Зарежда, валидира и публикува нова версия. При грешка текущата остава.
+        force=True пропуска проверката за рязко свиване на индекса.
+        """
+        with self._reload_lock:
+            return self._reload_locked(force)
+
+    def ensure_loaded(self) -> IndexVersion:
+        """
+        Текущата версия; първото извикване зарежда индекса (едновременните чакат него).
+        """
+        current = self._current
+        if current is not None:
+            return current
+        with self._reload_lock:
+            if self._current is not None:
+                return self._current
+            return self._reload_locked(force=False)
+
+    def _reload_locked(self, force: bool) -> IndexVersion:
+        previous = self._current
+        t0 = time.perf_counter()
+        # преди зареждането: заявка, дошла по време на него, ще мине отново
+        generation = self.requested_generation()[0]
+        try:
+            engine = self.loader(self.index_dir)
+            validate_engine(engine, None if force else previous)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            raise
+
+        version = IndexVersion(
+            engine=engine,
+            snippets=SnippetStore(self.index_dir),
+            version=(previous.version + 1) if previous else 1,
+            loaded_at=time.time(),
+            load_seconds=time.perf_counter() - t0,
+            duplicates=load_duplicates(self.index_dir),
+        )
+        self._current = version
+        self.last_error = None
+        self.reload_generation = max(self.reload_generation, generation)
+        return version
+
+    @property
+    def reload_request_path(self) -> Path:
+        return self.index_dir / RELOAD_REQUEST_FILE
+
+    def requested_generation(self) -> Tuple[int, bool]:
+        """
+        (generation, force) от reload_request.json; (0, False), ако няма файл.
+        """
+        try:
+            with self.reload_request_path.open(encoding="utf-8") as f:
+                request = json.load(f)
+        except (OSError, ValueError):
+            return 0, False
+        return int(request.get("generation", 0)), bool(request.get("force", False))
+
+    def request_reload(self, force: bool = False) -> int:
+        """
+        Обявява reload за всички процеси, които следят файла (watch_reload_requests).
+        Връща новата generation; самият този процес тя не презарежда.
+        """
+        generation = max(self.requested_generation()[0], self.reload_generation) + 1
+        tmp_path = self.reload_request_path.with_name(f"{RELOAD_REQUEST_FILE}.{os.getpid()}.tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "force": force, "requested_at": time.time()}, f)
+        os.replace(tmp_path, self.reload_request_path)
+        return generation
+
+    def check_reload_request(self) -> bool:
+        """
+        Презарежда, ако файлът обявява generation, по-нова от текущата.
+        При неуспех generation-ът се отбелязва като видян – грешката е в last_error.
+        """
+        generation, force = self.requested_generation()
+        if generation <= self.reload_generation:
+            return False
+        with self._reload_lock:
+            if generation <= self.reload_generation:
+                return False
+            try:
+                self._reload_locked(force)
+            except Exception:
+                pass
+            self.reload_generation = max(self.reload_generation, generation)
+        return True
+
+    def watch_reload_requests(self, interval: float = RELOAD_POLL_SECONDS) -> None:
+        """
+        Фонова нишка за check_reload_request; по една на процес (нишките не
+        преживяват fork, затова се пуска в lifespan-а на всеки worker).
+        """
+        if self._watch_thread is not None and self._watch_thread.is_alive():
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                if self._current is not None:
+                    self.check_reload_request()
+
+        self._watch_thread = threading.Thread(target=run, name="index-reload-watch", daemon=True)
+        self._watch_thread.start()
+
+    def reload_in_background(self, force: bool = False) -> bool:
+        """
+        False, ако вече тече reload.
+        """
+        if self._reload_lock.locked():
+            return False
+
+        def run():
+            try:
+                self.reload(force)
+            except Exception:
+                pass  # грешката е в last_error; текущата версия продължава да обслужва
+
+        self._reload_thread = threading.Thread(target=run, name="index-reload", daemon=True)
+        self._reload_thread.start()
+        return True
+
+    @property
+    def reloading(self) -> bool:
+        return self._reload_lock.locked()
+
+    def status(self) -> Dict[str, object]:
+        current = self._current
+        return {
+            "loaded": current is not None,
+            "version": current.version if current else None,
+            "documents": current.documents if current else 0,
+            "collapsed_duplicates": sum(len(d) for d in current.duplicates.values()) if current else 0,
+            "loaded_at": current.loaded_at if current else None,
+            "load_seconds": current.load_seconds if current else None,
+            "engine": type(current.engine).__name__ if current else None,
+            "reloading": self.reloading,
+            "reload_generation": self.reload_generation,
+            "last_error": self.last_error,
+        }
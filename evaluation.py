@@ -1,16 +1,19 @@
 from __future__ import annotations
 
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Set, Tuple
+from typing import List, Dict, Optional, Set, Tuple
+import os
 import re
 import math
 import json
+import hashlib
 import statistics
 
-from search import tf_idf_search
 from domain_entities_normalization import extract_text_from_pdf
 from domain_entities_extraction import extract_domain_entities
+from pdf_extraction import iter_pages_reversed
 
 
 DECISION_RE = re.compile(r"р\s*е\s*ш\s*и\s*:", re.IGNORECASE)
@@ -23,8 +26,7 @@ def extract_decision_part(full_text: str) -> str:
     return full_text[m.end():].strip()
 
 
-def legal_tokens_from_decision(pdf_path: Path) -> Set[str]:
-    full_text = extract_text_from_pdf(pdf_path)
+def legal_tokens_from_text(full_text: str) -> Set[str]:
     full_text = re.sub(r"\s+", " ", full_text)
 
     decision = extract_decision_part(full_text)
@@ -35,6 +37,38 @@ def legal_tokens_from_decision(pdf_path: Path) -> Set[str]:
     return {t for t in legal_tokens if t.startswith("LEGAL:")}
 
 
+def decision_text(pdf_path: Path, stats: Optional[dict] = None) -> str:
+    """
+    extract_decision_part върху целия документ, но страниците се четат от края
+    назад и четенето спира при първото (т.е. последното) "р е ш и :". Без маркер
+    се стига до първата страница – същото като пълното извличане.
+    """
+    pages = []
+    decision = ""
+    for page in iter_pages_reversed(pdf_path):
+        if stats is not None:
+            stats["pages_read"] = stats.get("pages_read", 0) + 1
+        if not page:
+            continue
+        pages.append(page)
+        # същото съединяване като extract_text_from_pdf; маркерът може да е на
+        # границата между две страници
+        tail = re.sub(r"\s+", " ", " ".join(reversed(pages)))
+        if DECISION_RE.search(tail):
+            decision = extract_decision_part(tail)
+            break
+    return decision
+
+
+def legal_tokens_from_decision(pdf_path: Path, stats: Optional[dict] = None) -> Set[str]:
+    decision = decision_text(pdf_path, stats)
+    if not decision:
+        return set()
+
+    _, legal_tokens = extract_domain_entities(decision)
+    return {t for t in legal_tokens if t.startswith("LEGAL:")}
+
+
 def jaccard(a: Set[str], b: Set[str]) -> float:
     if not a and not b:
         return 1.0
@@ -85,10 +119,14 @@ def evaluate_folder(
     if not query_files:
         raise RuntimeError(f"No PDFs found in {queries_dir}")
 
+    # индексът се зарежда само тук, не и във worker процесите за парсване
+    from search import HOLDER, QUERY_PRUNING, tf_idf_search
+
+    HOLDER.ensure_loaded()
     for qpath in query_files:
         q_legal = legal_tokens_from_decision(qpath)
 
-        retrieved = tf_idf_search(qpath, top_k=top_k)
+        retrieved = tf_idf_search(qpath, top_k=top_k, pruning=QUERY_PRUNING["evaluation"])
 
         best_doc = ""
         best_tfidf = 0.0
@@ -133,6 +171,218 @@ def evaluate_folder(
     return results
 
 
+DEFAULT_CACHE_PATH = Path("Data/evaluation_cache.json")
+
+# вдига се при промяна на формата на записите в кеша
+CACHE_VERSION = 2
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# кодът и данните, от които зависят токените в кеша
+PIPELINE_FILES = [
+    BASE_DIR / "text_preprocessing.py",
+    BASE_DIR / "domain_entities_extraction.py",
+    BASE_DIR / "domain_entities_normalization.py",
+    BASE_DIR / "pdf_extraction.py",
+    BASE_DIR / "evaluation.py",
+    BASE_DIR / "Data" / "stopwords.json",
+    BASE_DIR / "stemmer" / "stem_rules_context_1.txt",
+]
+
+
+def pipeline_fingerprint() -> str:
+    """
+    CACHE_VERSION + sha1 на PIPELINE_FILES: всяка промяна в preprocessing-а,
+    stemmer правилата или екстракцията обезсилва целия кеш.
+    """
+    h = hashlib.sha1(f"v{CACHE_VERSION}".encode())
+    for path in PIPELINE_FILES:
+        h.update(path.name.encode())
+        h.update(path.read_bytes() if path.exists() else b"")
+    return h.hexdigest()
+
+
+class EvaluationCache:
+    """
+    Мемоизирани резултати от парсване на PDF, ключ: име + размер + mtime, при
+    същия pipeline_fingerprint() (иначе кешът се изхвърля при зареждане).
+    "decision" – LEGAL токените от диспозитива на документ от корпуса;
+    "query" – (text_tokens, legal_tokens, decision tokens) на заявка.
+    """
+
+    def __init__(self, path: Optional[Path] = DEFAULT_CACHE_PATH):
+        self.path = path
+        self.fingerprint = pipeline_fingerprint()
+        self.data: Dict[str, object] = {"fingerprint": self.fingerprint, "decision": {}, "query": {}}
+        self.dirty = False
+        if path is not None and path.exists():
+            with path.open(encoding="utf-8") as f:
+                loaded = json.load(f)
+            if loaded.get("fingerprint") == self.fingerprint:
+                for section in ("decision", "query"):
+                    self.data[section].update(loaded.get(section, {}))
+
+    @staticmethod
+    def _stamp(pdf_path: Path) -> List[int]:
+        st = pdf_path.stat()
+        return [st.st_size, st.st_mtime_ns]
+
+    def get(self, section: str, pdf_path: Path):
+        entry = self.data[section].get(pdf_path.name)
+        if entry is None or entry["stamp"] != self._stamp(pdf_path):
+            return None
+        return entry["value"]
+
+    def put(self, section: str, pdf_path: Path, value) -> None:
+        self.data[section][pdf_path.name] = {"stamp": self._stamp(pdf_path), "value": value}
+        self.dirty = True
+
+    def save(self) -> None:
+        if self.path is None or not self.dirty:
+            return
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+def _decision_worker(pdf_path: Path) -> List[str]:
+    return sorted(legal_tokens_from_decision(pdf_path))
+
+
+def _query_worker(pdf_path: Path) -> dict:
+    # един parse на PDF-а и за заявката, и за диспозитива ѝ
+    from text_preprocessing import process_text_document
+
+    raw_text = extract_text_from_pdf(pdf_path)
+    doc = process_text_document(raw_text)
+    return {
+        "text_tokens": doc.text_tokens,
+        "legal_tokens": doc.legal_tokens,
+        "decision": sorted(legal_tokens_from_text(raw_text)),
+    }
+
+
+def _cached_map(
+    cache: EvaluationCache,
+    section: str,
+    paths: List[Path],
+    worker,
+    pool: Optional[ProcessPoolExecutor],
+) -> Dict[str, object]:
+    out = {}
+    missing = []
+    for path in paths:
+        value = cache.get(section, path)
+        if value is None:
+            missing.append(path)
+        else:
+            out[path.name] = value
+
+    if missing:
+        values = pool.map(worker, missing, chunksize=4) if pool is not None else map(worker, missing)
+        for path, value in zip(missing, values):
+            cache.put(section, path, value)
+            out[path.name] = value
+
+    return out
+
+
+def evaluate_folder_parallel(
+    queries_dir: Path,
+    documents_dir: Path = Path("Data/Documents"),
+    top_k: int = 10,
+    use_weighted: bool = True,
+    workers: Optional[int] = None,
+    cache_path: Optional[Path] = DEFAULT_CACHE_PATH,
+    engine=None,
+) -> List[QueryEval]:
+    """
+    Като evaluate_folder, но:
+      - всеки PDF се парсва най-много веднъж (и се пази в кеша между пусканията);
+      - парсването на заявки и документи върви в process pool;
+      - оценяването е едно search_batch извикване за всички заявки.
+    engine: None – текущият индекс (search.HOLDER).
+    """
+    from query_pruning import prune_query_tokens
+    from search import HOLDER, QUERY_PRUNING
+
+    query_files = sorted(list(queries_dir.glob("*.pdf")))
+    if not query_files:
+        raise RuntimeError(f"No PDFs found in {queries_dir}")
+
+    cache = EvaluationCache(cache_path)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        queries = _cached_map(cache, "query", query_files, _query_worker, pool)
+
+        engine = engine or HOLDER.ensure_loaded().engine
+        retrieved_all = engine.search_batch(
+            [
+                prune_query_tokens(
+                    engine, queries[q.name]["text_tokens"], queries[q.name]["legal_tokens"], QUERY_PRUNING["evaluation"]
+                )
+                for q in query_files
+            ],
+            top_k=top_k,
+        )
+
+        doc_paths = sorted({
+            documents_dir / doc_id
+            for retrieved in retrieved_all
+            for doc_id, _ in retrieved
+            if (documents_dir / doc_id).exists()
+        })
+        decisions = _cached_map(cache, "decision", doc_paths, _decision_worker, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        cache.save()
+
+    results: List[QueryEval] = []
+    for qpath, retrieved in zip(query_files, retrieved_all):
+        q_legal = set(queries[qpath.name]["decision"])
+
+        best_doc = ""
+        best_tfidf = 0.0
+        best_j = -1.0
+        best_wj = -1.0
+        best_doc_legal_count = 0
+
+        for doc_id, tfidf_score in retrieved:
+            if doc_id not in decisions:
+                continue
+
+            d_legal = set(decisions[doc_id])
+
+            j = jaccard(q_legal, d_legal)
+            wj = weighted_jaccard(q_legal, d_legal)
+
+            metric = wj if use_weighted else j
+            best_metric = best_wj if use_weighted else best_j
+
+            if metric > best_metric:
+                best_doc = doc_id
+                best_tfidf = float(tfidf_score)
+                best_j = j
+                best_wj = wj
+                best_doc_legal_count = len(d_legal)
+
+        results.append(
+            QueryEval(
+                query_doc=qpath.name,
+                best_match_doc=best_doc,
+                best_tfidf_score=best_tfidf,
+                best_jaccard=max(best_j, 0.0),
+                best_weighted_jaccard=max(best_wj, 0.0),
+                query_legal_count=len(q_legal),
+                best_match_legal_count=best_doc_legal_count,
+            )
+        )
+
+    return results
+
+
 def summarize(results: List[QueryEval], use_weighted=True) -> Dict:
     scores = [
         (r.best_weighted_jaccard if use_weighted else r.best_jaccard)
@@ -147,6 +397,145 @@ def summarize(results: List[QueryEval], use_weighted=True) -> Dict:
     return summary
 
 
+def run_sweep_mode(args, queries_dir: Path, documents_dir: Path) -> None:
+    import time
+    from search import HOLDER
+    from weight_sweep import build_components, parse_grid, print_sweep, run_sweep, save_sweep
+
+    t0 = time.perf_counter()
+    components = build_components(
+        HOLDER.ensure_loaded().engine,
+        queries_dir,
+        documents_dir,
+        n_candidates=args.candidates,
+        workers=args.workers,
+        cache_path=Path(args.cache) if args.cache else None,
+    )
+    t1 = time.perf_counter()
+
+    lambdas = parse_grid(args.lambdas)
+    boosts = parse_grid(args.boosts)
+    grid = run_sweep(components, lambdas, boosts, top_k=args.top_k)
+    t2 = time.perf_counter()
+
+    print(f"\nSweep over {len(components)} queries | top_k={args.top_k} | {grid.size} points")
+    print(f"components: {t1 - t0:.2f}s | sweep: {t2 - t1:.2f}s\n")
+    print_sweep(lambdas, boosts, grid)
+
+    save_sweep(Path(args.out_json), lambdas, boosts, grid)
+    print(f"\nSaved: {args.out_json}")
+
+
+def run_prune_report(args, queries_dir: Path) -> None:
+    """
+    Латентност и припокриване на top_k с/без подрязване на заявката, върху
+    кешираните токени на заявките от оценъчното множество.
+    """
+    from query_pruning import QueryPruning, pruning_report
+    from search import HOLDER
+
+    query_files = sorted(list(queries_dir.glob("*.pdf")))
+    if not query_files:
+        raise RuntimeError(f"No PDFs found in {queries_dir}")
+
+    cache = EvaluationCache(Path(args.cache) if args.cache else None)
+    pool = ProcessPoolExecutor(max_workers=args.workers) if args.workers != 1 else None
+    try:
+        queries = _cached_map(cache, "query", query_files, _query_worker, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        cache.save()
+
+    tokens = [(queries[q.name]["text_tokens"], queries[q.name]["legal_tokens"]) for q in query_files]
+    rows = {}
+    for spec in args.prune.split(","):
+        top_n, _, mass = spec.partition("@")
+        pruning = QueryPruning(
+            text_top_n=int(top_n) if top_n else None,
+            text_mass=float(mass) if mass else None,
+        )
+        rows[spec] = pruning_report(HOLDER.ensure_loaded().engine, tokens, pruning, top_k=args.top_k)
+        print(f"  {spec:>12}: " + ", ".join(f"{k}={v:.3f}" for k, v in rows[spec].items()))
+
+    with open(args.out_json, "w", encoding="utf-8") as f:
+        json.dump({"queries": len(tokens), "top_k": args.top_k, "pruning": rows}, f, ensure_ascii=False, indent=2)
+    print(f"\nSaved: {args.out_json}")
+
+
+def _json_size(vectors) -> int:
+    return sum(len(json.dumps(vec, ensure_ascii=False)) for vec in vectors.values())
+
+
+def run_index_prune_report(args, queries_dir: Path, documents_dir: Path) -> None:
+    """
+    Статично подрязване на text векторите на текущия индекс при няколко прага:
+    размер (ненулеви тегла, JSON байтове), латентност на search и mean
+    weighted Jaccard / припокриване на top_k спрямо неподрязания индекс.
+    """
+    import time
+    from search import HOLDER
+    from tf_idf_engine import TfidfSearchEngine
+
+    query_files = sorted(list(queries_dir.glob("*.pdf")))
+    if not query_files:
+        raise RuntimeError(f"No PDFs found in {queries_dir}")
+
+    cache = EvaluationCache(Path(args.cache) if args.cache else None)
+    pool = ProcessPoolExecutor(max_workers=args.workers) if args.workers != 1 else None
+    try:
+        queries = _cached_map(cache, "query", query_files, _query_worker, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        cache.save()
+    tokens = [(queries[q.name]["text_tokens"], queries[q.name]["legal_tokens"]) for q in query_files]
+
+    base = HOLDER.ensure_loaded().engine
+    settings = [("full", None, None)]
+    for spec in args.index_prune.split(","):
+        weight, _, max_terms = spec.partition("@")
+        settings.append((spec, float(weight) if weight else None, int(max_terms) if max_terms else None))
+
+    report = {}
+    expected = None
+    for name, min_weight, max_terms in settings:
+        engine = TfidfSearchEngine()
+        engine.idf_text, engine.idf_legal = base.idf_text, base.idf_legal
+        engine.tfidf_docs_text = {d: dict(v) for d, v in base.tfidf_docs_text.items()}
+        engine.tfidf_docs_legal = base.tfidf_docs_legal
+        engine.doc_norms_text = dict(getattr(base, "doc_norms_text", {}))
+        engine.prune_documents(min_weight, max_terms)
+
+        t0 = time.perf_counter()
+        retrieved = [engine.search(t, l, top_k=args.top_k) for t, l in tokens]
+        search_s = time.perf_counter() - t0
+
+        if expected is None:
+            expected = retrieved
+        overlaps = [
+            len({d for d, _ in e} & {d for d, _ in r}) / max(len(e), 1)
+            for e, r in zip(expected, retrieved)
+        ]
+
+        rows = evaluate_folder_parallel(
+            queries_dir, documents_dir, top_k=args.top_k, use_weighted=True,
+            workers=args.workers, cache_path=Path(args.cache) if args.cache else None, engine=engine,
+        )
+        report[name] = {
+            "terms": sum(len(v) for v in engine.tfidf_docs_text.values()),
+            "text_json_mb": _json_size(engine.tfidf_docs_text) / 2 ** 20,
+            "search_ms": 1000 * search_s / max(len(tokens), 1),
+            f"overlap_at_{args.top_k}": sum(overlaps) / max(len(overlaps), 1),
+            "mean_weighted_jaccard": summarize(rows, use_weighted=True)["mean"],
+        }
+        print(f"  {name:>12}: " + ", ".join(f"{k}={v:.3f}" for k, v in report[name].items()))
+
+    with open(args.out_json, "w", encoding="utf-8") as f:
+        json.dump({"queries": len(tokens), "top_k": args.top_k, "index_pruning": report}, f, ensure_ascii=False, indent=2)
+    print(f"\nSaved: {args.out_json}")
+
+
 def main():
     import argparse
 
@@ -156,17 +545,60 @@ def main():
     p.add_argument("--top_k", type=int, default=10)
     p.add_argument("--weighted", action="store_true", help="Use weighted Jaccard as primary metric")
     p.add_argument("--out_json", type=str, default="offline_eval_results.json")
+    p.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count, 1 = no pool)")
+    p.add_argument("--cache", type=str, default=str(DEFAULT_CACHE_PATH), help="Parsed-PDF cache file ('' to disable)")
+    p.add_argument("--sequential", action="store_true", help="Use the original one-query-at-a-time evaluation")
+    p.add_argument("--sweep", action="store_true", help="Sweep LEGAL_LAMBDA x LEGAL_SPEC_LOG_WEIGHT (weighted Jaccard)")
+    p.add_argument("--lambdas", type=str, default="0.5:3.5:10", help="start:stop:num or a,b,c")
+    p.add_argument("--boosts", type=str, default="0.0:1.8:10", help="start:stop:num or a,b,c")
+    p.add_argument("--candidates", type=int, default=200, help="Per-field candidates kept per query for the sweep")
+    p.add_argument("--prune_report", action="store_true", help="Compare query-pruned and full search (latency, top-k overlap)")
+    p.add_argument(
+        "--prune",
+        type=str,
+        default="2000,1000,500,200,@0.99,@0.95,@0.9",
+        help="Comma-separated text pruning settings: top_n, @mass or top_n@mass",
+    )
+    p.add_argument("--index_prune_report", action="store_true", help="Compare statically pruned document vectors with the full index")
+    p.add_argument(
+        "--index_prune",
+        type=str,
+        default="0.005,0.01,0.02,@500,@200,0.01@500",
+        help="Comma-separated settings: min_relative_weight, @max_terms or weight@max_terms",
+    )
     args = p.parse_args()
 
     queries_dir = Path(args.queries_dir)
     documents_dir = Path(args.documents_dir)
 
-    rows = evaluate_folder(
-        queries_dir=queries_dir,
-        documents_dir=documents_dir,
-        top_k=args.top_k,
-        use_weighted=args.weighted
-    )
+    if args.sweep:
+        run_sweep_mode(args, queries_dir, documents_dir)
+        return
+
+    if args.prune_report:
+        run_prune_report(args, queries_dir)
+        return
+
+    if args.index_prune_report:
+        run_index_prune_report(args, queries_dir, documents_dir)
+        return
+
+    if args.sequential:
+        rows = evaluate_folder(
+            queries_dir=queries_dir,
+            documents_dir=documents_dir,
+            top_k=args.top_k,
+            use_weighted=args.weighted
+        )
+    else:
+        rows = evaluate_folder_parallel(
+            queries_dir=queries_dir,
+            documents_dir=documents_dir,
+            top_k=args.top_k,
+            use_weighted=args.weighted,
+            workers=args.workers,
+            cache_path=Path(args.cache) if args.cache else None,
+        )
 
     summary = summarize(rows, use_weighted=args.weighted)
 
@@ -185,9 +617,10 @@ def main():
     for k, v in summary.items():
         if k != "hit_at":
             print(f"  {k}: {v}")
-    print("  hit_at:")
-    for t, v in summary["hit_at"].items():
-        print(f"    >= {t}: {v:.3f}")
+    if "hit_at" in summary:
+        print("  hit_at:")
+        for t, v in summary["hit_at"].items():
+            print(f"    >= {t}: {v:.3f}")
 
     # save json
     payload = {
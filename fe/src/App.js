@@ -1,6 +1,20 @@
 import { useState } from "react";
 import "./App.css";
 
+function renderSnippet(ref) {
+  if (!ref.highlight) {
+    return ref.snippet;
+  }
+  const [start, end] = ref.highlight;
+  return (
+    <>
+      {ref.snippet.slice(0, start)}
+      <mark>{ref.snippet.slice(start, end)}</mark>
+      {ref.snippet.slice(end)}
+    </>
+  );
+}
+
 function App() {
   const [file, setFile] = useState(null);
   const [results, setResults] = useState([]);
@@ -70,6 +84,19 @@ function App() {
                 <div>
                   <strong>{r.document} |</strong>
                   <span className="score">близост: {r.score}</span>
+
+                  {r.references && r.references.length > 0 && (
+                    <ul className="references">
+                      {r.references.map((ref, i) => (
+                        <li key={i}>
+                          <strong>{ref.reference}</strong>
+                          {ref.snippet && (
+                            <p className="snippet">{renderSnippet(ref)}</p>
+                          )}
+                        </li>
+                      ))}
+                    </ul>
+                  )}
                 </div>
 
                 <div className="actions">
@@ -0,0 +1,70 @@
+# gunicorn -c gunicorn.conf.py api:app
+#
+# preload_app: api.py се импортира веднъж в master процеса, when_ready зарежда
+# индекса (search.HOLDER) и stemmer-а там, а worker-ите се fork-ват след това –
+# lifespan-ът на api.py в тях ги заварва заредени. Компактният/сегментираният индекс
+# е mmap-нат read-only, така че страниците му са едни и същи във всички worker-и;
+# Python обектите (речници на термините, idf) се делят copy-on-write.
+#
+# /admin/reload презарежда worker-а, който е обслужил заявката, и увеличава
+# generation в index/reload_request.json; останалите worker-и го проверяват
+# (engine_holder.RELOAD_POLL_SECONDS) и се презареждат сами. `kill -HUP <master>`
+# не стига при preload_app (новите worker-и наследяват заредения в master-а индекс,
+# но и те виждат файла и догонват). /admin/* съществуват само при зададен
+# ADMIN_TOKEN и изискват "Authorization: Bearer <ADMIN_TOKEN>".
+#
+# /metrics се обслужва от случаен worker, затова броячите минават през
+# PROMETHEUS_MULTIPROC_DIR (вж. metrics.py): всеки worker записва своите там, а
+# /metrics връща сумата за всички. По подразбиране – временна директория на този
+# master; файловете в нея се трият при старт и при спиране.
+import gc
+import multiprocessing
+import os
+import tempfile
+import time
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 120
+
+# преди preload-а на api.py – metrics.py го чете при импорта
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), f"legal-search-metrics-{os.getpid()}")
+)
+
+
+def _clear_metrics_dir() -> None:
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        if name.endswith((".json", ".json.tmp")):
+            os.unlink(os.path.join(metrics_dir, name))
+
+
+def on_starting(server):
+    _clear_metrics_dir()
+
+
+def on_exit(server):
+    _clear_metrics_dir()
+    try:
+        os.rmdir(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+    except OSError:
+        pass
+
+
+def when_ready(server):
+    from search import HOLDER
+    from text_preprocessing import get_stemmer
+
+    t0 = time.perf_counter()
+    HOLDER.ensure_loaded()
+    get_stemmer()
+    server.log.info("Index and stemmer loaded in %.2fs", time.perf_counter() - t0)
+
+    # обектите от зареждането отиват в permanent generation – gc в worker-ите
+    # не ги обхожда и не пише в заглавията им, така че страниците остават споделени
+    gc.freeze()
+    server.log.info("Index preloaded; forking %s workers", workers)
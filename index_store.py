@@ -0,0 +1,112 @@
+from pathlib import Path
+from typing import Union
+import json
+import os
+
+from compact_store import CompactTfidfEngine, compact_dir, has_compact, stale_reason
+from postings_store import PostingsTfidfEngine, has_postings, postings_dir
+from segments import SegmentedTfidfEngine, has_segments, manifest_stale_reason
+from tf_idf_engine import TfidfSearchEngine
+
+
+def load_engine(
+    index_dir: Path, mmap: bool = False
+) -> Union[TfidfSearchEngine, SegmentedTfidfEngine, CompactTfidfEngine, PostingsTfidfEngine]:
+    """
+    Сегментиран индекс, ако има index/segments/manifest.json; компактният
+    (index/compact, вж. compact_store.py) или компресираните postings
+    (index/postings, вж. postings_store.py), ако са построени; иначе JSON векторите.
+    mmap=True отваря .npy масивите read-only през mmap – процесите (напр.
+    gunicorn worker-ите) делят едни и същи страници от page cache-а.
+    JSON индексът винаги се зарежда в паметта на процеса.
+    Производен индекс (сегменти, compact, postings), построен от по-стара
+    версия на JSON индекса (след tf_idf_index_builder / ingest_pipeline без
+    --segmented), се пропуска с предупреждение.
+    """
+    mmap_mode = "r" if mmap else None
+    if has_segments(index_dir):
+        reason = manifest_stale_reason(index_dir)
+        if reason is None:
+            return SegmentedTfidfEngine(index_dir, mmap_mode=mmap_mode)
+        print(f"Skipping stale segmented index ({reason}); re-seed it with segments.py init")
+    if has_compact(index_dir):
+        reason = stale_reason(index_dir, compact_dir(index_dir))
+        if reason is None:
+            return CompactTfidfEngine.load(index_dir, mmap_mode=mmap_mode)
+        print(f"Skipping stale compact index ({reason}); rebuild it with compact_store.py")
+    if has_postings(index_dir):
+        reason = stale_reason(index_dir, postings_dir(index_dir))
+        if reason is None:
+            return PostingsTfidfEngine.load(index_dir, mmap_mode=mmap_mode)
+        print(f"Skipping stale postings index ({reason}); rebuild it with postings_store.py")
+    return load_json_engine(index_dir)
+
+
+def load_json_engine(index_dir: Path) -> TfidfSearchEngine:
+    engine = TfidfSearchEngine()
+
+    # суровите token списъци не са нужни за търсене; streaming builder-ът
+    # пази само term counts в index/counts
+    text_tokens_path = index_dir / "documents_text_tokens.json"
+    if text_tokens_path.exists():
+        with text_tokens_path.open(encoding="utf-8") as f:
+            engine.documents_text_tokens = json.load(f)
+
+    legal_tokens_path = index_dir / "documents_legal_tokens.json"
+    if legal_tokens_path.exists():
+        with legal_tokens_path.open(encoding="utf-8") as f:
+            engine.documents_legal_tokens = json.load(f)
+
+    with (index_dir / "idf_text.json").open(encoding="utf-8") as f:
+        engine.idf_text = {k: float(v) for k, v in json.load(f).items()}
+
+    with (index_dir / "idf_legal.json").open(encoding="utf-8") as f:
+        engine.idf_legal = {k: float(v) for k, v in json.load(f).items()}
+
+    with (index_dir / "tfidf_docs_text.json").open(encoding="utf-8") as f:
+        engine.tfidf_docs_text = {
+            doc_id: {k: float(v) for k, v in vec.items()}
+            for doc_id, vec in json.load(f).items()
+        }
+
+    with (index_dir / "tfidf_docs_legal.json").open(encoding="utf-8") as f:
+        engine.tfidf_docs_legal = {
+            doc_id: {k: float(v) for k, v in vec.items()}
+            for doc_id, vec in json.load(f).items()
+        }
+
+    # само при статично подрязан индекс (вж. TfidfSearchEngine.prune_documents)
+    norms_path = index_dir / "doc_norms_text.json"
+    if norms_path.exists():
+        with norms_path.open(encoding="utf-8") as f:
+            engine.doc_norms_text = {k: float(v) for k, v in json.load(f).items()}
+
+    return engine
+
+
+def save_engine(engine: TfidfSearchEngine, index_dir: Path) -> None:
+    """
+    Записва idf и tfidf речниците на вече построен engine (без token списъците).
+    """
+    index_dir.mkdir(parents=True, exist_ok=True)
+
+    for name, obj in (
+        ("idf_text.json", engine.idf_text),
+        ("idf_legal.json", engine.idf_legal),
+        ("tfidf_docs_text.json", engine.tfidf_docs_text),
+        ("tfidf_docs_legal.json", engine.tfidf_docs_legal),
+    ):
+        path = index_dir / name
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    norms_path = index_dir / "doc_norms_text.json"
+    if engine.doc_norms_text:
+        tmp_path = norms_path.with_name(norms_path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(engine.doc_norms_text, f, ensure_ascii=False)
+        os.replace(tmp_path, norms_path)
+    elif norms_path.exists():
+        norms_path.unlink()
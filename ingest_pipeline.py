@@ -0,0 +1,288 @@
+# Crawl -> extraction -> индекс като един поток:
+#   crawler  --(parse_queue)-->  process_pdf_document в ProcessPool  --(index_queue)-->  writer
+# Опашките са ограничени, така че бавната екстракция спира тегленето (back-pressure).
+# Writer-ът добавя нови части index/counts/seg_*.jsonl + snippets/seg_*.bin и
+# след всяка преизчислява целия индекс (write_index_from_counts – с дубликатите
+# и подрязването на builder-а); API-то го вижда след /admin/reload.
+# --segmented: вместо това ги публикува като нови сегменти на сегментирания
+# индекс (segments.py) – API-то ги вижда при следващия refresh на manifest-а,
+# без reload. Новите документи не се сверяват за дубликати; при статично
+# подрязване сегментиран режим не е възможен (вж. SegmentedIndex.seed_from_counts).
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Set
+
+from crawler import (
+    BASE_URL,
+    CONCURRENCY,
+    PAGES_TO_CRAWL,
+    PER_HOST_INTERVAL,
+    AsyncCrawler,
+    HtmlListingDiscovery,
+    SeleniumListingDiscovery,
+)
+from document_metadata import MetadataWriter
+from segments import SegmentedIndex, has_segments, manifest_stale_reason
+from snippets import SnippetStoreWriter
+from text_preprocessing import ProcessedDocument, process_pdf_document
+from tf_idf_index_builder import (
+    COUNTS_DIR_NAME,
+    INDEX_DIR,
+    PDF_DIR,
+    iter_counts,
+    write_counts_record,
+    write_index_from_counts,
+)
+
+PARSE_QUEUE_SIZE = 16
+INDEX_QUEUE_SIZE = 16
+
+# сегментът се затваря при толкова документа или след толкова секунди
+SEGMENT_MAX_DOCS = 50
+SEGMENT_MAX_SECONDS = 120.0
+
+
+def _process_worker(path: str) -> ProcessedDocument:
+    return process_pdf_document(Path(path))
+
+
+def indexed_doc_ids(index_dir: Path) -> Set[str]:
+    return {doc_id for doc_id, _, _ in iter_counts(index_dir)}
+
+
+class SegmentWriter:
+    """
+    Един отворен сегмент: counts + snippets + метаданни с едно и също име на част.
+    Сегментът става видим (os.replace) едва при close().
+    """
+
+    def __init__(self, index_dir: Path, name: str):
+        counts_dir = index_dir / COUNTS_DIR_NAME
+        counts_dir.mkdir(parents=True, exist_ok=True)
+
+        self.name = name
+        self.path = counts_dir / f"{name}.jsonl"
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self._f = self.tmp_path.open("w", encoding="utf-8")
+        self._snippets = SnippetStoreWriter(index_dir, name)
+        self._metadata = MetadataWriter(index_dir, name)
+        self.docs = 0
+        self.doc_ids: List[str] = []
+        self.opened_at = time.monotonic()
+
+    def add(self, doc_id: str, doc: ProcessedDocument) -> None:
+        write_counts_record(self._f, doc_id, doc.text_tokens, doc.legal_tokens)
+        self._snippets.add(doc_id, doc.display_text, doc.legal_spans)
+        self._metadata.add(doc_id, doc.metadata)
+        self.docs += 1
+        self.doc_ids.append(doc_id)
+
+    def close(self) -> None:
+        self._f.close()
+        # snippets и метаданни преди counts: документ в индекса винаги има и двата записа
+        self._snippets.close()
+        self._metadata.close()
+        self.tmp_path.replace(self.path)
+
+
+class IngestPipeline:
+    def __init__(
+        self,
+        index_dir: Path = INDEX_DIR,
+        workers: Optional[int] = None,
+        segment_max_docs: int = SEGMENT_MAX_DOCS,
+        segment_max_seconds: float = SEGMENT_MAX_SECONDS,
+        segmented: bool = False,
+    ):
+        self.index_dir = index_dir
+        self.workers = workers
+        self.segment_max_docs = segment_max_docs
+        self.segment_max_seconds = segment_max_seconds
+
+        self.parse_queue: "asyncio.Queue[Optional[Path]]" = asyncio.Queue(PARSE_QUEUE_SIZE)
+        self.index_queue: "asyncio.Queue[Optional[tuple]]" = asyncio.Queue(INDEX_QUEUE_SIZE)
+
+        self.segmented = SegmentedIndex(index_dir) if segmented else None
+
+        self.indexed: Set[str] = set()
+        self.segments = 0
+        self.failed_segments = 0
+        self._segment_seq = 0
+
+    async def submit(self, path: Path) -> None:
+        """
+        on_download hook за crawler-а; блокира, ако екстракцията изостава.
+        """
+        if path.suffix.lower() == ".pdf" and path.name not in self.indexed:
+            await self.parse_queue.put(path)
+
+    async def _parse_stage(self, pool: ProcessPoolExecutor) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            path = await self.parse_queue.get()
+            if path is None:
+                return
+            try:
+                doc = await loop.run_in_executor(pool, _process_worker, str(path))
+            except Exception as e:
+                print(f" Грешка при обработка на {path.name}: {e}")
+                continue
+            await self.index_queue.put((path.name, doc))
+
+    def _new_segment(self) -> SegmentWriter:
+        self._segment_seq += 1
+        name = f"seg_{time.strftime('%Y%m%d%H%M%S')}_{self._segment_seq:04d}"
+        return SegmentWriter(self.index_dir, name)
+
+    async def _publish(self, segment: SegmentWriter) -> None:
+        """
+        Грешката се логва и writer-ът продължава: ако _index_stage спре,
+        parser-ите блокират на пълната index_queue, а crawler-ът – на parse_queue.
+        При сегментиран индекс counts файлът на неуспешния сегмент се маха, за да
+        могат документите му да бъдат подадени отново; при пълно преизчисляване
+        той остава и влиза в следващото.
+        """
+        try:
+            segment.close()
+        except Exception as e:
+            print(f" Грешка при запис на {segment.name}: {type(e).__name__}: {e}")
+            self.failed_segments += 1
+            self.indexed.difference_update(segment.doc_ids)
+            return
+
+        try:
+            if self.segmented is not None:
+                name = await asyncio.to_thread(self.segmented.add_counts_file, segment.path)
+                print(f"Сегмент {segment.name}: {segment.docs} документа -> {name}")
+            else:
+                N = await asyncio.to_thread(write_index_from_counts, self.index_dir)
+                print(f"Сегмент {segment.name}: {segment.docs} документа, индексът е с {N}")
+        except Exception as e:
+            print(f" Грешка при публикуване на {segment.name}: {type(e).__name__}: {e}")
+            self.failed_segments += 1
+            if self.segmented is not None:
+                segment.path.unlink(missing_ok=True)
+                self.indexed.difference_update(segment.doc_ids)
+            return
+        self.segments += 1
+
+    async def _seed_segments(self) -> None:
+        """
+        Първият път, или ако JSON индексът е преизчислен след сегментите: по
+        един сегмент на всеки counts файл без дубликатите ("segments.py init"),
+        иначе сегментираният индекс би съдържал само новите документи.
+        """
+        if has_segments(self.index_dir):
+            reason = manifest_stale_reason(self.index_dir)
+            if reason is None:
+                return
+            print(f"Сегментите са остарели ({reason}); създават се наново")
+        for name in await asyncio.to_thread(self.segmented.seed_from_counts):
+            print(f"Начален сегмент -> {name}")
+
+    async def _index_stage(self) -> None:
+        segment: Optional[SegmentWriter] = None
+        while True:
+            timeout = None
+            if segment is not None:
+                timeout = max(0.0, segment.opened_at + self.segment_max_seconds - time.monotonic())
+            try:
+                item = await asyncio.wait_for(self.index_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                await self._publish(segment)
+                segment = None
+                continue
+
+            if item is None:
+                if segment is not None:
+                    await self._publish(segment)
+                return
+
+            doc_id, doc = item
+            if doc_id in self.indexed:
+                continue
+            if segment is None:
+                segment = self._new_segment()
+            segment.add(doc_id, doc)
+            self.indexed.add(doc_id)
+
+            if segment.docs >= self.segment_max_docs:
+                await self._publish(segment)
+                segment = None
+
+    async def run(self, crawler: AsyncCrawler, discovery, backfill_dir: Optional[Path] = None) -> None:
+        self.indexed = await asyncio.to_thread(indexed_doc_ids, self.index_dir)
+        crawler.on_download = self.submit
+        if self.segmented is not None:
+            await self._seed_segments()
+            self.segmented.start_merger()
+
+        n_parsers = self.workers or CONCURRENCY
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            parsers = [asyncio.create_task(self._parse_stage(pool)) for _ in range(n_parsers)]
+            indexer = asyncio.create_task(self._index_stage())
+            try:
+                # изтеглени, но неиндексирани файлове (напр. след прекъсване)
+                if backfill_dir is not None:
+                    for path in sorted(backfill_dir.glob("*.pdf")):
+                        await self.submit(path)
+
+                await crawler.crawl(discovery)
+            finally:
+                for _ in parsers:
+                    await self.parse_queue.put(None)
+                await asyncio.gather(*parsers)
+                await self.index_queue.put(None)
+                await indexer
+                if self.segmented is not None:
+                    self.segmented.stop_merger()
+
+
+def main():
+    import argparse
+
+    p = argparse.ArgumentParser("Crawl and index court decisions as they are downloaded")
+    p.add_argument("--start_url", type=str, default=BASE_URL)
+    p.add_argument("--pages", type=int, default=PAGES_TO_CRAWL)
+    p.add_argument("--download_dir", type=str, default=str(PDF_DIR), help="Corpus directory (also backfilled)")
+    p.add_argument("--index_dir", type=str, default=str(INDEX_DIR))
+    p.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    p.add_argument("--per_host_interval", type=float, default=PER_HOST_INTERVAL)
+    p.add_argument("--workers", type=int, default=None, help="Extraction processes")
+    p.add_argument("--segment_docs", type=int, default=SEGMENT_MAX_DOCS)
+    p.add_argument("--segment_seconds", type=float, default=SEGMENT_MAX_SECONDS)
+    p.add_argument(
+        "--segmented",
+        action="store_true",
+        help="Publish each batch as a new index segment instead of rebuilding the JSON index "
+             "(no /admin/reload needed; new documents are not checked for near-duplicates)",
+    )
+    p.add_argument("--no_backfill", action="store_true", help="Do not index PDFs already in download_dir")
+    p.add_argument("--selenium", action="store_true", help="Discover listing pages with a headless Chrome")
+    args = p.parse_args()
+
+    if args.selenium:
+        discovery = SeleniumListingDiscovery(args.start_url, args.pages)
+    else:
+        discovery = HtmlListingDiscovery(args.start_url, args.pages)
+
+    crawler = AsyncCrawler(args.download_dir, args.concurrency, args.per_host_interval)
+    pipeline = IngestPipeline(
+        Path(args.index_dir),
+        workers=args.workers,
+        segment_max_docs=args.segment_docs,
+        segment_max_seconds=args.segment_seconds,
+        segmented=args.segmented,
+    )
+    backfill_dir = None if args.no_backfill else Path(args.download_dir)
+    asyncio.run(pipeline.run(crawler, discovery, backfill_dir))
+
+    print(f"\nИндексирани са {len(pipeline.indexed)} документа в {pipeline.segments} нови части.")
+    if pipeline.failed_segments:
+        print(f"Неуспешни сегменти: {pipeline.failed_segments}")
+
+
+if __name__ == "__main__":
+    main()
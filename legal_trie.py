@@ -0,0 +1,228 @@
+# Дърво на правните препратки: закон -> чл./§/ал. -> ал. -> т.
+# LEGAL:чл:145_ал:1_АПК  ->  път ("АПК", "чл:145", "ал:1")
+# Всеки възел пази bitset (Python int по реда на документите в engine-а) на
+# документите, които цитират точно него, и на тези, които цитират него или поднива.
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from tf_idf_engine import iter_bits
+
+LEGAL_PREFIX = "LEGAL:"
+
+Path = Tuple[str, ...]
+
+
+def token_path(token: str) -> Path:
+    """
+    LEGAL:чл:145_ал:1_АПК -> ("АПК", "чл:145", "ал:1")
+    """
+    body = token[len(LEGAL_PREFIX):] if token.startswith(LEGAL_PREFIX) else token
+    parts = body.split("_")
+    return (parts[-1],) + tuple(parts[:-1])
+
+
+def path_token(path: Path) -> str:
+    return LEGAL_PREFIX + "_".join(path[1:] + path[:1])
+
+
+def law_key(path: Path) -> Path:
+    """
+    Ключът на пътя в дървото: законът без значение от регистъра (ЗЗдр, ЗЗДР и
+    зздр са един възел). Единствената нормализация – и при строене, и при търсене.
+    """
+    return (path[0].upper(),) + path[1:] if path else path
+
+
+# нивата след закона и кое ниво може да следва кое – както ги пише
+# extract_reference_tokens (чл:1_ал:2_т:3, чл:1_§:2, §:1_ал:2_т:3, ал:1_т:2)
+NEXT_LEVELS = {
+    None: {"чл", "§", "ал"},
+    "чл": {"ал", "§"},
+    "§": {"ал", "т"},
+    "ал": {"т"},
+    "т": set(),
+}
+
+
+def validate_path(path: Path, spec: str) -> Path:
+    """
+    ValueError, ако законът липсва или е име на ниво, ако ниво не е от
+    чл/§/ал/т, номерът не е число или редът на нивата е невъзможен.
+    """
+    law, levels = path[0], path[1:]
+    if not law or law.lower() in NEXT_LEVELS:
+        raise ValueError(f"expected LAW[:level:number]..., got {spec!r}")
+
+    previous = None
+    for level in levels:
+        name, _, number = level.partition(":")
+        if name not in NEXT_LEVELS:
+            raise ValueError(f"unknown level {name!r} in {spec!r} (expected чл, §, ал or т)")
+        if not number.isdigit():
+            raise ValueError(f"expected a number after {name!r} in {spec!r}")
+        if name not in NEXT_LEVELS[previous]:
+            raise ValueError(f"{name!r} cannot follow {previous or law!r} in {spec!r}")
+        previous = name
+    return path
+
+
+def parse_cites(spec: str) -> Path:
+    """
+    "АПК:чл:145:ал:1" или LEGAL токен ("чл:145_ал:1_АПК") -> път в дървото.
+    ValueError при невалидна препратка (вж. validate_path).
+    """
+    spec = spec.strip()
+    if not spec:
+        raise ValueError("empty legal reference")
+    if spec.startswith(LEGAL_PREFIX) or "_" in spec:
+        return validate_path(token_path(spec), spec)
+
+    law, *rest = spec.split(":")
+    if len(rest) % 2:
+        raise ValueError(f"expected LAW[:level:number]..., got {spec!r}")
+    levels = tuple(f"{rest[i].strip().lower()}:{rest[i + 1].strip()}" for i in range(0, len(rest), 2))
+    return validate_path((law.strip(),) + levels, spec)
+
+
+class LegalTrieNode:
+    __slots__ = ("children", "docs", "subtree", "token")
+
+    def __init__(self):
+        self.children: Dict[str, "LegalTrieNode"] = {}
+        self.docs = 0
+        self.subtree = 0
+        # None за междинни възли, които не са срещани като самостоятелен токен
+        self.token: Optional[str] = None
+
+
+class LegalReferenceTrie:
+    def __init__(self):
+        self.root = LegalTrieNode()
+        self.doc_ids: List[str] = []
+        # law_key -> законът, както е в първия срещнат токен (за children())
+        self.laws: Dict[str, str] = {}
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Tuple[str, Iterable[str]]]) -> "LegalReferenceTrie":
+        """
+        documents: (doc_id, LEGAL токени) – изходът на extract_reference_tokens
+        """
+        trie = cls()
+        for doc_id, tokens in documents:
+            bit = 1 << len(trie.doc_ids)
+            trie.doc_ids.append(doc_id)
+            for token in tokens:
+                if token.startswith(LEGAL_PREFIX):
+                    node = trie._insert(token_path(token))
+                    node.token = token
+                    node.docs |= bit
+        trie._finalize(trie.root)
+        return trie
+
+    @classmethod
+    def from_engine(cls, engine) -> "LegalReferenceTrie":
+        legal = engine.tfidf_docs_legal
+        return cls.from_documents(
+            (doc_id, legal.get(doc_id, {}).keys()) for doc_id in engine.tfidf_docs_text
+        )
+
+    def _insert(self, path: Path) -> LegalTrieNode:
+        self.laws.setdefault(law_key(path)[0], path[0])
+        node = self.root
+        for part in law_key(path):
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = LegalTrieNode()
+            node = child
+        return node
+
+    def _finalize(self, root: LegalTrieNode) -> None:
+        # subtree bitset-ите отдолу нагоре, без рекурсия
+        stack = [(root, False)]
+        while stack:
+            node, done = stack.pop()
+            if not done:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children.values())
+                continue
+            bits = node.docs
+            for child in node.children.values():
+                bits |= child.subtree
+            node.subtree = bits
+
+    def find(self, path: Path) -> Optional[LegalTrieNode]:
+        node = self.root
+        for part in law_key(path):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def citing(self, path: Path, exact: bool = False) -> int:
+        """
+        Bitset на документите, цитиращи path (или някое от поднивата му, ако exact=False).
+        """
+        node = self.find(path)
+        if node is None:
+            return 0
+        return node.docs if exact else node.subtree
+
+    def citing_all(self, paths: Iterable[Path]) -> int:
+        """
+        AND върху няколко препратки
+        """
+        bits = None
+        for path in paths:
+            node_bits = self.citing(path)
+            bits = node_bits if bits is None else bits & node_bits
+            if not bits:
+                return 0
+        return bits or 0
+
+    def documents(self, bits: int) -> Set[str]:
+        return {self.doc_ids[idx] for idx in iter_bits(bits)}
+
+    def ancestors(self, path: Path) -> List[str]:
+        """
+        Токените на по-горните нива, които присъстват в индекса (от закона надолу).
+        """
+        out = []
+        node = self.root
+        for part in law_key(path)[:-1]:
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.token is not None:
+                out.append(node.token)
+        return out
+
+    def descendants(self, path: Path) -> List[str]:
+        """
+        Всички индексирани токени под path (включително самия него).
+        """
+        node = self.find(path)
+        if node is None:
+            return []
+
+        out = []
+        stack = [(path, node)]
+        while stack:
+            p, n = stack.pop()
+            if n.token is not None:
+                out.append(n.token)
+            stack.extend((p + (part,), child) for part, child in n.children.items())
+        return sorted(out)
+
+    def children(self, path: Path) -> List[Tuple[str, int]]:
+        """
+        (токен на детето, брой документи в поддървото му)
+        """
+        node = self.find(path)
+        if node is None:
+            return []
+        out = []
+        for part, child in node.children.items():
+            # законът – с изписването от индекса, не от заявката
+            child_path = law_key(path + (part,))
+            child_path = (self.laws.get(child_path[0], child_path[0]),) + child_path[1:]
+            out.append((child.token or path_token(child_path), bin(child.subtree).count("1")))
+        return sorted(out, key=lambda x: -x[1])
@@ -0,0 +1,320 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import json
+import os
+import threading
+import time
+import uuid
+
+# секунди; последната кофа е +Inf
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_REGISTRY: List["_Metric"] = []
+
+# Под gunicorn всеки worker има свои броячи, а /metrics отговаря от случаен
+# worker. С PROMETHEUS_MULTIPROC_DIR всеки процес записва състоянието си в
+# <dir>/<pid>-<id>.json (MULTIPROC_FLUSH_SECONDS след промяна и преди рендиране),
+# а render_prometheus сумира файловете на всички процеси – и на спрените, за да не
+# намаляват counter-ите. gunicorn.conf.py задава директорията и я изпразва при старт.
+MULTIPROC_DIR: Optional[str] = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or None
+MULTIPROC_FLUSH_SECONDS = 1.0
+
+# профилът на текущата заявка (stage -> секунди), ако е поискан
+_current_profile: ContextVar[Optional[Dict[str, float]]] = ContextVar("_current_profile", default=None)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(k, "")) for k in self.labelnames)
+
+    def snapshot(self) -> List[list]:
+        """
+        [[стойности на етикетите, стойност], ...] – за JSON файла на процеса.
+        """
+        raise NotImplementedError
+
+    def _combine(self, a, b):
+        raise NotImplementedError
+
+    def render(self, snapshots: List[List[list]]) -> List[str]:
+        """
+        Сумата на snapshot-ите (на един или на всички процеси).
+        """
+        merged: Dict[Tuple[str, ...], object] = {}
+        for snapshot in snapshots:
+            for key, value in snapshot:
+                key = tuple(key)
+                merged[key] = value if key not in merged else self._combine(merged[key], value)
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples(merged))
+        return lines
+
+    def _samples(self, values: Dict[Tuple[str, ...], object]) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+        _mark_dirty()
+
+    def snapshot(self) -> List[list]:
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+    def _combine(self, a: float, b: float) -> float:
+        return a + b
+
+    def _samples(self, values: Dict[Tuple[str, ...], float]) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> (bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = entry
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+        _mark_dirty()
+
+    def snapshot(self) -> List[list]:
+        with self._lock:
+            return [[list(k), [list(v[0]), v[1], v[2]]] for k, v in self._values.items()]
+
+    def _combine(self, a: list, b: list) -> list:
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def _samples(self, values: Dict[Tuple[str, ...], list]) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "legal_search_stage_seconds",
+    "Time spent in each search pipeline stage.",
+    labelnames=("stage",),
+)
+REQUEST_SECONDS = Histogram(
+    "legal_search_request_seconds",
+    "End-to-end request latency per endpoint.",
+    labelnames=("endpoint",),
+)
+CACHE_HITS = Counter("legal_search_cache_hits_total", "Cache hits.", labelnames=("cache",))
+CACHE_MISSES = Counter("legal_search_cache_misses_total", "Cache misses.", labelnames=("cache",))
+DOCUMENTS_SCORED = Counter("legal_search_documents_scored_total", "Documents scored by search.")
+POSTINGS_TOUCHED = Counter(
+    "legal_search_postings_touched_total",
+    "Query term / document matches evaluated while scoring.",
+)
+QUERIES = Counter("legal_search_queries_total", "Search queries executed.")
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Мери времето на един етап: в хистограмата и, ако е включено, в профила на заявката.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+
+        profile = _current_profile.get()
+        if profile is not None:
+            profile[stage] = profile.get(stage, 0.0) + elapsed
+
+
+def record_search_stats(stats: Dict[str, int]) -> None:
+    QUERIES.inc()
+    DOCUMENTS_SCORED.inc(stats.get("documents_scored", 0))
+    POSTINGS_TOUCHED.inc(stats.get("postings_touched", 0))
+
+    profile = _current_profile.get()
+    if profile is not None:
+        for k, v in stats.items():
+            profile[k] = profile.get(k, 0) + v
+
+
+@contextmanager
+def request_profile(enabled: bool = True) -> Iterator[Optional[Dict[str, float]]]:
+    if not enabled:
+        yield None
+        return
+
+    profile: Dict[str, float] = {}
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+
+
+def format_profile(profile: Dict[str, float]) -> Dict:
+    """
+    Етапите в милисекунди, броячите – както са.
+    """
+    stages = {}
+    counters = {}
+    for k, v in profile.items():
+        if isinstance(v, float):
+            stages[k] = round(v * 1000.0, 3)
+        else:
+            counters[k] = v
+    return {"stages_ms": stages, **counters}
+
+
+_process_token = uuid.uuid4().hex[:8]
+_flusher_pid: Optional[int] = None
+_flusher_lock = threading.Lock()
+_dirty = threading.Event()
+
+
+def _snapshots() -> Dict[str, List[list]]:
+    return {metric.name: metric.snapshot() for metric in _REGISTRY}
+
+
+def _process_file() -> Path:
+    # pid + случаен суфикс: нов worker със същия pid не презаписва спрения
+    return Path(MULTIPROC_DIR) / f"{os.getpid()}-{_process_token}.json"
+
+
+def flush() -> None:
+    """
+    Записва броячите на процеса в MULTIPROC_DIR (атомарно).
+    """
+    if MULTIPROC_DIR is None:
+        return
+    path = _process_file()
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(_snapshots(), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _flush_loop() -> None:
+    while True:
+        _dirty.wait()
+        time.sleep(MULTIPROC_FLUSH_SECONDS)
+        _dirty.clear()
+        try:
+            flush()
+        except OSError:
+            # директорията е изтрита (спиране на сървъра) – следващата промяна опитва пак
+            pass
+
+
+def _mark_dirty() -> None:
+    global _flusher_pid
+    if MULTIPROC_DIR is None:
+        return
+    _dirty.set()
+    if _flusher_pid != os.getpid():
+        with _flusher_lock:
+            if _flusher_pid != os.getpid():
+                _flusher_pid = os.getpid()
+                threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+def _after_fork_in_child() -> None:
+    # worker-ът започва от нула: наследените от master-а стойности са в неговия файл
+    global _process_token, _flusher_pid, _flusher_lock, _dirty
+    _process_token = uuid.uuid4().hex[:8]
+    _flusher_pid = None
+    _flusher_lock = threading.Lock()
+    _dirty = threading.Event()
+    for metric in _REGISTRY:
+        metric._lock = threading.Lock()
+        metric._values = {}
+
+
+if MULTIPROC_DIR is not None:
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _read_snapshots() -> List[Dict[str, List[list]]]:
+    out = []
+    for path in sorted(Path(MULTIPROC_DIR).glob("*.json")):
+        try:
+            with path.open(encoding="utf-8") as f:
+                out.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+def render_prometheus() -> str:
+    """
+    Текстовият формат на Prometheus; с MULTIPROC_DIR – сумата на всички процеси.
+    """
+    if MULTIPROC_DIR is None:
+        processes = [_snapshots()]
+    else:
+        flush()
+        processes = _read_snapshots()
+
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render([p.get(metric.name, []) for p in processes]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,143 @@
+# Почти еднакви актове (поправки, преиздадени решения, шаблонни определения):
+# MinHash сигнатура върху множеството stem-нати текстови токени и LSH по ленти.
+# Кандидатите са документите, които съвпадат изцяло в поне една лента; двойка
+# се приема, ако оценката за Jaccard от сигнатурите е поне DUPLICATE_THRESHOLD.
+# Клъстерите са свързаните компоненти (union-find); от всеки се индексира
+# само един представител.
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import zlib
+
+import numpy as np
+
+# {представител: [дубликати]} в директорията на индекса
+DUPLICATES_FILE = "duplicates.json"
+
+NUM_PERM = 128
+# 16 ленти x 8 реда: праг на LSH кривата ~(1/16)^(1/8) ≈ 0.71
+BANDS = 16
+DUPLICATE_THRESHOLD = 0.85
+# документи с по-малко различни токени не се сравняват – оценката е шумна
+MIN_TOKENS = 20
+SEED = 1
+
+
+def _permutations(num_perm: int = NUM_PERM, seed: int = SEED) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+_A, _B = _permutations()
+
+
+def signature(tokens: Iterable[str]) -> np.ndarray:
+    """
+    uint32[NUM_PERM]: минимумът на всяка хеш функция (multiply-shift върху crc32)
+    по токените. Стабилна между пусканията – не зависи от PYTHONHASHSEED.
+    """
+    hashes = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in tokens), dtype=np.uint64)
+    if hashes.size == 0:
+        return np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint32)
+    with np.errstate(over="ignore"):
+        mixed = (hashes[:, None] * _A[None, :] + _B[None, :]) >> np.uint64(32)
+    return mixed.min(axis=0).astype(np.uint32)
+
+
+def estimated_jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.count_nonzero(a == b)) / a.size
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            self.parent[max(ri, rj)] = min(ri, rj)
+
+
+def find_duplicates(
+    documents: Iterable[Tuple[str, Iterable[str]]],
+    threshold: float = DUPLICATE_THRESHOLD,
+    bands: int = BANDS,
+    stats: Optional[dict] = None,
+) -> Dict[str, List[str]]:
+    """
+    documents: (doc_id, токени) – достатъчно е множеството (напр. ключовете на counts).
+    Връща {представител: [дубликати]} само за клъстери с поне два документа.
+    Представител е документът с най-много различни токени (при равенство – по doc_id).
+    """
+    rows = NUM_PERM // bands
+    doc_ids: List[str] = []
+    sizes: List[int] = []
+    signatures: List[np.ndarray] = []
+    for doc_id, tokens in documents:
+        tokens = set(tokens)
+        if len(tokens) < MIN_TOKENS:
+            continue
+        doc_ids.append(doc_id)
+        sizes.append(len(tokens))
+        signatures.append(signature(tokens))
+
+    if not doc_ids:
+        return {}
+    sig = np.vstack(signatures)
+
+    uf = _UnionFind(len(doc_ids))
+    checked = set()
+    candidates = 0
+    for band in range(bands):
+        buckets: Dict[bytes, List[int]] = {}
+        for i, key in enumerate(sig[:, band * rows:(band + 1) * rows]):
+            buckets.setdefault(key.tobytes(), []).append(i)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            for x, i in enumerate(members):
+                for j in members[x + 1:]:
+                    # вече в един клъстер (напр. голяма група еднакви шаблони)
+                    if (i, j) in checked or uf.find(i) == uf.find(j):
+                        continue
+                    checked.add((i, j))
+                    candidates += 1
+                    if estimated_jaccard(sig[i], sig[j]) >= threshold:
+                        uf.union(i, j)
+
+    clusters: Dict[int, List[int]] = {}
+    for i in range(len(doc_ids)):
+        clusters.setdefault(uf.find(i), []).append(i)
+
+    out = {}
+    for members in clusters.values():
+        if len(members) < 2:
+            continue
+        members.sort(key=lambda i: (-sizes[i], doc_ids[i]))
+        out[doc_ids[members[0]]] = sorted(doc_ids[i] for i in members[1:])
+
+    if stats is not None:
+        stats["signatures"] = len(doc_ids)
+        stats["candidate_pairs"] = candidates
+        stats["clusters"] = len(out)
+        stats["duplicates"] = sum(len(v) for v in out.values())
+    return out
+
+
+def load_duplicates(index_dir: Path) -> Dict[str, List[str]]:
+    """
+    {представител: [дубликати]}; празно за индекси без duplicates.json
+    """
+    path = index_dir / DUPLICATES_FILE
+    if not path.exists():
+        return {}
+    with path.open(encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,200 @@
+# Извличане на текст от PDF през сменяеми backend-и.
+#   pypdf2    – PyPDF2 (зависимост на проекта, по подразбиране)
+#   pdfminer  – pdfminer.six, ако е инсталиран
+#   pypdfium2 – PDFium, ако е инсталиран (най-бърз)
+# Страниците се връщат поточно (iter_pages); големи документи се разделят на
+# поредици от страници и се извличат паралелно в процеси.
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import multiprocessing
+import os
+import threading
+
+PDF_BACKEND = os.environ.get("PDF_BACKEND", "pypdf2")
+
+# под толкова страници паралелизмът не си заслужава разходите за IPC
+PARALLEL_MIN_PAGES = 16
+# страници на една задача в pool-а
+PAGE_CHUNK = 8
+PAGE_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def _page_range(start: int, stop: int, reverse: bool) -> range:
+    return range(stop - 1, start - 1, -1) if reverse else range(start, stop)
+
+
+class PyPDF2Backend:
+    name = "pypdf2"
+
+    def __init__(self):
+        import PyPDF2
+
+        self._pypdf2 = PyPDF2
+
+    def page_count(self, pdf_path: Path) -> int:
+        return len(self._pypdf2.PdfReader(str(pdf_path)).pages)
+
+    def pages(self, pdf_path: Path, start: int = 0, stop: Optional[int] = None, reverse: bool = False) -> Iterator[str]:
+        with open(pdf_path, "rb") as f:
+            reader = self._pypdf2.PdfReader(f)
+            for i in _page_range(start, len(reader.pages) if stop is None else stop, reverse):
+                yield reader.pages[i].extract_text() or ""
+
+
+class PdfminerBackend:
+    name = "pdfminer"
+
+    def __init__(self):
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+        from pdfminer.pdfpage import PDFPage
+
+        self._extract_pages = extract_pages
+        self._text_container = LTTextContainer
+        self._pdf_page = PDFPage
+
+    def page_count(self, pdf_path: Path) -> int:
+        with open(pdf_path, "rb") as f:
+            return sum(1 for _ in self._pdf_page.get_pages(f))
+
+    def _text(self, page) -> str:
+        return "".join(el.get_text() for el in page if isinstance(el, self._text_container))
+
+    def pages(self, pdf_path: Path, start: int = 0, stop: Optional[int] = None, reverse: bool = False) -> Iterator[str]:
+        if stop is None:
+            stop = self.page_count(pdf_path)
+        if not reverse:
+            for page in self._extract_pages(str(pdf_path), page_numbers=range(start, stop)):
+                yield self._text(page)
+            return
+        # page_numbers е само филтър – обратният ред иска по едно извикване на страница
+        for i in _page_range(start, stop, reverse):
+            for page in self._extract_pages(str(pdf_path), page_numbers=[i]):
+                yield self._text(page)
+
+
+class Pypdfium2Backend:
+    name = "pypdfium2"
+
+    def __init__(self):
+        import pypdfium2
+
+        self._pdfium = pypdfium2
+
+    def page_count(self, pdf_path: Path) -> int:
+        pdf = self._pdfium.PdfDocument(str(pdf_path))
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    def pages(self, pdf_path: Path, start: int = 0, stop: Optional[int] = None, reverse: bool = False) -> Iterator[str]:
+        pdf = self._pdfium.PdfDocument(str(pdf_path))
+        try:
+            for i in _page_range(start, len(pdf) if stop is None else stop, reverse):
+                page = pdf[i]
+                textpage = page.get_textpage()
+                try:
+                    # PDFium разделя редовете с \r\n
+                    yield textpage.get_text_range().replace("\r\n", "\n")
+                finally:
+                    textpage.close()
+                    page.close()
+        finally:
+            pdf.close()
+
+
+BACKENDS = {
+    "pypdf2": PyPDF2Backend,
+    "pdfminer": PdfminerBackend,
+    "pypdfium2": Pypdfium2Backend,
+}
+
+_instances: Dict[str, object] = {}
+
+
+def get_backend(name: Optional[str] = None):
+    """
+    ValueError за непознат backend, ImportError ако библиотеката не е инсталирана.
+    """
+    name = name or PDF_BACKEND
+    backend = _instances.get(name)
+    if backend is None:
+        if name not in BACKENDS:
+            raise ValueError(f"unknown PDF backend {name!r}, expected one of {', '.join(BACKENDS)}")
+        backend = _instances[name] = BACKENDS[name]()
+    return backend
+
+
+def available_backends() -> List[str]:
+    out = []
+    for name in BACKENDS:
+        try:
+            get_backend(name)
+        except ImportError:
+            continue
+        out.append(name)
+    return out
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _page_pool() -> ProcessPoolExecutor:
+    # създава се при първия голям документ – след fork-а на gunicorn worker-а
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PAGE_WORKERS)
+        return _pool
+
+
+def _extract_range(args: Tuple[str, str, int, int]) -> List[str]:
+    backend, pdf_path, start, stop = args
+    return list(get_backend(backend).pages(Path(pdf_path), start, stop))
+
+
+def iter_pages(
+    pdf_path: Path,
+    backend: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    Текстът на страниците по ред. При поне PARALLEL_MIN_PAGES страници и
+    workers > 1 поредиците от страници се извличат паралелно; workers=1 – поточно
+    в текущия процес.
+    """
+    impl = get_backend(backend)
+    if workers is None:
+        # вече сме в pool (ingest, evaluation) – паралелизмът е по документи
+        workers = PAGE_WORKERS if multiprocessing.parent_process() is None else 1
+
+    n_pages = impl.page_count(pdf_path) if workers > 1 else 0
+    if n_pages < PARALLEL_MIN_PAGES:
+        yield from impl.pages(pdf_path)
+        return
+
+    chunk = max(PAGE_CHUNK, -(-n_pages // (workers * 4)))
+    ranges = [(impl.name, str(pdf_path), start, min(start + chunk, n_pages)) for start in range(0, n_pages, chunk)]
+    # map връща поредиците по ред, докато следващите още се извличат
+    for pages in _page_pool().map(_extract_range, ranges):
+        yield from pages
+
+
+def iter_pages_reversed(pdf_path: Path, backend: Optional[str] = None) -> Iterator[str]:
+    """
+    Страниците от последната към първата, поточно – за части, които са в края
+    на документа (диспозитивът на решението).
+    """
+    return get_backend(backend).pages(pdf_path, reverse=True)
+
+
+def extract_text(
+    pdf_path: Path,
+    sep: str = "\n",
+    backend: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> str:
+    return sep.join(t for t in iter_pages(pdf_path, backend, workers) if t)
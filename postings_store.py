@@ -0,0 +1,415 @@
+# Компресирани postings по термин (term-major), вместо JSON векторите:
+#   index/postings/<field>.terms.json     речник (term id -> term), сортиран
+#   index/postings/<field>.offsets.npy    int64, байтовете на term i са в [offsets[i], offsets[i+1])
+#   index/postings/<field>.counts.npy     int64, postings на term i са в [counts[i], counts[i+1])
+#   index/postings/<field>.docs.npy       uint8, delta-кодирани doc индекси (CODECS)
+#   index/postings/<field>.impacts.npy    uint8 квантизиран impact w / ||d||
+#   index/postings/<field>.scales.npy     float32 мащаб на term (impact = q * scale)
+#   index/postings/meta.json, docs.json, idf_*.json
+# Impact-ът е вече нормиран с нормата на документа (преди статично подрязване,
+# ако има такова), така че косинусът е Σ q_w * impact / ||q||.
+# Всичко е .npy – при mmap декодирането чете директно от page cache-а.
+from pathlib import Path
+from typing import Collection, Dict, List, Mapping, Optional, Tuple
+import json
+import math
+
+import numpy as np
+
+from compact_store import (
+    CompactTfidfEngine,
+    _save_npy_atomic,
+    _write_json_atomic,
+    load_dir_consistent,
+    save_dir_atomic,
+    source_generation,
+)
+
+POSTINGS_DIR_NAME = "postings"
+FIELDS = ("text", "legal")
+
+# "varint": LEB128 на разликите; "block": блокове от BLOCK_SIZE разлики, всеки
+# с 1 байт ширина в битове и bit-packed стойности
+CODECS = ("varint", "block")
+BLOCK_SIZE = 128
+IMPACT_MAX = 255
+
+
+def postings_dir(index_dir: Path) -> Path:
+    return index_dir / POSTINGS_DIR_NAME
+
+
+def has_postings(index_dir: Path) -> bool:
+    return (postings_dir(index_dir) / "docs.json").exists()
+
+
+def varint_encode(values: np.ndarray) -> np.ndarray:
+    """
+    LEB128: по 7 бита на байт, старшият бит = "следва още байт".
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        n_bytes += rest > 0
+        rest >>= np.uint64(7)
+
+    out = np.empty(int(n_bytes.sum()), dtype=np.uint8)
+    starts = np.zeros(len(values), dtype=np.int64)
+    np.cumsum(n_bytes[:-1], out=starts[1:])
+    for k in range(int(n_bytes.max()) if len(values) else 0):
+        has = n_bytes > k
+        byte = (values[has] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = n_bytes[has] > k + 1
+        out[starts[has] + k] = byte.astype(np.uint8) | (more.astype(np.uint8) << 7)
+    return out
+
+
+def varint_decode(buf: np.ndarray) -> np.ndarray:
+    """
+    Векторизирано: краищата са байтовете без старши бит, а всяка стойност е
+    Σ (byte & 0x7F) << 7*позиция в групата.
+    """
+    buf = np.asarray(buf, dtype=np.uint8)
+    if not len(buf):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    pos = np.arange(len(buf)) - np.repeat(starts, ends - starts + 1)
+    vals = (buf & 0x7F).astype(np.int64) << (7 * pos)
+    return np.add.reduceat(vals, starts)
+
+
+def block_encode(values: np.ndarray, block_size: int = BLOCK_SIZE) -> np.ndarray:
+    values = np.asarray(values, dtype=np.int64)
+    chunks = []
+    for s in range(0, len(values), block_size):
+        block = values[s:s + block_size]
+        width = max(int(block.max()).bit_length(), 1)
+        bits = ((block[:, None] >> np.arange(width)) & 1).astype(np.uint8)
+        chunks.append(np.array([width], dtype=np.uint8))
+        chunks.append(np.packbits(bits.ravel(), bitorder="little"))
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint8)
+
+
+def block_decode(buf: np.ndarray, n: int, block_size: int = BLOCK_SIZE) -> np.ndarray:
+    """
+    n стойности, блок по блок; всеки блок се разпакетира с една numpy операция.
+    """
+    out = np.empty(n, dtype=np.int64)
+    pos = 0
+    for s in range(0, n, block_size):
+        count = min(block_size, n - s)
+        width = int(buf[pos])
+        nbytes = (count * width + 7) // 8
+        bits = np.unpackbits(buf[pos + 1:pos + 1 + nbytes], bitorder="little")[:count * width]
+        out[s:s + count] = bits.reshape(count, width).astype(np.int64) @ (np.int64(1) << np.arange(width, dtype=np.int64))
+        pos += 1 + nbytes
+    return out
+
+
+class PostingsField:
+    """
+    Term-major postings на едно поле. Има същия интерфейс като
+    compact_store.CompactField (cosines, cosines_for, docs_with_any, doc_vector), за да се
+    ползва от CompactTfidfEngine.
+    """
+
+    def __init__(
+        self,
+        terms: List[str],
+        n_docs: int,
+        codec: str,
+        offsets: np.ndarray,
+        counts: np.ndarray,
+        docs: np.ndarray,
+        impacts: np.ndarray,
+        scales: np.ndarray,
+    ):
+        if codec not in CODECS:
+            raise ValueError(f"codec must be one of {CODECS}")
+        self.terms = terms
+        self.term_id = {t: i for i, t in enumerate(terms)}
+        self._n_docs = n_docs
+        self.codec = codec
+        self.offsets = offsets
+        self.counts = counts
+        self.docs = docs
+        self.impacts = impacts
+        self.scales = scales
+        self._by_doc = None
+
+    @property
+    def n_docs(self) -> int:
+        return self._n_docs
+
+    @property
+    def n_postings(self) -> int:
+        return int(self.counts[-1])
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.offsets, self.counts, self.docs, self.impacts, self.scales)
+        return sum(a.nbytes for a in arrays)
+
+    @classmethod
+    def build(
+        cls,
+        doc_ids: List[str],
+        vectors: Mapping[str, Dict[str, float]],
+        codec: str = "varint",
+        doc_norms: Optional[Mapping[str, float]] = None,
+    ) -> "PostingsField":
+        """
+        doc_norms: нормите отпреди статично подрязване (TfidfSearchEngine.doc_norms_text).
+        """
+        if codec not in CODECS:
+            raise ValueError(f"codec must be one of {CODECS}")
+
+        postings: Dict[str, List[Tuple[int, float]]] = {}
+        for idx, doc_id in enumerate(doc_ids):
+            vec = vectors.get(doc_id, {})
+            norm = (doc_norms or {}).get(doc_id)
+            if norm is None:
+                norm = math.sqrt(sum(w * w for w in vec.values()))
+            if not norm:
+                continue
+            for token, w in vec.items():
+                postings.setdefault(token, []).append((idx, w / norm))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        counts = np.zeros(len(terms) + 1, dtype=np.int64)
+        scales = np.ones(len(terms), dtype=np.float32)
+        doc_chunks, impact_chunks = [], []
+        for i, term in enumerate(terms):
+            # doc индексите вече са възходящи – реда на doc_ids
+            idxs = np.fromiter((d for d, _ in postings[term]), dtype=np.int64)
+            weights = np.fromiter((w for _, w in postings[term]), dtype=np.float64)
+
+            gaps = np.diff(idxs, prepend=0)
+            encoded = varint_encode(gaps) if codec == "varint" else block_encode(gaps)
+            doc_chunks.append(encoded)
+            offsets[i + 1] = offsets[i] + len(encoded)
+            counts[i + 1] = counts[i] + len(idxs)
+
+            top = float(np.abs(weights).max())
+            if top > 0:
+                scales[i] = top / IMPACT_MAX
+            impact_chunks.append(np.rint(weights / scales[i]).clip(0, IMPACT_MAX).astype(np.uint8))
+
+        docs = np.concatenate(doc_chunks) if doc_chunks else np.zeros(0, dtype=np.uint8)
+        impacts = np.concatenate(impact_chunks) if impact_chunks else np.zeros(0, dtype=np.uint8)
+        return cls(terms, len(doc_ids), codec, offsets, counts, docs, impacts, scales)
+
+    def postings(self, tid: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (doc индекси, impact-и като float) на един термин
+        """
+        s, e = int(self.offsets[tid]), int(self.offsets[tid + 1])
+        n = int(self.counts[tid + 1] - self.counts[tid])
+        buf = self.docs[s:e]
+        gaps = varint_decode(buf) if self.codec == "varint" else block_decode(buf, n)
+        impacts = self.impacts[self.counts[tid]:self.counts[tid + 1]].astype(np.float64) * float(self.scales[tid])
+        return np.cumsum(gaps), impacts
+
+    def decode_all(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (term id, doc индекс, impact) на всички postings. При varint целият
+        поток се декодира наведнъж, а префиксните суми се нулират на границите.
+        """
+        term_of_posting = np.repeat(np.arange(len(self.terms), dtype=np.int32), np.diff(self.counts))
+        if self.codec == "varint":
+            gaps = varint_decode(self.docs)
+        else:
+            gaps = np.empty(self.n_postings, dtype=np.int64)
+            for tid in range(len(self.terms)):
+                s, e = int(self.counts[tid]), int(self.counts[tid + 1])
+                gaps[s:e] = block_decode(self.docs[self.offsets[tid]:self.offsets[tid + 1]], e - s)
+
+        docs = np.cumsum(gaps)
+        if len(docs):
+            starts = self.counts[:-1]
+            base = np.zeros(len(self.terms), dtype=np.int64)
+            nonempty = starts > 0
+            base[nonempty] = docs[starts[nonempty] - 1]
+            docs -= np.repeat(base, np.diff(self.counts))
+        impacts = self.impacts.astype(np.float64) * np.repeat(self.scales.astype(np.float64), np.diff(self.counts))
+        return term_of_posting, docs, impacts
+
+    def cosines(self, q_vec: Dict[str, float], q_norm: Optional[float] = None) -> Tuple[np.ndarray, int]:
+        """
+        Term-at-a-time: декодират се само postings на термините от заявката.
+        """
+        if q_norm is None:
+            q_norm = math.sqrt(sum(v ** 2 for v in q_vec.values()))
+        out = np.zeros(self.n_docs)
+        if q_norm == 0:
+            return out, 0
+
+        touched = 0
+        for token, q_w in q_vec.items():
+            tid = self.term_id.get(token)
+            if tid is None:
+                continue
+            docs, impacts = self.postings(tid)
+            out[docs] += q_w * impacts
+            touched += len(docs)
+        out /= q_norm
+        return out, touched
+
+    def cosines_for(self, q_vec: Dict[str, float], idxs: np.ndarray, q_norm: Optional[float] = None) -> Tuple[np.ndarray, int]:
+        """
+        cosines само за idxs: postings на термините от заявката са сортирани по
+        документ, така че теглата на idxs се намират с двоично търсене.
+        """
+        if q_norm is None:
+            q_norm = math.sqrt(sum(v ** 2 for v in q_vec.values()))
+        out = np.zeros(len(idxs))
+        if q_norm == 0 or not len(idxs):
+            return out, 0
+
+        touched = 0
+        for token, q_w in q_vec.items():
+            tid = self.term_id.get(token)
+            if tid is None:
+                continue
+            docs, impacts = self.postings(tid)
+            if not len(docs):
+                continue
+            loc = np.minimum(np.searchsorted(docs, idxs), len(docs) - 1)
+            hit = docs[loc] == idxs
+            out[hit] += q_w * impacts[loc[hit]]
+            touched += int(hit.sum())
+        out /= q_norm
+        return out, touched
+
+    def docs_with_any(self, tokens: Collection[str]) -> np.ndarray:
+        mask = np.zeros(self.n_docs, dtype=bool)
+        for token in tokens:
+            tid = self.term_id.get(token)
+            if tid is not None:
+                mask[self.postings(tid)[0]] = True
+        return mask
+
+    def doc_vector(self, idx: int) -> Dict[str, float]:
+        """
+        Нормираният вектор на документа. Doc-major изгледът изисква пълно
+        декодиране и се строи при първа нужда.
+        """
+        if self._by_doc is None:
+            term_of_posting, docs, impacts = self.decode_all()
+            order = np.argsort(docs, kind="stable")
+            starts = np.zeros(self.n_docs + 1, dtype=np.int64)
+            np.cumsum(np.bincount(docs, minlength=self.n_docs), out=starts[1:])
+            self._by_doc = (term_of_posting[order], impacts[order], starts)
+
+        tids, impacts, starts = self._by_doc
+        s, e = starts[idx], starts[idx + 1]
+        return {self.terms[t]: float(w) for t, w in zip(tids[s:e].tolist(), impacts[s:e].tolist())}
+
+    def save(self, out_dir: Path, field: str) -> None:
+        _write_json_atomic(out_dir / f"{field}.terms.json", self.terms)
+        _save_npy_atomic(out_dir / f"{field}.offsets.npy", self.offsets)
+        _save_npy_atomic(out_dir / f"{field}.counts.npy", self.counts)
+        _save_npy_atomic(out_dir / f"{field}.docs.npy", self.docs)
+        _save_npy_atomic(out_dir / f"{field}.impacts.npy", self.impacts)
+        _save_npy_atomic(out_dir / f"{field}.scales.npy", self.scales)
+
+    @classmethod
+    def load(cls, in_dir: Path, field: str, n_docs: int, codec: str, mmap_mode: Optional[str] = None) -> "PostingsField":
+        with (in_dir / f"{field}.terms.json").open(encoding="utf-8") as f:
+            terms = json.load(f)
+        return cls(
+            terms,
+            n_docs,
+            codec,
+            *(np.load(in_dir / f"{field}.{name}.npy", mmap_mode=mmap_mode)
+              for name in ("offsets", "counts", "docs", "impacts", "scales")),
+        )
+
+
+class PostingsTfidfEngine(CompactTfidfEngine):
+    """
+    Търсенето на CompactTfidfEngine върху PostingsField вместо CSR по документи.
+    """
+
+    @classmethod
+    def from_engine(cls, engine, codec: str = "varint") -> "PostingsTfidfEngine":
+        doc_ids = list(engine.tfidf_docs_text.keys())
+        fields = {
+            "text": PostingsField.build(doc_ids, engine.tfidf_docs_text, codec, getattr(engine, "doc_norms_text", None)),
+            "legal": PostingsField.build(doc_ids, engine.tfidf_docs_legal, codec),
+        }
+        return cls(doc_ids, dict(engine.idf_text), dict(engine.idf_legal), fields)
+
+    @property
+    def codec(self) -> str:
+        return self.fields["text"].codec
+
+    def save(self, index_dir: Path, source: Optional[str] = None) -> None:
+        """
+        source: вж. CompactTfidfEngine.save
+        """
+        def write(out_dir: Path) -> None:
+            for field, postings in self.fields.items():
+                postings.save(out_dir, field)
+            _write_json_atomic(out_dir / "meta.json", {"codec": self.codec, "block_size": BLOCK_SIZE})
+            _write_json_atomic(out_dir / "idf_text.json", self.idf_text)
+            _write_json_atomic(out_dir / "idf_legal.json", self.idf_legal)
+            _write_json_atomic(out_dir / "docs.json", self.doc_ids)
+
+        if source is None:
+            source = source_generation(index_dir)
+        save_dir_atomic(postings_dir(index_dir), write, source)
+
+    @classmethod
+    def load(cls, index_dir: Path, mmap_mode: Optional[str] = None) -> "PostingsTfidfEngine":
+        return load_dir_consistent(postings_dir(index_dir), lambda: cls._load(index_dir, mmap_mode))
+
+    @classmethod
+    def _load(cls, index_dir: Path, mmap_mode: Optional[str] = None) -> "PostingsTfidfEngine":
+        in_dir = postings_dir(index_dir)
+        with (in_dir / "docs.json").open(encoding="utf-8") as f:
+            doc_ids = json.load(f)
+        with (in_dir / "meta.json").open(encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("block_size", BLOCK_SIZE) != BLOCK_SIZE:
+            raise ValueError(f"{in_dir}: block_size {meta['block_size']} != {BLOCK_SIZE}")
+        with (in_dir / "idf_text.json").open(encoding="utf-8") as f:
+            idf_text = json.load(f)
+        with (in_dir / "idf_legal.json").open(encoding="utf-8") as f:
+            idf_legal = json.load(f)
+        fields = {
+            field: PostingsField.load(in_dir, field, len(doc_ids), meta["codec"], mmap_mode)
+            for field in FIELDS
+        }
+        return cls(doc_ids, idf_text, idf_legal, fields)
+
+
+def main():
+    import argparse
+
+    from index_store import load_json_engine
+    from tf_idf_index_builder import INDEX_DIR
+
+    p = argparse.ArgumentParser("Convert the JSON index into compressed term-major postings")
+    p.add_argument("--index_dir", type=str, default=str(INDEX_DIR))
+    p.add_argument("--codec", type=str, default="varint", choices=CODECS)
+    args = p.parse_args()
+
+    index_dir = Path(args.index_dir)
+    source = source_generation(index_dir)
+    engine = PostingsTfidfEngine.from_engine(load_json_engine(index_dir), args.codec)
+    engine.save(index_dir, source)
+    n_postings = sum(f.n_postings for f in engine.fields.values())
+    print(
+        f"Postings index ({args.codec}): {len(engine.doc_ids)} documents, {n_postings} postings, "
+        f"{engine.nbytes / max(n_postings, 1):.2f} bytes/posting"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Подрязване на заявката: PDF заявката е цяло решение с хиляди text термина,
+# повечето с нищожно тегло след IDF. Пазят се само top_n най-тежките термина
+# и/или най-малкото множество, което покрива mass от L2 масата (Σ w²) на
+# вектора – поотделно за всяко поле.
+# Подрязването е върху токените (изхвърлят се всички срещания на отрязаните
+# термини), така че TF на останалите не се променя и работи с всеки engine.
+# Косинусите се делят на нормите на неподрязаната заявка (query_norms на
+# engine.search): иначе всяко поле се надува с ~1/sqrt(запазената маса) поотделно
+# и ефективните W_TEXT/W_LEGAL се изместват (напр. при подрязване само на text).
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import math
+import time
+
+from tf_idf_engine import QueryNorms
+
+
+@dataclass(frozen=True)
+class QueryPruning:
+    """
+    None – без ограничение по този критерий; при двата – по-строгият.
+    """
+    text_top_n: Optional[int] = None
+    text_mass: Optional[float] = None
+    legal_top_n: Optional[int] = None
+    legal_mass: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return any(v is not None for v in (self.text_top_n, self.text_mass, self.legal_top_n, self.legal_mass))
+
+
+def kept_terms(vec: Dict[str, float], top_n: Optional[int] = None, mass: Optional[float] = None) -> Set[str]:
+    """
+    Термините на vec, подредени по |w| (при равенство – по име, за стабилност),
+    до top_n броя и докато натрупаната Σ w² достигне mass от общата.
+    """
+    if top_n is None and mass is None:
+        return set(vec)
+
+    ranked = sorted(vec, key=lambda t: (-abs(vec[t]), t))
+    if top_n is not None:
+        ranked = ranked[:max(top_n, 0)]
+
+    if mass is not None and mass < 1.0:
+        target = mass * sum(w * w for w in vec.values())
+        acc = 0.0
+        for i, t in enumerate(ranked):
+            if acc >= target:
+                ranked = ranked[:i]
+                break
+            acc += vec[t] * vec[t]
+    return set(ranked)
+
+
+def prune_query_tokens(
+    engine,
+    query_text_tokens: List[str],
+    query_legal_tokens: List[str],
+    pruning: Optional[QueryPruning],
+    stats: Optional[Dict[str, int]] = None,
+) -> Tuple[List[str], List[str], QueryNorms]:
+    """
+    (text токени, legal токени, query_norms): токените без тези на отрязаните
+    термини и (text, legal) нормите на неподрязаната заявка – за engine.search(query_norms=).
+    Без подрязване query_norms е None. В stats: query_terms и query_terms_kept
+    (двете полета заедно).
+    """
+    if pruning is None or not pruning.enabled:
+        return query_text_tokens, query_legal_tokens, None
+
+    q_text_vec, q_legal_vec = engine.vectorize_query(query_text_tokens, query_legal_tokens)
+    keep_text = kept_terms(q_text_vec, pruning.text_top_n, pruning.text_mass)
+    keep_legal = kept_terms(q_legal_vec, pruning.legal_top_n, pruning.legal_mass)
+
+    if stats is not None:
+        stats["query_terms"] = len(q_text_vec) + len(q_legal_vec)
+        stats["query_terms_kept"] = len(keep_text) + len(keep_legal)
+
+    return (
+        [t for t in query_text_tokens if t in keep_text],
+        [t for t in query_legal_tokens if t in keep_legal],
+        tuple(math.sqrt(sum(w * w for w in vec.values())) for vec in (q_text_vec, q_legal_vec)),
+    )
+
+
+def pruning_report(
+    engine,
+    queries: Iterable[Tuple[List[str], List[str]]],
+    pruning: QueryPruning,
+    top_k: int = 10,
+) -> Dict[str, float]:
+    """
+    Латентност на engine.search с и без подрязване (подрязването се брои към
+    времето) и припокриване на top_k с неподрязаното търсене.
+    """
+    full_s = pruned_s = 0.0
+    overlaps = []
+    kept = []
+    for text_tokens, legal_tokens in queries:
+        t0 = time.perf_counter()
+        expected = engine.search(text_tokens, legal_tokens, top_k=top_k)
+        full_s += time.perf_counter() - t0
+
+        stats = {}
+        t0 = time.perf_counter()
+        pruned_text, pruned_legal, query_norms = prune_query_tokens(engine, text_tokens, legal_tokens, pruning, stats)
+        got = engine.search(pruned_text, pruned_legal, top_k=top_k, query_norms=query_norms)
+        pruned_s += time.perf_counter() - t0
+
+        expected_ids = {d for d, s in expected if s > 0}
+        got_ids = {d for d, _ in got}
+        overlaps.append(len(expected_ids & got_ids) / len(expected_ids) if expected_ids else 1.0)
+        kept.append(stats.get("query_terms_kept", 0) / max(stats.get("query_terms", 0), 1))
+
+    n = max(len(overlaps), 1)
+    return {
+        "full_ms": 1000 * full_s / n,
+        "pruned_ms": 1000 * pruned_s / n,
+        "speedup": full_s / (pruned_s or 1e-12),
+        f"overlap_at_{top_k}": sum(overlaps) / n,
+        "min_overlap": min(overlaps, default=1.0),
+        "terms_kept": sum(kept) / n,
+    }
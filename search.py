@@ -1,47 +1,220 @@
+from functools import partial
 from pathlib import Path
-import json
+from typing import List, Optional
+import os
 
+from ann_index import AnnIndex, approximate_search
+from document_metadata import DocumentMetadataStore, MetadataFilter
+from engine_holder import EngineHolder, IndexVersion
+from index_store import load_engine
+from legal_trie import LegalReferenceTrie, parse_cites
+from metrics import record_search_stats, span
+from query_pruning import QueryPruning, prune_query_tokens
 from text_preprocessing import process_pdf
-from tf_idf_engine import TfidfSearchEngine
+from tf_idf_engine import two_stage_search
 
 BASE_DIR = Path(__file__).resolve().parent
 INDEX_DIR = BASE_DIR / "index"
 
 
-def load_engine() -> TfidfSearchEngine:
-    engine = TfidfSearchEngine()
+# компактният/сегментираният индекс се чете през mmap, за да го делят worker-ите
+# (вж. gunicorn.conf.py). На Windows mmap-нат файл не може да бъде заменен,
+# докато сървърът работи, затова там масивите се зареждат в паметта.
+INDEX_MMAP = os.name != "nt"
 
-    with (INDEX_DIR / "documents_text_tokens.json").open(encoding="utf-8") as f:
-        engine.documents_text_tokens = json.load(f)
+# Индексът не се зарежда при import: api.py го зарежда във фонов thread при
+# старт (вж. /readyz), gunicorn.conf.py – в master процеса, а CLI скриптовете
+# викат HOLDER.ensure_loaded(). По-късно – HOLDER.reload() без рестарт.
+HOLDER = EngineHolder(INDEX_DIR, loader=partial(load_engine, mmap=INDEX_MMAP))
 
-    with (INDEX_DIR / "documents_legal_tokens.json").open(encoding="utf-8") as f:
-        engine.documents_legal_tokens = json.load(f)
+# колко препратки показваме за резултат
+MAX_REFERENCES = 3
 
-    with (INDEX_DIR / "idf_text.json").open(encoding="utf-8") as f:
-        engine.idf_text = {k: float(v) for k, v in json.load(f).items()}
+# двуетапно търсене: кандидати по общи LEGAL препратки, после пълен score върху тях
+# (вж. "prefilter" етапа в benchmark.py за recall/latency)
+LEGAL_PREFILTER = False
 
-    with (INDEX_DIR / "idf_legal.json").open(encoding="utf-8") as f:
-        engine.idf_legal = {k: float(v) for k, v in json.load(f).items()}
+# приблизително търсене: IVF кандидати върху хеширани плътни вектори, точен score
+# върху тях (вж. ann_index.py и "ann" етапа в benchmark.py за recall/latency)
+ANN_SEARCH = False
 
-    with (INDEX_DIR / "tfidf_docs_text.json").open(encoding="utf-8") as f:
-        engine.tfidf_docs_text = {
-            doc_id: {k: float(v) for k, v in vec.items()}
-            for doc_id, vec in json.load(f).items()
-        }
+# подрязване на заявката по ендпойнт (вж. query_pruning.py; "query_pruning"
+# етапа в benchmark.py и evaluation.py --prune_report за латентност/припокриване).
+# QueryPruning() – без подрязване; /search/pdf го позволява и през query параметри.
+QUERY_PRUNING = {
+    "/search/pdf": QueryPruning(),
+    "evaluation": QueryPruning(),
+}
 
-    with (INDEX_DIR / "tfidf_docs_legal.json").open(encoding="utf-8") as f:
-        engine.tfidf_docs_legal = {
-            doc_id: {k: float(v) for k, v in vec.items()}
-            for doc_id, vec in json.load(f).items()
-        }
+def _per_snapshot(current: IndexVersion, name: str, build):
+    """
+    build(engine) веднъж за версията на индекса – и наново, ако сегментираният
+    engine е сменил snapshot-а си. Кешът държи самия snapshot и го сравнява с
+    `is`: id() на освободен snapshot може да се падне на новия.
+    """
+    engine = current.engine
+    snapshot = getattr(engine, "snapshot", engine)
 
-    return engine
+    cached = current.cache.get(name)
+    if cached is None or cached[0] is not snapshot:
+        with span(name):
+            cached = (snapshot, build(engine))
+        current.cache[name] = cached
+    return cached[1]
 
 
-# Load ONCE at startup
-ENGINE = load_engine()
+def legal_trie(current: Optional[IndexVersion] = None) -> LegalReferenceTrie:
+    """
+    Строи се при първия cites филтър за версията на индекса (и при нов snapshot).
+    """
+    return _per_snapshot(current or HOLDER.current, "legal_trie", LegalReferenceTrie.from_engine)
 
 
-def tf_idf_search(query_pdf_path: Path, top_k: int = 5):
+def ann_index(current: Optional[IndexVersion] = None) -> AnnIndex:
+    """
+    Строи се при първата ANN заявка за версията на индекса (и при нов snapshot).
+    """
+    return _per_snapshot(current or HOLDER.current, "ann_index", AnnIndex.from_engine)
+
+
+def metadata_store(current: Optional[IndexVersion] = None) -> DocumentMetadataStore:
+    """
+    Колоните с метаданни (вж. document_metadata.py) по реда на документите в
+    engine-а – при първия филтър за версията на индекса (и при нов snapshot).
+    """
+    return _per_snapshot(
+        current or HOLDER.current,
+        "metadata_store",
+        lambda engine: DocumentMetadataStore.from_engine(engine, HOLDER.index_dir),
+    )
+
+
+def cited_documents(cites: List[str], current: Optional[IndexVersion] = None) -> set:
+    """
+    Документите, които цитират всяка от препратките (на кое да е подниво).
+    ValueError при невалидна препратка.
+    """
+    trie = legal_trie(current)
+    return trie.documents(trie.citing_all(parse_cites(c) for c in cites))
+
+
+def _engine_search(
+    query_text_tokens,
+    query_legal_tokens,
+    top_k: int,
+    cites: Optional[List[str]] = None,
+    current: Optional[IndexVersion] = None,
+    pruning: Optional[QueryPruning] = None,
+    filters: Optional[MetadataFilter] = None,
+):
+    """
+    cites и filters се прилагат преди оценяването: search() получава само
+    минаващите документи като candidates.
+    """
+    current = current or HOLDER.current
+    engine = current.engine
+
+    stats = {}
+    query_norms = None
+    if pruning is not None and pruning.enabled:
+        with span("query_pruning"):
+            query_text_tokens, query_legal_tokens, query_norms = prune_query_tokens(
+                engine, query_text_tokens, query_legal_tokens, pruning, stats
+            )
+
+    candidates = None
+    if cites:
+        candidates = cited_documents(cites, current)
+        if not candidates:
+            return []
+
+    if filters is not None and filters.enabled:
+        with span("metadata_filter"):
+            filtered = metadata_store(current).documents(filters)
+        candidates = filtered if candidates is None else candidates & filtered
+        if not candidates:
+            return []
+
+    with span("search"):
+        if LEGAL_PREFILTER:
+            results = two_stage_search(
+                engine, query_text_tokens, query_legal_tokens, top_k=top_k, stats=stats, candidates=candidates,
+                query_norms=query_norms,
+            )
+        elif ANN_SEARCH and candidates is None:
+            results = approximate_search(
+                engine, ann_index(current), query_text_tokens, query_legal_tokens, top_k=top_k, stats=stats,
+                query_norms=query_norms,
+            )
+        else:
+            results = engine.search(
+                query_text_tokens, query_legal_tokens, top_k=top_k, stats=stats, candidates=candidates,
+                query_norms=query_norms,
+            )
+    record_search_stats(stats)
+    return results
+
+
+def tf_idf_search(
+    query_pdf_path: Path,
+    top_k: int = 5,
+    cites: Optional[List[str]] = None,
+    pruning: Optional[QueryPruning] = None,
+    filters: Optional[MetadataFilter] = None,
+):
+    query_text_tokens, query_legal_tokens = process_pdf(query_pdf_path)
+    return _engine_search(query_text_tokens, query_legal_tokens, top_k, cites, pruning=pruning, filters=filters)
+
+
+def matching_references(engine, q_legal_vec, doc_id: str, limit: int = MAX_REFERENCES) -> list[str]:
+    """
+    Общите LEGAL токени, подредени по приноса им към legal косинуса.
+    """
+    d_legal_vec = engine.tfidf_docs_legal.get(doc_id, {})
+    common = q_legal_vec.keys() & d_legal_vec.keys()
+    ranked = sorted(common, key=lambda t: q_legal_vec[t] * d_legal_vec[t], reverse=True)
+    return ranked[:limit]
+
+
+def tf_idf_search_with_highlights(
+    query_pdf_path: Path,
+    top_k: int = 5,
+    cites: Optional[List[str]] = None,
+    include_duplicates: bool = False,
+    pruning: Optional[QueryPruning] = None,
+    filters: Optional[MetadataFilter] = None,
+) -> list[dict]:
+    """
+    pruning: None – QUERY_PRUNING["/search/pdf"]. Препратките в резултатите се
+    търсят по цялата (неподрязана) заявка.
+    """
     query_text_tokens, query_legal_tokens = process_pdf(query_pdf_path)
-    return ENGINE.search(query_text_tokens, query_legal_tokens, top_k=top_k)
+    if pruning is None:
+        pruning = QUERY_PRUNING["/search/pdf"]
+
+    # цялата заявка върви върху една и съща версия, дори ако междувременно има reload
+    current = HOLDER.current
+    results = _engine_search(query_text_tokens, query_legal_tokens, top_k, cites, current, pruning, filters)
+
+    with span("snippets"):
+        # сегментите, дошли с refresh на manifest-а, носят нови части със snippets
+        snapshot = getattr(current.engine, "snapshot", None)
+        current.snippets.sync(getattr(snapshot, "generation", None))
+        _, q_legal_vec = current.engine.vectorize_query([], query_legal_tokens)
+
+        out = [
+            {
+                "document": doc_id,
+                "score": score,
+                "references": current.snippets.highlights(
+                    doc_id, matching_references(current.engine, q_legal_vec, doc_id)
+                ),
+            }
+            for doc_id, score in results
+        ]
+
+    if include_duplicates:
+        # почти еднаквите актове не са в индекса – връщат се към представителя си
+        for r in out:
+            r["duplicates"] = current.duplicates.get(r["document"], [])
+    return out
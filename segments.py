@@ -0,0 +1,935 @@
+# Сегментиран индекс (LSM):
+#   index/segments/manifest.json   – кои сегменти са живи + tombstones; сменя се атомарно
+#   index/segments/<name>/         – непроменим сегмент:
+#       docs.json                    doc table (локален индекс -> doc_id)
+#       <field>.terms.json           речник, сортиран
+#       <field>.offsets.npy          int64, postings на term i са в [offsets[i], offsets[i+1])
+#       <field>.docs.npy             int32 локални doc индекси
+#       <field>.weights.npy          float64 tf * legal boost (без idf)
+# DF на term-а в сегмента е дължината на postings списъка му, така че глобалните
+# DF/IDF и нормите на документите се смятат при всеки snapshot, без да се пипат сегментите.
+from pathlib import Path
+from typing import Collection, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+import heapq
+import json
+import math
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from compact_store import source_generation, source_mismatch
+from near_duplicates import load_duplicates
+from tf_idf_engine import (
+    W_LEGAL,
+    W_TEXT,
+    BatchQuery,
+    QueryNorms,
+    compute_idf_from_df,
+    compute_tf_from_counts,
+    compute_tfidf_vector,
+    split_batch_query,
+    token_boost_legal,
+    two_stage_search,
+)
+
+SEGMENTS_DIR_NAME = "segments"
+MANIFEST_NAME = "manifest.json"
+FIELDS = ("text", "legal")
+
+# tiered merge: сливаме MERGE_FACTOR сегмента от едно и също ниво по размер
+MERGE_FACTOR = 4
+MERGE_INTERVAL = 30.0
+
+# колко често search() проверява за нов manifest
+REFRESH_INTERVAL = 1.0
+
+# слети сегменти се трият чак толкова секунди след като излязат от manifest-а:
+# читател, започнал да зарежда стария manifest, трябва да успее да го довърши
+GC_GRACE_SECONDS = 60.0
+
+
+def segments_dir(index_dir: Path) -> Path:
+    return index_dir / SEGMENTS_DIR_NAME
+
+
+def has_segments(index_dir: Path) -> bool:
+    return (segments_dir(index_dir) / MANIFEST_NAME).exists()
+
+
+def read_manifest(index_dir: Path) -> dict:
+    path = segments_dir(index_dir) / MANIFEST_NAME
+    if not path.exists():
+        return {"generation": 0, "segments": [], "tombstones": {}}
+    with path.open(encoding="utf-8") as f:
+        return json.load(f)
+
+
+def manifest_stale_reason(index_dir: Path) -> Optional[str]:
+    """
+    Защо сегментите не съответстват на JSON индекса (None – съответстват):
+    tf_idf_index_builder е преизчислил индекса след seed_from_counts.
+    """
+    return source_mismatch(index_dir, read_manifest(index_dir).get("source"))
+
+
+def _write_json_atomic(path: Path, obj) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def write_segment(
+    index_dir: Path,
+    name: str,
+    records: Iterable[Tuple[str, Dict[str, int], Dict[str, int]]],
+) -> int:
+    """
+    records: (doc_id, text_counts, legal_counts). Връща броя документи.
+    Сегментът се появява под крайното си име наведнъж (os.replace на директорията).
+    """
+    doc_ids: List[str] = []
+    postings = {field: {} for field in FIELDS}
+
+    for doc_id, text_counts, legal_counts in records:
+        idx = len(doc_ids)
+        doc_ids.append(doc_id)
+        for field, counts in zip(FIELDS, (text_counts, legal_counts)):
+            field_postings = postings[field]
+            for token, tf in compute_tf_from_counts(counts).items():
+                if field == "legal":
+                    tf *= token_boost_legal(token)
+                field_postings.setdefault(token, []).append((idx, tf))
+
+    tmp_dir = segments_dir(index_dir) / f"{name}.tmp"
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    _write_json_atomic(tmp_dir / "docs.json", doc_ids)
+    for field in FIELDS:
+        terms = sorted(postings[field])
+        lists = [postings[field][t] for t in terms]
+        _write_field(tmp_dir, field, terms, lists)
+
+    os.replace(tmp_dir, segments_dir(index_dir) / name)
+    return len(doc_ids)
+
+
+def _write_field(seg_dir: Path, field: str, terms: List[str], lists: List[List[Tuple[int, float]]]) -> None:
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(p) for p in lists])
+    docs = np.fromiter((idx for p in lists for idx, _ in p), dtype=np.int32, count=int(offsets[-1]))
+    weights = np.fromiter((w for p in lists for _, w in p), dtype=np.float64, count=int(offsets[-1]))
+    _save_field(seg_dir, field, terms, offsets, docs, weights)
+
+
+def _save_field(seg_dir: Path, field: str, terms: List[str], offsets, docs, weights) -> None:
+    _write_json_atomic(seg_dir / f"{field}.terms.json", terms)
+    np.save(seg_dir / f"{field}.offsets.npy", offsets)
+    np.save(seg_dir / f"{field}.docs.npy", docs)
+    np.save(seg_dir / f"{field}.weights.npy", weights)
+
+
+class SegmentField:
+    def __init__(self, terms: List[str], offsets: np.ndarray, docs: np.ndarray, weights: np.ndarray):
+        self.terms = terms
+        self.term_id = {t: i for i, t in enumerate(terms)}
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self._term_of_posting = None
+        self._by_doc = None
+
+    @property
+    def term_of_posting(self) -> np.ndarray:
+        if self._term_of_posting is None:
+            self._term_of_posting = np.repeat(
+                np.arange(len(self.terms), dtype=np.int32), np.diff(self.offsets)
+            )
+        return self._term_of_posting
+
+    def live_df(self, live: np.ndarray) -> np.ndarray:
+        if len(self.docs) == 0:
+            return np.zeros(len(self.terms), dtype=np.int64)
+        # няма празни postings списъци, така че reduceat е коректен
+        return np.add.reduceat(live[self.docs].astype(np.int64), self.offsets[:-1])
+
+    def norms(self, idf: np.ndarray, n_docs: int) -> np.ndarray:
+        w = self.weights * idf[self.term_of_posting]
+        return np.sqrt(np.bincount(self.docs, weights=w * w, minlength=n_docs))
+
+    def doc_postings(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (term ids, weights) на един документ – doc-major изгледът се строи при първа нужда
+        """
+        if self._by_doc is None:
+            order = np.argsort(self.docs, kind="stable")
+            counts = np.bincount(self.docs, minlength=int(self.docs.max()) + 1 if len(self.docs) else 0)
+            starts = np.zeros(len(counts) + 1, dtype=np.int64)
+            starts[1:] = np.cumsum(counts)
+            self._by_doc = (order, starts)
+
+        order, starts = self._by_doc
+        if idx + 1 >= len(starts):
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        sel = order[starts[idx]:starts[idx + 1]]
+        return self.term_of_posting[sel], self.weights[sel]
+
+
+class Segment:
+    def __init__(self, path: Path, mmap_mode: Optional[str] = None):
+        self.path = path
+        self.name = path.name
+        with (path / "docs.json").open(encoding="utf-8") as f:
+            self.doc_ids: List[str] = json.load(f)
+        self.doc_index = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+
+        self.fields: Dict[str, SegmentField] = {}
+        for field in FIELDS:
+            with (path / f"{field}.terms.json").open(encoding="utf-8") as f:
+                terms = json.load(f)
+            self.fields[field] = SegmentField(
+                terms,
+                np.load(path / f"{field}.offsets.npy", mmap_mode=mmap_mode),
+                np.load(path / f"{field}.docs.npy", mmap_mode=mmap_mode),
+                np.load(path / f"{field}.weights.npy", mmap_mode=mmap_mode),
+            )
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_ids)
+
+
+class _SegmentView:
+    """
+    Сегмент в конкретен snapshot: live маска, idf по term id и норми.
+    """
+
+    def __init__(self, segment: Segment, live: np.ndarray, base: int):
+        self.segment = segment
+        self.live = live
+        # глобален индекс (сред живите документи) или -1
+        self.global_idx = np.full(segment.n_docs, -1, dtype=np.int64)
+        self.global_idx[live] = base + np.arange(int(live.sum()))
+        self.idf: Dict[str, np.ndarray] = {}
+        self.norms: Dict[str, np.ndarray] = {}
+
+
+class IndexSnapshot:
+    """
+    Непроменим изглед върху набор сегменти; търсенето работи само с него,
+    така че смяната на snapshot-а е едно присвояване.
+    """
+
+    def __init__(self, generation: int, segments: List[Segment], tombstones: Dict[str, List[int]]):
+        self.generation = generation
+        self.views: List[_SegmentView] = []
+        self.doc_ids: List[str] = []
+
+        for segment in segments:
+            live = np.ones(segment.n_docs, dtype=bool)
+            dead = tombstones.get(segment.name)
+            if dead:
+                live[np.asarray(dead, dtype=np.int64)] = False
+            view = _SegmentView(segment, live, len(self.doc_ids))
+            self.views.append(view)
+            self.doc_ids.extend(d for d, alive in zip(segment.doc_ids, live) if alive)
+
+        self.N = len(self.doc_ids)
+        self.idf: Dict[str, Dict[str, float]] = {}
+
+        for field in FIELDS:
+            df: Dict[str, int] = {}
+            for view in self.views:
+                f = view.segment.fields[field]
+                for term, count in zip(f.terms, f.live_df(view.live).tolist()):
+                    if count:
+                        df[term] = df.get(term, 0) + count
+            idf = compute_idf_from_df(df, self.N)
+            self.idf[field] = idf
+
+            for view in self.views:
+                f = view.segment.fields[field]
+                view.idf[field] = np.array([idf.get(t, 0.0) for t in f.terms], dtype=np.float64)
+                view.norms[field] = f.norms(view.idf[field], view.segment.n_docs)
+
+    def locate(self, doc_id: str) -> Optional[Tuple[_SegmentView, int]]:
+        # по-новите сегменти имат предимство
+        for view in reversed(self.views):
+            idx = view.segment.doc_index.get(doc_id)
+            if idx is not None and view.live[idx]:
+                return view, idx
+        return None
+
+
+def _doc_mask(segment: Segment, doc_ids: Collection[str]) -> np.ndarray:
+    mask = np.zeros(segment.n_docs, dtype=bool)
+    if len(doc_ids) < segment.n_docs:
+        idxs = [segment.doc_index[d] for d in doc_ids if d in segment.doc_index]
+        mask[idxs] = True
+    else:
+        mask[:] = [d in doc_ids for d in segment.doc_ids]
+    return mask
+
+
+class _FieldVectors(Mapping):
+    """
+    Read-only doc_id -> нормализиран TF-IDF вектор, за код, който очаква
+    engine.tfidf_docs_text / tfidf_docs_legal.
+    """
+
+    def __init__(self, engine: "SegmentedTfidfEngine", field: str):
+        self.engine = engine
+        self.field = field
+
+    def __getitem__(self, doc_id: str) -> Dict[str, float]:
+        snapshot = self.engine.snapshot
+        found = snapshot.locate(doc_id)
+        if found is None:
+            raise KeyError(doc_id)
+        view, idx = found
+        f = view.segment.fields[self.field]
+        norm = view.norms[self.field][idx]
+        if not norm:
+            return {}
+        term_ids, weights = f.doc_postings(idx)
+        values = weights * view.idf[self.field][term_ids] / norm
+        return {f.terms[t]: float(w) for t, w in zip(term_ids.tolist(), values.tolist()) if w}
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.engine.snapshot.doc_ids)
+
+    def __len__(self) -> int:
+        return self.engine.snapshot.N
+
+
+class SegmentedTfidfEngine:
+    """
+    Същото API за търсене като TfidfSearchEngine, върху сегментиран индекс.
+    Нов manifest се зарежда във фонов thread; търсенията дотогава ползват стария snapshot.
+    """
+
+    def __init__(
+        self,
+        index_dir: Path,
+        refresh_interval: Optional[float] = REFRESH_INTERVAL,
+        mmap_mode: Optional[str] = None,
+    ):
+        self.index_dir = index_dir
+        self.refresh_interval = refresh_interval
+        self.mmap_mode = mmap_mode
+        self._segments: Dict[str, Segment] = {}
+        self._refresh_lock = threading.Lock()
+        self._last_check = time.monotonic()
+        self._manifest_mtime = None
+        self.snapshot = self._load_snapshot()
+
+        self.tfidf_docs_text = _FieldVectors(self, "text")
+        self.tfidf_docs_legal = _FieldVectors(self, "legal")
+
+    @property
+    def idf_text(self) -> Dict[str, float]:
+        return self.snapshot.idf["text"]
+
+    @property
+    def idf_legal(self) -> Dict[str, float]:
+        return self.snapshot.idf["legal"]
+
+    def _load_snapshot(self) -> IndexSnapshot:
+        """
+        mtime-ът на manifest-а се запомня едва след успешно зареждане, така че
+        неуспешен опит (напр. изтрит сегмент) се повтаря при следващата проверка.
+        """
+        manifest_path = segments_dir(self.index_dir) / MANIFEST_NAME
+        mtime = manifest_path.stat().st_mtime_ns if manifest_path.exists() else None
+        manifest = read_manifest(self.index_dir)
+
+        names = [s["name"] for s in manifest["segments"]]
+        segments = []
+        for name in names:
+            segment = self._segments.get(name)
+            if segment is None:
+                segment = Segment(segments_dir(self.index_dir) / name, self.mmap_mode)
+            segments.append(segment)
+        snapshot = IndexSnapshot(manifest["generation"], segments, manifest.get("tombstones", {}))
+
+        # сегментите са непроменими – пазим само тези от текущия manifest
+        self._segments = dict(zip(names, segments))
+        self._manifest_mtime = mtime
+        return snapshot
+
+    def refresh(self) -> bool:
+        """
+        Зарежда manifest-а наново, ако е сменен. Връща True при нов snapshot.
+        """
+        with self._refresh_lock:
+            manifest_path = segments_dir(self.index_dir) / MANIFEST_NAME
+            mtime = manifest_path.stat().st_mtime_ns if manifest_path.exists() else None
+            if mtime == self._manifest_mtime:
+                return False
+            try:
+                snapshot = self._load_snapshot()
+            except (OSError, ValueError):
+                # manifest-ът се е сменил по време на зареждането; ще опитаме пак
+                return False
+            if snapshot.generation == self.snapshot.generation:
+                return False
+            self.snapshot = snapshot
+            return True
+
+    def _maybe_refresh(self) -> None:
+        if self.refresh_interval is None:
+            return
+        now = time.monotonic()
+        if now - self._last_check < self.refresh_interval or self._refresh_lock.locked():
+            return
+        self._last_check = now
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def vectorize_query(self, text_tokens: List[str], legal_tokens: List[str]) -> Tuple[Dict[str, float], Dict[str, float]]:
+        snapshot = self.snapshot
+        q_text = compute_tfidf_vector(text_tokens, snapshot.idf["text"], is_legal_field=False)
+        q_legal = compute_tfidf_vector(legal_tokens, snapshot.idf["legal"], is_legal_field=True)
+        return q_text, q_legal
+
+    @staticmethod
+    def _field_cosines(
+        view: _SegmentView,
+        field: str,
+        q_vec: Dict[str, float],
+        q_norm: Optional[float] = None,
+        idxs: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, int]:
+        """
+        cosine за всички документи в сегмента (0 за тези без общ токен) и брой postings;
+        q_norm – нормата на заявката преди подрязване (None – от q_vec).
+        idxs (сортирани локални индекси): само за тези документи, по реда на idxs –
+        postings на term са сортирани по документ, така че теглата им се
+        намират с двоично търсене и другите документи не се оценяват.
+        """
+        f = view.segment.fields[field]
+        idf = view.idf[field]
+        dots = np.zeros(view.segment.n_docs if idxs is None else len(idxs))
+        touched = 0
+
+        if q_norm is None:
+            q_norm = math.sqrt(sum(v ** 2 for v in q_vec.values()))
+        if q_norm == 0:
+            return dots, 0
+
+        for token, q_w in q_vec.items():
+            tid = f.term_id.get(token)
+            if tid is None:
+                continue
+            s, e = f.offsets[tid], f.offsets[tid + 1]
+            if idxs is None:
+                # всеки документ се среща най-много веднъж в postings на term
+                dots[f.docs[s:e]] += (q_w * idf[tid]) * f.weights[s:e]
+                touched += int(e - s)
+                continue
+            docs = f.docs[s:e]
+            loc = np.minimum(np.searchsorted(docs, idxs), len(docs) - 1)
+            hit = docs[loc] == idxs
+            dots[hit] += (q_w * idf[tid]) * f.weights[s:e][loc[hit]]
+            touched += int(hit.sum())
+
+        norms = view.norms[field] if idxs is None else view.norms[field][idxs]
+        np.divide(dots, q_norm * norms, out=dots, where=norms > 0)
+        dots[norms == 0] = 0.0
+        return dots, touched
+
+    def _segment_scores(
+        self, view: _SegmentView, q_vecs, query_norms: QueryNorms = None, idxs: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, int]:
+        scores = np.zeros(view.segment.n_docs if idxs is None else len(idxs))
+        touched = 0
+        for field, q_vec, q_norm, weight in zip(FIELDS, q_vecs, query_norms or (None, None), (W_TEXT, W_LEGAL)):
+            cos, t = self._field_cosines(view, field, q_vec, q_norm, idxs)
+            scores += weight * cos
+            touched += t
+        return scores, touched
+
+    def search(
+        self,
+        query_text_tokens: List[str],
+        query_legal_tokens: List[str],
+        top_k: int = 5,
+        min_score: float = 0.0,
+        stats: Optional[Dict[str, int]] = None,
+        candidates: Optional[Collection[str]] = None,
+        query_norms: QueryNorms = None
+    ) -> List[Tuple[str, float]]:
+        self._maybe_refresh()
+        snapshot = self.snapshot
+        q_vecs = self.vectorize_query(query_text_tokens, query_legal_tokens)
+
+        ranked = []
+        documents_scored = 0
+        postings_touched = 0
+        for seg_order, view in enumerate(snapshot.views):
+            if candidates is None:
+                scores, touched = self._segment_scores(view, q_vecs, query_norms)
+                idxs = np.flatnonzero(view.live)
+                scores = scores[idxs]
+            else:
+                # оценяват се само candidates (cites/метаданни), не всички документи
+                idxs = np.flatnonzero(view.live & _doc_mask(view.segment, candidates))
+                if not len(idxs):
+                    continue
+                scores, touched = self._segment_scores(view, q_vecs, query_norms, idxs)
+            postings_touched += touched
+            documents_scored += int(np.count_nonzero(scores))
+
+            keep = np.flatnonzero(scores >= min_score)
+            # същата подредба като TfidfSearchEngine.search(): score desc, после реда на документите
+            best = keep[np.argsort(-scores[keep], kind="stable")[:top_k]]
+            ranked.extend(
+                (-float(scores[j]), seg_order, int(idxs[j])) for j in best
+            )
+
+        top = heapq.nsmallest(top_k, ranked)
+
+        if stats is not None:
+            stats["documents_scored"] = documents_scored
+            stats["postings_touched"] = postings_touched
+
+        return [
+            (snapshot.views[seg_order].segment.doc_ids[i], -neg)
+            for neg, seg_order, i in top
+        ]
+
+    def score_documents(
+        self,
+        q_text_vec: Dict[str, float],
+        q_legal_vec: Dict[str, float],
+        doc_ids: List[str],
+        query_norms: QueryNorms = None
+    ) -> Tuple[np.ndarray, int]:
+        """
+        Вж. TfidfSearchEngine.score_documents; документът се чете от doc-major
+        изгледа на сегмента си (SegmentField.doc_postings).
+        """
+        snapshot = self.snapshot
+        scores = np.zeros(len(doc_ids))
+        touched = 0
+        for field, q_vec, q_norm, weight in zip(
+            FIELDS, (q_text_vec, q_legal_vec), query_norms or (None, None), (W_TEXT, W_LEGAL)
+        ):
+            if q_norm is None:
+                q_norm = math.sqrt(sum(v ** 2 for v in q_vec.values()))
+            if q_norm == 0:
+                continue
+            for pos, doc_id in enumerate(doc_ids):
+                found = snapshot.locate(doc_id)
+                if found is None:
+                    continue
+                view, idx = found
+                norm = view.norms[field][idx]
+                if not norm:
+                    continue
+                f = view.segment.fields[field]
+                term_ids, weights = f.doc_postings(idx)
+                dot = 0.0
+                for tid, w in zip(term_ids.tolist(), (weights * view.idf[field][term_ids]).tolist()):
+                    q_w = q_vec.get(f.terms[tid])
+                    if q_w is not None:
+                        dot += q_w * w
+                        touched += 1
+                scores[pos] += weight * dot / (q_norm * norm)
+        return scores, touched
+
+    def legal_candidates(self, query_legal_tokens: List[str]) -> Optional[Set[str]]:
+        """
+        Документите с поне един общ LEGAL токен – направо от legal postings на сегментите.
+        """
+        snapshot = self.snapshot
+        found = False
+        out = set()
+        tokens = set(query_legal_tokens)
+        for view in snapshot.views:
+            f = view.segment.fields["legal"]
+            mask = np.zeros(view.segment.n_docs, dtype=bool)
+            for token in tokens:
+                tid = f.term_id.get(token)
+                if tid is not None:
+                    mask[f.docs[f.offsets[tid]:f.offsets[tid + 1]]] = True
+            mask &= view.live
+            if mask.any():
+                found = True
+                doc_ids = view.segment.doc_ids
+                out.update(doc_ids[i] for i in np.flatnonzero(mask).tolist())
+        return out if found else None
+
+    def search_two_stage(
+        self,
+        query_text_tokens: List[str],
+        query_legal_tokens: List[str],
+        top_k: int = 5,
+        min_score: float = 0.0,
+        stats: Optional[Dict[str, int]] = None,
+        candidates: Optional[Collection[str]] = None,
+        query_norms: QueryNorms = None
+    ) -> List[Tuple[str, float]]:
+        return two_stage_search(
+            self, query_text_tokens, query_legal_tokens, top_k, min_score, stats, candidates, query_norms
+        )
+
+    def search_batch(
+        self,
+        queries: List[BatchQuery],
+        top_k: int = 5,
+        min_score: float = 0.0,
+        stats: Optional[Dict[str, int]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        results = []
+        totals = {"documents_scored": 0, "postings_touched": 0}
+        for query in queries:
+            query_text_tokens, query_legal_tokens, query_norms = split_batch_query(query)
+            query_stats = {}
+            results.append(
+                self.search(query_text_tokens, query_legal_tokens, top_k, min_score, query_stats, query_norms=query_norms)
+            )
+            for key in totals:
+                totals[key] += query_stats[key]
+        if stats is not None:
+            stats.update(totals)
+        return results
+
+    def field_similarities(
+        self,
+        query_text_tokens: List[str],
+        query_legal_tokens: List[str]
+    ) -> Tuple[List[str], Dict[int, float], Dict[int, float]]:
+        snapshot = self.snapshot
+        q_text_vec, q_legal_vec = self.vectorize_query(query_text_tokens, query_legal_tokens)
+
+        out = []
+        for field, q_vec in zip(FIELDS, (q_text_vec, q_legal_vec)):
+            cosines = {}
+            for view in snapshot.views:
+                cos, _ = self._field_cosines(view, field, q_vec)
+                hit = np.flatnonzero(view.live & (cos != 0))
+                cosines.update(zip(view.global_idx[hit].tolist(), cos[hit].tolist()))
+            out.append(cosines)
+
+        return snapshot.doc_ids, out[0], out[1]
+
+
+class SegmentedIndex:
+    """
+    Писащата страна: нови сегменти, tombstones и сливане. Един процес пише;
+    читателите виждат промените, когато manifest-ът бъде сменен.
+    """
+
+    def __init__(self, index_dir: Path, merge_factor: int = MERGE_FACTOR):
+        self.index_dir = index_dir
+        self.merge_factor = merge_factor
+        segments_dir(index_dir).mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._merger: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _write_manifest(self, manifest: dict) -> None:
+        manifest["generation"] = manifest.get("generation", 0) + 1
+        _write_json_atomic(segments_dir(self.index_dir) / MANIFEST_NAME, manifest)
+
+    @staticmethod
+    def _new_name() -> str:
+        # редът на сегментите е в manifest-а; името само трябва да е уникално
+        return f"seg_{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+    def add_documents(self, records: Iterable[Tuple[str, Dict[str, int], Dict[str, int]]]) -> Optional[str]:
+        """
+        Нов сегмент от (doc_id, text_counts, legal_counts). Документ, който вече
+        е в индекса, се заменя (старото копие получава tombstone).
+        """
+        name = self._new_name()
+        n_docs = write_segment(self.index_dir, name, records)
+        if n_docs == 0:
+            shutil.rmtree(segments_dir(self.index_dir) / name, ignore_errors=True)
+            return None
+
+        segment = Segment(segments_dir(self.index_dir) / name)
+        with self._lock:
+            manifest = read_manifest(self.index_dir)
+            self._tombstone(manifest, segment.doc_ids)
+            manifest["segments"].append({"name": name, "n_docs": n_docs})
+            self._write_manifest(manifest)
+        return name
+
+    def add_counts_file(self, counts_path: Path) -> Optional[str]:
+        from tf_idf_index_builder import iter_counts_file
+        return self.add_documents(iter_counts_file(counts_path))
+
+    def seed_from_counts(self) -> List[str]:
+        """
+        По един сегмент на всеки counts файл, със същите изключения като
+        write_index_from_counts: дубликатите от duplicates.json не се индексират.
+        Заменя целия manifest наведнъж и записва в него отпечатъка на JSON
+        индекса (вж. manifest_stale_reason). Статично подрязан JSON индекс не
+        може да се възпроизведе в сегменти – нормите зависят от глобалния idf,
+        затова тогава е ValueError.
+        """
+        from tf_idf_index_builder import PRUNE_MAX_TERMS, PRUNE_MIN_RELATIVE_WEIGHT, counts_files, iter_counts_file
+
+        if PRUNE_MIN_RELATIVE_WEIGHT is not None or PRUNE_MAX_TERMS is not None:
+            raise ValueError("static pruning is on; segments cannot reproduce it, use full rebuilds")
+
+        skip = {doc_id for dups in load_duplicates(self.index_dir).values() for doc_id in dups}
+        source = source_generation(self.index_dir)
+        entries = []
+        for path in counts_files(self.index_dir):
+            name = self._new_name()
+            records = (r for r in iter_counts_file(path) if r[0] not in skip)
+            n_docs = write_segment(self.index_dir, name, records)
+            if n_docs:
+                entries.append({"name": name, "n_docs": n_docs})
+            else:
+                shutil.rmtree(segments_dir(self.index_dir) / name, ignore_errors=True)
+
+        with self._lock:
+            manifest = read_manifest(self.index_dir)
+            # mtime на директорията = кога е извадена от manifest-а (вж. collect_garbage)
+            for entry in manifest["segments"]:
+                os.utime(segments_dir(self.index_dir) / entry["name"])
+            manifest.update(segments=entries, tombstones={}, source=source)
+            self._write_manifest(manifest)
+
+        self.collect_garbage()
+        return [entry["name"] for entry in entries]
+
+    def _tombstone(self, manifest: dict, doc_ids: Iterable[str]) -> int:
+        wanted = set(doc_ids)
+        tombstones = manifest.setdefault("tombstones", {})
+        deleted = 0
+        for entry in manifest["segments"]:
+            with (segments_dir(self.index_dir) / entry["name"] / "docs.json").open(encoding="utf-8") as f:
+                seg_docs = json.load(f)
+            dead = set(tombstones.get(entry["name"], []))
+            for idx, doc_id in enumerate(seg_docs):
+                if doc_id in wanted and idx not in dead:
+                    dead.add(idx)
+                    deleted += 1
+            if dead:
+                tombstones[entry["name"]] = sorted(dead)
+        return deleted
+
+    def delete(self, doc_ids: Iterable[str]) -> int:
+        with self._lock:
+            manifest = read_manifest(self.index_dir)
+            deleted = self._tombstone(manifest, doc_ids)
+            if deleted:
+                self._write_manifest(manifest)
+        return deleted
+
+    def pick_merge(self, manifest: dict) -> List[str]:
+        """
+        Tiered политика: ниво = floor(log_factor(живи документи)); първото ниво
+        с поне merge_factor сегмента се слива.
+        """
+        tiers: Dict[int, List[str]] = {}
+        tombstones = manifest.get("tombstones", {})
+        for entry in manifest["segments"]:
+            live = entry["n_docs"] - len(tombstones.get(entry["name"], []))
+            tier = int(math.log(max(live, 1), self.merge_factor))
+            tiers.setdefault(tier, []).append(entry["name"])
+
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier][:self.merge_factor]
+        return []
+
+    def merge(self, names: List[str]) -> Optional[str]:
+        """
+        Слива сегментите в нов, без изтритите документи. Изтривания по време на
+        сливането се пренасят като tombstones в новия сегмент.
+        """
+        with self._merge_lock:
+            manifest = read_manifest(self.index_dir)
+            tombstones = manifest.get("tombstones", {})
+            sources = [Segment(segments_dir(self.index_dir) / name) for name in names]
+            dead_before = {name: set(tombstones.get(name, [])) for name in names}
+
+            name = self._new_name()
+            doc_ids = _merge_segments(self.index_dir, name, sources, dead_before)
+
+            with self._lock:
+                manifest = read_manifest(self.index_dir)
+                tombstones = manifest.setdefault("tombstones", {})
+                current = [e["name"] for e in manifest["segments"]]
+                if not all(n in current for n in names):
+                    shutil.rmtree(segments_dir(self.index_dir) / name, ignore_errors=True)
+                    return None
+
+                new_index = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+                dead_new = set()
+                for source in sources:
+                    for idx in set(tombstones.get(source.name, [])) - dead_before[source.name]:
+                        dead_new.add(new_index[source.doc_ids[idx]])
+                    tombstones.pop(source.name, None)
+                if dead_new:
+                    tombstones[name] = sorted(dead_new)
+
+                position = current.index(names[0])
+                manifest["segments"] = [e for e in manifest["segments"] if e["name"] not in names]
+                # mtime на директорията = кога е извадена от manifest-а (вж. collect_garbage)
+                for source in sources:
+                    os.utime(source.path)
+                manifest["segments"].insert(position, {"name": name, "n_docs": len(doc_ids)})
+                self._write_manifest(manifest)
+
+            self.collect_garbage()
+            return name
+
+    def maybe_merge(self) -> Optional[str]:
+        names = self.pick_merge(read_manifest(self.index_dir))
+        return self.merge(names) if names else None
+
+    def collect_garbage(self, grace: float = GC_GRACE_SECONDS) -> int:
+        """
+        Трие директории на сегменти извън manifest-а, чийто mtime (създаване
+        или изваждане при сливане) е отпреди поне grace секунди – и между
+        процесите, и за сегмент, който още не е добавен в manifest-а.
+        Връща броя изтрити.
+        """
+        live = {e["name"] for e in read_manifest(self.index_dir)["segments"]}
+        now = time.time()
+        removed = 0
+        for path in segments_dir(self.index_dir).iterdir():
+            if not path.is_dir() or path.name.endswith(".tmp") or path.name in live:
+                continue
+            if now - path.stat().st_mtime >= grace:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def start_merger(self, interval: float = MERGE_INTERVAL) -> threading.Thread:
+        def loop():
+            while not self._stop.wait(interval):
+                while self.maybe_merge():
+                    pass
+                self.collect_garbage()
+
+        self._stop.clear()
+        self._merger = threading.Thread(target=loop, name="segment-merger", daemon=True)
+        self._merger.start()
+        return self._merger
+
+    def stop_merger(self) -> None:
+        self._stop.set()
+        if self._merger is not None:
+            self._merger.join()
+            self._merger = None
+
+
+def _merge_segments(index_dir: Path, name: str, sources: List[Segment], dead: Dict[str, set]) -> List[str]:
+    """
+    Конкатенира живите postings на сегментите с преномериране на документите.
+    """
+    doc_ids: List[str] = []
+    remaps = []
+    for source in sources:
+        live = np.ones(source.n_docs, dtype=bool)
+        if dead[source.name]:
+            live[np.fromiter(dead[source.name], dtype=np.int64)] = False
+        remap = np.full(source.n_docs, -1, dtype=np.int64)
+        remap[live] = len(doc_ids) + np.arange(int(live.sum()))
+        doc_ids.extend(d for d, alive in zip(source.doc_ids, live) if alive)
+        remaps.append(remap)
+
+    tmp_dir = segments_dir(index_dir) / f"{name}.tmp"
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    _write_json_atomic(tmp_dir / "docs.json", doc_ids)
+
+    for field in FIELDS:
+        terms = sorted(set().union(*(s.fields[field].terms for s in sources)))
+        term_id = {t: i for i, t in enumerate(terms)}
+
+        all_terms, all_docs, all_weights = [], [], []
+        for source, remap in zip(sources, remaps):
+            f = source.fields[field]
+            new_docs = remap[f.docs]
+            keep = new_docs >= 0
+            local_to_global = np.array([term_id[t] for t in f.terms], dtype=np.int64)
+            all_terms.append(local_to_global[f.term_of_posting[keep]])
+            all_docs.append(new_docs[keep])
+            all_weights.append(f.weights[keep])
+
+        t = np.concatenate(all_terms) if all_terms else np.zeros(0, dtype=np.int64)
+        d = np.concatenate(all_docs) if all_docs else np.zeros(0, dtype=np.int64)
+        w = np.concatenate(all_weights) if all_weights else np.zeros(0)
+
+        order = np.lexsort((d, t))
+        t, d, w = t[order], d[order], w[order]
+
+        # term-ове само в изтрити документи отпадат
+        counts = np.bincount(t, minlength=len(terms))
+        used = counts > 0
+        offsets = np.zeros(int(used.sum()) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts[used])
+        kept_terms = [term for term, u in zip(terms, used.tolist()) if u]
+
+        _save_field(tmp_dir, field, kept_terms, offsets, d.astype(np.int32), w)
+
+    os.replace(tmp_dir, segments_dir(index_dir) / name)
+    return doc_ids
+
+
+def main():
+    import argparse
+
+    from tf_idf_index_builder import INDEX_DIR
+
+    p = argparse.ArgumentParser("Manage the segmented index")
+    p.add_argument("--index_dir", type=str, default=str(INDEX_DIR))
+    sub = p.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("init", help="Replace the segments with one per counts spool file (duplicates skipped)")
+    sub.add_parser("merge", help="Run the merge policy until nothing is left to merge")
+    sub.add_parser("compact", help="Merge all segments into one")
+    delete = sub.add_parser("delete", help="Tombstone documents")
+    delete.add_argument("doc_ids", nargs="+")
+    gc = sub.add_parser("gc", help="Delete segment dirs that left the manifest at least --grace seconds ago")
+    gc.add_argument("--grace", type=float, default=GC_GRACE_SECONDS)
+    sub.add_parser("stats")
+    args = p.parse_args()
+
+    index_dir = Path(args.index_dir)
+    index = SegmentedIndex(index_dir)
+
+    if args.cmd == "init":
+        for name in index.seed_from_counts():
+            print("seeded ->", name)
+    elif args.cmd == "merge":
+        while True:
+            name = index.maybe_merge()
+            if name is None:
+                break
+            print("merged ->", name)
+    elif args.cmd == "compact":
+        names = [e["name"] for e in read_manifest(index_dir)["segments"]]
+        if len(names) > 1:
+            print("merged ->", index.merge(names))
+    elif args.cmd == "delete":
+        print("deleted", index.delete(args.doc_ids))
+    elif args.cmd == "gc":
+        print("removed", index.collect_garbage(args.grace))
+
+    manifest = read_manifest(index_dir)
+    reason = manifest_stale_reason(index_dir)
+    if reason is not None:
+        print(f"stale: {reason}; load_engine ignores it until 'init'")
+    tombstones = manifest.get("tombstones", {})
+    for entry in manifest["segments"]:
+        print(f"{entry['name']}\t{entry['n_docs']} docs\t{len(tombstones.get(entry['name'], []))} deleted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+import json
+import mmap
+import os
+import threading
+import zlib
+
+from metrics import CACHE_HITS, CACHE_MISSES
+
+# index/snippets/<part>.bin + <part>.offsets.json, по една част на counts файл
+SNIPPETS_DIR_NAME = "snippets"
+
+SNIPPET_WINDOW = 120
+DECOMPRESSED_CACHE_SIZE = 64
+
+
+def format_reference(token: str) -> str:
+    """
+    LEGAL:чл:145_ал:1_АПК -> "чл. 145, ал. 1 АПК"
+    """
+    body = token[6:] if token.startswith("LEGAL:") else token
+    parts = body.split("_")
+    law = parts[-1]
+    levels = []
+    for part in parts[:-1]:
+        level, _, num = part.partition(":")
+        levels.append(f"§ {num}" if level == "§" else f"{level}. {num}")
+    return ", ".join(levels) + (" " if levels else "") + law
+
+
+class SnippetStoreWriter:
+    """
+    Записва за всеки документ zlib-компресиран запис
+    {"text": изчистен текст, "spans": {LEGAL токен: [[start, end], ...]}}.
+    """
+
+    def __init__(self, index_dir: Path, part: str):
+        snippets_dir = index_dir / SNIPPETS_DIR_NAME
+        snippets_dir.mkdir(parents=True, exist_ok=True)
+
+        self.bin_path = snippets_dir / f"{part}.bin"
+        self.offsets_path = snippets_dir / f"{part}.offsets.json"
+        self._bin_tmp = self.bin_path.with_name(self.bin_path.name + ".tmp")
+        self._f = self._bin_tmp.open("wb")
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        self._pos = 0
+
+    def add(self, doc_id: str, display_text: str, legal_spans: Dict[str, List[Tuple[int, int]]]) -> None:
+        payload = json.dumps(
+            {"text": display_text, "spans": legal_spans},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        blob = zlib.compress(payload, 6)
+
+        self._f.write(blob)
+        self._offsets[doc_id] = (self._pos, len(blob))
+        self._pos += len(blob)
+
+    def close(self) -> None:
+        self._f.close()
+        os.replace(self._bin_tmp, self.bin_path)
+
+        offsets_tmp = self.offsets_path.with_name(self.offsets_path.name + ".tmp")
+        with offsets_tmp.open("w", encoding="utf-8") as f:
+            json.dump(self._offsets, f, ensure_ascii=False)
+        os.replace(offsets_tmp, self.offsets_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+            self._bin_tmp.unlink(missing_ok=True)
+
+
+class SnippetStore:
+    """
+    Чете записите директно от mmap; последните разкомпресирани документи се
+    пазят в малък LRU кеш.
+    """
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = index_dir
+        self._docs: Dict[str, Tuple[mmap.mmap, int, int]] = {}
+        self._maps: List[mmap.mmap] = []
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._loaded = False
+        # заредените части и generation на snapshot-а, при който е зареждано (вж. sync)
+        self._parts: Set[str] = set()
+        self._generation: Optional[int] = None
+        self._load_lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Зарежда частите, които още не са заредени. Частите на сегментите не се
+        променят след записа си, така че вече заредените не се четат наново.
+        """
+        snippets_dir = self.index_dir / SNIPPETS_DIR_NAME
+        with self._load_lock:
+            for offsets_path in sorted(snippets_dir.glob("*.offsets.json")):
+                part = offsets_path.name[: -len(".offsets.json")]
+                bin_path = offsets_path.with_name(part + ".bin")
+                if part in self._parts or not bin_path.exists() or bin_path.stat().st_size == 0:
+                    continue
+
+                with bin_path.open("rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps.append(mm)
+
+                with offsets_path.open(encoding="utf-8") as f:
+                    for doc_id, (offset, length) in json.load(f).items():
+                        self._docs[doc_id] = (mm, offset, length)
+                        # документ, въведен наново в по-нов сегмент
+                        self._cache.pop(doc_id, None)
+                self._parts.add(part)
+
+            self._loaded = True
+
+    def sync(self, generation: Optional[int]) -> None:
+        """
+        generation: на snapshot-а на сегментирания engine (None за другите).
+        Нов snapshot може да съдържа сегменти, чиито части още не са заредени –
+        ingest_pipeline пише snippets преди сегмента, така че те вече са на диска.
+        """
+        if generation != self._generation:
+            self.load()
+            self._generation = generation
+
+    def _record(self, doc_id: str) -> Optional[dict]:
+        if not self._loaded:
+            self.load()
+
+        record = self._cache.get(doc_id)
+        if record is not None:
+            CACHE_HITS.inc(cache="snippets")
+            self._cache.move_to_end(doc_id)
+            return record
+        CACHE_MISSES.inc(cache="snippets")
+
+        location = self._docs.get(doc_id)
+        if location is None:
+            return None
+
+        mm, offset, length = location
+        record = json.loads(zlib.decompress(mm[offset:offset + length]))
+
+        self._cache[doc_id] = record
+        if len(self._cache) > DECOMPRESSED_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return record
+
+    def highlights(
+        self,
+        doc_id: str,
+        references: List[str],
+        window: int = SNIPPET_WINDOW,
+    ) -> List[Dict]:
+        """
+        За всяка препратка: кратък откъс около първото ѝ срещане и позицията
+        на препратката в откъса (за подчертаване във frontend-а).
+        """
+        record = self._record(doc_id)
+        if record is None:
+            return []
+
+        text = record["text"]
+        spans = record["spans"]
+
+        out = []
+        for token in references:
+            token_spans = spans.get(token)
+            if not token_spans:
+                out.append({"reference": format_reference(token), "token": token, "snippet": "", "highlight": None})
+                continue
+
+            start, end = token_spans[0]
+            s = max(0, start - window)
+            e = min(len(text), end + window)
+
+            prefix = "…" if s > 0 else ""
+            suffix = "…" if e < len(text) else ""
+
+            out.append({
+                "reference": format_reference(token),
+                "token": token,
+                "snippet": prefix + text[s:e] + suffix,
+                "highlight": [start - s + len(prefix), end - s + len(prefix)],
+            })
+
+        return out
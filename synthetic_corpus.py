@@ -0,0 +1,140 @@
+# Синтетичен корпус за бенчмаркове: текст от stopword списъка + псевдо-думи
+# и правни препратки по същата граматика, която разпознава extract_domain_entities.
+# Не изисква съдебни данни; при един и същ seed корпусът е един и същ.
+from pathlib import Path
+from typing import Dict, List
+import json
+import random
+
+BASE_DIR = Path(__file__).resolve().parent
+STOPWORDS_PATH = BASE_DIR / "Data" / "stopwords.json"
+
+LAWS = [
+    "АПК", "ГПК", "ЗУБ", "ЗМВР", "ДОПК", "ЗДДС", "ЗУТ", "КСО",
+    "ЗОП", "ЗКПО", "ЗАНН", "ЗДвП", "ЗИНЗС", "ЗСП", "ЗЗдр",
+]
+EU_DIRECTIVES = ["2006/112/ЕО", "2008/115/ЕО", "2011/95/ЕС"]
+
+SYLLABLES = [
+    "ка", "ни", "то", "ва", "ре", "ше", "про", "ста", "ност", "ние", "ция",
+    "за", "ле", "ми", "ра", "де", "жал", "ба", "ли", "по", "се", "вен",
+    "тел", "ска", "дър", "жа", "об", "ект", "пра", "ен", "ни", "ко",
+]
+
+DECISION_MARKER = "Р Е Ш И :"
+
+
+def load_stopwords() -> List[str]:
+    with STOPWORDS_PATH.open(encoding="utf-8") as f:
+        data = json.load(f)
+    return data["common"]
+
+
+def make_vocabulary(rng: random.Random, size: int) -> List[str]:
+    words = set()
+    while len(words) < size:
+        n = rng.randint(2, 4)
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(n)))
+    # сортираме за детерминизъм, разбъркваме за да не е рангът азбучен
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+def legal_reference(rng: random.Random) -> str:
+    """
+    ref := "чл. N" [", ал. M" [", т. K"]] " от " LAW
+         | "чл. N-M от " LAW
+         | "§ N" [", т. K"] " от " LAW
+         | "чл. N от Директива " EU
+    """
+    law = rng.choice(LAWS)
+    roll = rng.random()
+
+    if roll < 0.6:
+        ref = f"чл. {rng.randint(1, 300)}"
+        if rng.random() < 0.6:
+            ref += f", ал. {rng.randint(1, 6)}"
+            if rng.random() < 0.4:
+                ref += f", т. {rng.randint(1, 12)}"
+        return f"{ref} от {law}"
+
+    if roll < 0.75:
+        start = rng.randint(1, 250)
+        return f"чл. {start}-{start + rng.randint(1, 3)} от {law}"
+
+    if roll < 0.92:
+        ref = f"§ {rng.randint(1, 40)}"
+        if rng.random() < 0.5:
+            ref += f", т. {rng.randint(1, 10)}"
+        return f"{ref} от {law}"
+
+    return f"чл. {rng.randint(1, 200)} от Директива {rng.choice(EU_DIRECTIVES)}"
+
+
+class CorpusGenerator:
+    def __init__(self, seed: int = 13, vocabulary_size: int = 4000, stopword_ratio: float = 0.35):
+        self.rng = random.Random(seed)
+        self.stopwords = load_stopwords()
+        self.vocabulary = make_vocabulary(self.rng, vocabulary_size)
+        # Zipf-подобно разпределение на честотите
+        self._cum_weights = []
+        total = 0.0
+        for rank in range(len(self.vocabulary)):
+            total += 1.0 / (rank + 1)
+            self._cum_weights.append(total)
+        self.stopword_ratio = stopword_ratio
+
+    def _words(self, n: int) -> List[str]:
+        rng = self.rng
+        content = rng.choices(self.vocabulary, cum_weights=self._cum_weights, k=n)
+        out = []
+        for w in content:
+            if rng.random() < self.stopword_ratio:
+                out.append(rng.choice(self.stopwords))
+            out.append(w)
+        return out
+
+    def _paragraph(self, n_words: int, n_refs: int) -> str:
+        words = self._words(n_words)
+        for _ in range(n_refs):
+            pos = self.rng.randint(0, len(words))
+            words.insert(pos, "съгласно " + legal_reference(self.rng))
+        return " ".join(words) + "."
+
+    def document(self, n_words: int = 900, n_refs: int = 8) -> str:
+        rng = self.rng
+        day, month, year = rng.randint(1, 28), rng.randint(1, 12), rng.randint(2015, 2025)
+        header = (
+            f"РЕШЕНИЕ № {rng.randint(1, 9999)}\n"
+            f"гр. София, {day:02d}.{month:02d}.{year} г.\n"
+            f"Административен съд София-град, {rng.randint(1, 70)} състав, "
+            "в публично заседание, постанови следното:\n"
+        )
+
+        body_words = int(n_words * 0.85)
+        paragraphs = []
+        remaining = body_words
+        refs_left = n_refs
+        while remaining > 0:
+            size = min(remaining, rng.randint(60, 180))
+            refs = min(refs_left, rng.randint(0, 2))
+            paragraphs.append(self._paragraph(size, refs))
+            remaining -= size
+            refs_left -= refs
+
+        decision = self._paragraph(n_words - body_words, max(refs_left, 1))
+        return header + "\n".join(paragraphs) + f"\n{DECISION_MARKER}\n" + decision
+
+    def corpus(self, n_docs: int, n_words: int = 900, n_refs: int = 8, prefix: str = "Synthetic") -> Dict[str, str]:
+        return {
+            f"{prefix}_{i}.pdf": self.document(
+                n_words=max(50, int(self.rng.gauss(n_words, n_words * 0.3))),
+                n_refs=max(0, int(self.rng.gauss(n_refs, n_refs * 0.5))),
+            )
+            for i in range(n_docs)
+        }
+
+
+def generate_corpus(n_docs: int, seed: int = 13, **kwargs) -> Dict[str, str]:
+    return CorpusGenerator(seed=seed).corpus(n_docs, **kwargs)
@@ -0,0 +1,76 @@
+import sys
+from collections import Counter
+from pathlib import Path
+import random
+
+import pytest
+
+# модулите са в корена на репото (без пакет)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from compact_store import CompactTfidfEngine  # noqa: E402
+from postings_store import PostingsTfidfEngine  # noqa: E402
+from segments import SegmentedIndex, SegmentedTfidfEngine  # noqa: E402
+from tf_idf_engine import TfidfSearchEngine  # noqa: E402
+
+LAWS = ["АПК", "ДОПК", "ЗДДС", "ЗЗдр", "ИЗоБ"]
+
+
+def make_corpus(n_docs: int = 80, n_queries: int = 6, seed: int = 7):
+    """
+    (документи, заявки): doc_id -> (text токени, LEGAL токени), Zipf-подобни
+    честоти, за да има и чести, и редки термини.
+    """
+    rng = random.Random(seed)
+    vocab = [f"дума{i}" for i in range(300)]
+    weights = [1.0 / (r + 1) for r in range(len(vocab))]
+    refs = [f"LEGAL:чл:{n}_{law}" for law in LAWS for n in range(1, 7)]
+    refs += [f"LEGAL:чл:{n}_ал:{a}_{law}" for law in LAWS[:2] for n in range(1, 4) for a in (1, 2)]
+
+    def doc(n_words: int):
+        text = rng.choices(vocab, weights=weights, k=n_words)
+        legal = rng.sample(refs, rng.randint(0, 5))
+        return text, legal + rng.sample(legal, min(len(legal), 2))
+
+    docs = {f"doc_{i:03d}.pdf": doc(rng.randint(20, 120)) for i in range(n_docs)}
+    queries = [doc(rng.randint(10, 40)) for _ in range(n_queries)]
+    return docs, queries
+
+
+def counts_records(docs):
+    return [(doc_id, Counter(text), Counter(legal)) for doc_id, (text, legal) in docs.items()]
+
+
+@pytest.fixture(scope="session")
+def corpus():
+    return make_corpus()
+
+
+@pytest.fixture(scope="session")
+def dict_engine(corpus):
+    docs, _ = corpus
+    engine = TfidfSearchEngine()
+    engine.build_index({d: t for d, (t, _) in docs.items()}, {d: lg for d, (_, lg) in docs.items()})
+    return engine
+
+
+@pytest.fixture(scope="session")
+def segmented_engine(corpus, tmp_path_factory):
+    docs, _ = corpus
+    index_dir = tmp_path_factory.mktemp("segmented")
+    records = counts_records(docs)
+    index = SegmentedIndex(index_dir)
+    # два сегмента, за да се слеят резултатите от повече от един
+    index.add_documents(records[:50])
+    index.add_documents(records[50:])
+    return SegmentedTfidfEngine(index_dir, refresh_interval=None)
+
+
+@pytest.fixture(scope="session")
+def engines(dict_engine, segmented_engine):
+    return {
+        "dict": dict_engine,
+        "compact": CompactTfidfEngine.from_engine(dict_engine),
+        "postings": PostingsTfidfEngine.from_engine(dict_engine),
+        "segments": segmented_engine,
+    }
@@ -0,0 +1,24 @@
+from ann_index import NPROBE, AnnIndex, ann_recall
+from compact_store import CompactTfidfEngine
+from conftest import make_corpus
+from tf_idf_engine import TfidfSearchEngine
+
+
+def test_calibrated_recall_against_exact_search():
+    # заявките не са от индекса – калибрирането е върху документите му
+    docs, queries = make_corpus(n_docs=1500, n_queries=30, seed=5)
+    dict_engine = TfidfSearchEngine()
+    dict_engine.build_index({d: t for d, (t, _) in docs.items()}, {d: lg for d, (_, lg) in docs.items()})
+    engine = CompactTfidfEngine.from_engine(dict_engine)
+
+    ann = AnnIndex.from_engine(engine)
+    assert 1 <= ann.nprobe <= len(ann.lists)
+    report = ann_recall(engine, ann, queries, top_k=10)
+    assert report["recall_at_10"] >= 0.9
+    # и все пак не е изчерпателно търсене
+    assert report["candidate_ratio"] < 0.2
+
+
+def test_without_calibration_uses_fixed_nprobe(dict_engine):
+    ann = AnnIndex.from_engine(dict_engine, recall_target=None)
+    assert ann.nprobe == NPROBE
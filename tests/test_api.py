@@ -0,0 +1,83 @@
+# API без истински индекс: търсенето е подменено. Сървърът е истински uvicorn
+# (един event loop), а не TestClient, който пуска всяка заявка отделно.
+import socket
+import threading
+import time
+
+import httpx
+import pytest
+import uvicorn
+
+import api
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # без lifespan: warm_up би зареждал индекса от диска
+    config = uvicorn.Config(api.app, host="127.0.0.1", port=_free_port(), lifespan="off", log_level="warning")
+    srv = uvicorn.Server(config)
+    thread = threading.Thread(target=srv.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not srv.started and time.monotonic() < deadline:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{config.port}"
+    srv.should_exit = True
+    thread.join(5)
+
+
+def test_health_answers_during_search(server, monkeypatch):
+    release = threading.Event()
+
+    def slow_search(*args, **kwargs):
+        # блокиращо като извличането от PDF и оценяването
+        release.wait(5)
+        return []
+
+    monkeypatch.setattr(api, "tf_idf_search_with_highlights", slow_search)
+    monkeypatch.setattr(api, "require_ready", lambda: None)
+
+    search = threading.Thread(
+        target=httpx.post,
+        args=(f"{server}/search/pdf",),
+        kwargs={"files": {"file": ("q.pdf", b"%PDF-1.4", "application/pdf")}, "timeout": 10},
+    )
+    search.start()
+    try:
+        time.sleep(0.2)
+        assert httpx.get(f"{server}/healthz", timeout=1.0).status_code == 200
+        assert search.is_alive()
+    finally:
+        release.set()
+        search.join()
+
+
+def test_admin_routes_absent_without_token(server):
+    # ADMIN_TOKEN не е зададен при импорта на api
+    assert api.ADMIN_TOKEN is None
+    assert httpx.get(f"{server}/admin/index", timeout=1.0).status_code == 404
+    assert httpx.post(f"{server}/admin/reload", timeout=1.0).status_code == 404
+
+
+def test_admin_requires_bearer_token(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(api, "ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(api.HOLDER, "status", lambda: {"version": 1})
+    app = FastAPI()
+    app.include_router(api.admin)
+    client = TestClient(app)
+
+    # и от 127.0.0.1 (както зад reverse proxy) без токен – 401
+    assert client.get("/admin/index").status_code == 401
+    assert client.get("/admin/index", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get("/admin/index", headers={"Authorization": "Basic s3cret"}).status_code == 401
+    ok = client.get("/admin/index", headers={"Authorization": "Bearer s3cret"})
+    assert ok.status_code == 200 and ok.json() == {"version": 1}
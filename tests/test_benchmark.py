@@ -0,0 +1,36 @@
+from benchmark import compare, missing_rows
+
+BASELINE = {
+    "meta": {"stages": {"search": ["search.single", "search.batch"], "startup": ["startup.eager"], "pdf": []}},
+    "stages": {
+        "search.single": {"queries_per_s": 100.0, "p50_ms": 10.0},
+        "search.batch": {"queries_per_s": 200.0},
+        "startup.eager": {"time_to_ready_s": 1.0},
+    },
+}
+
+
+def run(stages, rows):
+    return {"meta": {"stages": stages}, "stages": rows}
+
+
+def test_skipped_stage_is_missing():
+    # startup е пуснат, но е пропуснат (напр. без uvicorn) – не е "без регресии"
+    current = run(
+        {"search": ["search.batch", "search.single"], "startup": []},
+        {"search.single": {"queries_per_s": 100.0, "p50_ms": 10.0}, "search.batch": {"queries_per_s": 200.0}},
+    )
+    assert missing_rows(current, BASELINE) == ["startup.eager"]
+    assert compare(current, BASELINE) == []
+
+
+def test_only_requested_stages_and_missing_metrics():
+    current = run({"search": ["search.single"]}, {"search.single": {"queries_per_s": 50.0}})
+    assert missing_rows(current, BASELINE) == ["search.single.p50_ms", "search.batch"]
+    assert [r["metric"] for r in compare(current, BASELINE)] == ["queries_per_s"]
+
+
+def test_baseline_without_stage_map_requires_every_row():
+    baseline = {"stages": BASELINE["stages"]}
+    current = run({"search": ["search.single"]}, {"search.single": {"queries_per_s": 100.0, "p50_ms": 10.0}})
+    assert missing_rows(current, baseline) == ["search.batch", "startup.eager"]
@@ -0,0 +1,46 @@
+# candidates (cites/метаданни) трябва да ограничават самото оценяване, а
+# резултатът – да е като пълното търсене, филтрирано след това.
+import random
+
+import pytest
+
+ENGINES = ["dict", "compact", "postings", "segments"]
+
+
+@pytest.mark.parametrize("name", ENGINES)
+def test_candidates_equal_search_then_mask(name, engines, corpus):
+    engine = engines[name]
+    docs, queries = corpus
+    rng = random.Random(3)
+    doc_ids = sorted(docs)
+
+    for text, legal in queries:
+        candidates = set(rng.sample(doc_ids, 20)) | {"not_indexed.pdf"}
+        stats = {}
+        got = engine.search(text, legal, top_k=5, stats=stats, candidates=candidates)
+
+        full = engine.search(text, legal, top_k=len(doc_ids))
+        expected = [(d, s) for d, s in full if d in candidates][:5]
+
+        assert [d for d, _ in got] == [d for d, _ in expected]
+        assert [s for _, s in got] == pytest.approx([s for _, s in expected], abs=1e-6)
+        # оценени са най-много кандидатите, не целият индекс
+        assert stats["documents_scored"] <= 20
+
+
+@pytest.mark.parametrize("name", ["compact", "postings", "segments"])
+def test_candidates_touch_fewer_postings(name, engines, corpus):
+    engine = engines[name]
+    docs, queries = corpus
+    text, legal = queries[0]
+    full, filtered = {}, {}
+    engine.search(text, legal, stats=full)
+    engine.search(text, legal, stats=filtered, candidates=set(sorted(docs)[:5]))
+    assert filtered["postings_touched"] < full["postings_touched"]
+
+
+def test_empty_candidates(engines, corpus):
+    _, queries = corpus
+    text, legal = queries[0]
+    for engine in engines.values():
+        assert engine.search(text, legal, candidates=set()) == []
@@ -0,0 +1,92 @@
+import threading
+
+import numpy as np
+import pytest
+
+from compact_store import (
+    QUANTIZATION,
+    CompactTfidfEngine,
+    compact_dir,
+    load_dir_consistent,
+    read_build_info,
+    save_dir_atomic,
+)
+
+
+def _write(value):
+    def write(tmp_dir):
+        (tmp_dir / "a.txt").write_text(value)
+        (tmp_dir / "b.txt").write_text(value)
+    return write
+
+
+def test_save_replaces_legacy_dir_and_old_versions(tmp_path):
+    out_dir = tmp_path / "compact"
+    out_dir.mkdir()
+    (out_dir / "a.txt").write_text("legacy")
+
+    save_dir_atomic(out_dir, _write("1"), "src-1")
+    assert out_dir.is_symlink()
+    assert (out_dir / "a.txt").read_text() == "1"
+    assert read_build_info(out_dir)["source"] == "src-1"
+
+    save_dir_atomic(out_dir, _write("2"), "src-2")
+    assert (out_dir / "b.txt").read_text() == "2"
+    # остава само текущата версия
+    assert [p.name for p in tmp_path.iterdir() if p.name != "compact"] == [out_dir.resolve().name]
+
+
+def test_loader_never_sees_missing_or_mixed_dir(tmp_path):
+    out_dir = tmp_path / "compact"
+    save_dir_atomic(out_dir, _write("0"), None)
+    stop = threading.Event()
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            save_dir_atomic(out_dir, _write(str(i)), None)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(300):
+            assert out_dir.exists()
+            a, b = load_dir_consistent(
+                out_dir, lambda: ((out_dir / "a.txt").read_text(), (out_dir / "b.txt").read_text()), attempts=20,
+            )
+            assert a == b
+    finally:
+        stop.set()
+        thread.join()
+
+
+@pytest.mark.parametrize("dtype", sorted(QUANTIZATION))
+def test_quantized_vectors_within_half_step(dtype, dict_engine):
+    engine = CompactTfidfEngine.from_engine(dict_engine, dtype=dtype)
+    field = engine.fields["text"]
+    assert field.data.dtype == np.dtype(dtype)
+    for idx, doc_id in enumerate(engine.doc_ids):
+        exact = dict_engine.tfidf_docs_text[doc_id]
+        got = field.doc_vector(idx)
+        assert set(got) == set(exact)
+        # мащаб на документ: грешката е до половин стъпка
+        step = 0.0 if field.scales is None else float(field.scales[idx])
+        for term, w in exact.items():
+            assert abs(got[term] - w) <= step / 2 + 1e-6 * abs(w)
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float32", 1e-6), ("uint16", 1e-4), ("uint8", 2e-2)])
+def test_save_load_round_trip(dtype, tolerance, dict_engine, corpus, tmp_path):
+    docs, queries = corpus
+    engine = CompactTfidfEngine.from_engine(dict_engine, dtype=dtype)
+    engine.save(tmp_path, source="test")
+    loaded = CompactTfidfEngine.load(tmp_path, mmap_mode="r")
+    assert read_build_info(compact_dir(tmp_path))["source"] == "test"
+
+    for text, legal in queries:
+        assert loaded.search(text, legal, top_k=10) == engine.search(text, legal, top_k=10)
+
+        exact = dict(dict_engine.search(text, legal, top_k=len(docs)))
+        for doc_id, score in loaded.search(text, legal, top_k=10):
+            assert score == pytest.approx(exact[doc_id], abs=tolerance)
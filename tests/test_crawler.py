@@ -0,0 +1,151 @@
+# AsyncCrawler срещу локален aiohttp.web сървър на 127.0.0.1: листинг с линкове
+# "Решение", PDF-и, endpoint с временни 503 и такъв, който винаги връща 404.
+import asyncio
+import socket
+import time
+from pathlib import Path
+
+import pytest
+from aiohttp import web
+
+import crawler
+from crawler import AsyncCrawler, HtmlListingDiscovery
+
+INTERVAL = 0.2
+
+
+class StandInServer:
+    def __init__(self):
+        self.hits = {}
+        self.request_times = []
+        self.flaky_failures = 2
+
+        app = web.Application()
+        app.router.add_get("/list", self.listing)
+        app.router.add_get("/list2", self.listing2)
+        app.router.add_get("/doc/{name}", self.document)
+        app.router.add_get("/flaky", self.flaky)
+        app.router.add_get("/missing", self.missing)
+        self.app = app
+
+    def _hit(self, request) -> None:
+        self.request_times.append(time.monotonic())
+        self.hits[request.path] = self.hits.get(request.path, 0) + 1
+
+    async def listing(self, request):
+        self._hit(request)
+        html = (
+            '<a href="/doc/a">Решение</a> <a href="/doc/b">Решение</a>'
+            '<a href="/doc/a_copy">Решение</a> <a href="/about">За нас</a>'
+            '<ul><li class="PagedList-skipToNext"><a href="/list2">»</a></li></ul>'
+        )
+        return web.Response(text=html, content_type="text/html")
+
+    async def listing2(self, request):
+        self._hit(request)
+        html = '<a href="/flaky">Решение</a> <a href="/missing">Решение</a> <a href="/doc/a">Решение</a>'
+        return web.Response(text=html, content_type="text/html")
+
+    async def document(self, request):
+        self._hit(request)
+        name = request.match_info["name"]
+        # a и a_copy са едно и също съдържание под различни URL-и
+        body = b"%PDF-1.4 same" if name.startswith("a") else f"%PDF-1.4 {name}".encode()
+        return web.Response(
+            body=body,
+            headers={"Content-Disposition": f'attachment; filename="{name}.pdf"'},
+            content_type="application/pdf",
+        )
+
+    async def flaky(self, request):
+        self._hit(request)
+        if self.flaky_failures > 0:
+            self.flaky_failures -= 1
+            return web.Response(status=503, headers={"Retry-After": "0"})
+        return web.Response(
+            body=b"%PDF-1.4 flaky",
+            headers={"Content-Disposition": 'attachment; filename="flaky.pdf"'},
+        )
+
+    async def missing(self, request):
+        self._hit(request)
+        return web.Response(status=404)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _serve(server: StandInServer, port: int):
+    runner = web.AppRunner(server.app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def _crawl(tmp_path: Path, server: StandInServer, port: int = 0, **kwargs):
+    port = port or _free_port()
+
+    async def run():
+        runner, base = await _serve(server, port)
+        try:
+            c = AsyncCrawler(str(tmp_path), concurrency=4, per_host_interval=INTERVAL, **kwargs)
+            counts = await asyncio.wait_for(c.crawl(HtmlListingDiscovery(f"{base}/list", max_pages=5)), 30)
+            return c, counts
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(crawler, "BACKOFF_FACTOR", 0.01)
+
+
+def test_dedup_retry_and_failures(tmp_path):
+    server = StandInServer()
+    port = _free_port()
+    c, (downloaded, duplicates, skipped, failed) = _crawl(tmp_path, server, port)
+
+    # a, b, flaky; a_copy е дубликат по съдържание; /doc/a на втората страница – вече видян
+    assert (downloaded, duplicates, skipped, failed) == (3, 1, 1, 1)
+    assert server.hits["/flaky"] == 3
+    # 404 не е в RETRY_STATUSES
+    assert server.hits["/missing"] == 1
+    assert sorted(p.name for p in tmp_path.glob("*.pdf")) == ["a_0.pdf", "b_1.pdf", "flaky_3.pdf"]
+    assert not list(tmp_path.glob("*.part"))
+
+    # втори обход (същите URL-и): всичко е в manifest-а, нищо не се тегли наново
+    server2 = StandInServer()
+    _, (downloaded, duplicates, skipped, failed) = _crawl(tmp_path, server2, port)
+    assert (downloaded, duplicates, skipped, failed) == (0, 0, 5, 1)
+    assert "/doc/a" not in server2.hits and "/doc/b" not in server2.hits
+
+
+def test_per_host_interval(tmp_path):
+    server = StandInServer()
+    _crawl(tmp_path, server)
+
+    gaps = [b - a for a, b in zip(server.request_times, server.request_times[1:])]
+    assert gaps
+    # limiter-ът мери началата на заявките при клиента; малък толеранс за мрежата
+    assert min(gaps) >= INTERVAL * 0.9
+
+
+def test_failing_hook_does_not_stall_crawl(tmp_path):
+    calls = []
+
+    async def on_download(path: Path):
+        calls.append(path.name)
+        raise RuntimeError("index queue closed")
+
+    server = StandInServer()
+    c, (downloaded, duplicates, skipped, failed) = _crawl(tmp_path, server, on_download=on_download)
+
+    assert len(calls) == downloaded == 3
+    # 404 + трите неуспешни hook-а
+    assert failed == 4
+    assert not list(tmp_path.glob("*.part"))
@@ -0,0 +1,50 @@
+import pytest
+
+from document_metadata import DocumentMetadataStore, MetadataFilter, MetadataWriter
+from text_preprocessing import extract_metadata
+
+HEADERS = {
+    "caps.pdf": "АДМИНИСТРАТИВЕН СЪД – ПЛОВДИВ\nР Е Ш Е Н И Е\n№ 1234\nгр. Пловдив, 12.03.2021 г.\n",
+    "mixed.pdf": "РЕШЕНИЕ № 77\nгр. София, 05.11.2019 г.\nАдминистративен съд София-град, 12 състав\n",
+    "vas.pdf": "ВЪРХОВЕН АДМИНИСТРАТИВЕН СЪД РЕШЕНИЕ № 5 София, 01.02.2023 г.\n",
+    "rs.pdf": "Районен съд - Пловдив\nОПРЕДЕЛЕНИЕ\n30.06.2020 г.\n",
+    "none.pdf": "ПРОТОКОЛ\nнастоящият съд разгледа делото\n",
+}
+
+
+@pytest.mark.parametrize("doc_id, court", [
+    ("caps.pdf", "Административен съд Пловдив"),
+    ("mixed.pdf", "Административен съд София-град"),
+    ("vas.pdf", "Върховен административен съд"),
+    ("rs.pdf", "Районен съд Пловдив"),
+    ("none.pdf", None),
+])
+def test_court_from_header(doc_id, court):
+    assert extract_metadata(HEADERS[doc_id], [])["court"] == court
+
+
+def test_act_type_year_and_laws():
+    meta = extract_metadata(HEADERS["caps.pdf"], ["LEGAL:чл:145_ал:1_АПК", "LEGAL:чл:5_ЗЗдр", "LEGAL:чл:146_АПК"])
+    assert meta["act_type"] == "решение"
+    assert meta["year"] == 2021
+    assert meta["laws"] == ["АПК", "ЗЗдр"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    with MetadataWriter(tmp_path, "base") as writer:
+        for doc_id, header in HEADERS.items():
+            writer.add(doc_id, extract_metadata(header, ["LEGAL:чл:5_ЗЗдр"] if doc_id == "caps.pdf" else []))
+    return DocumentMetadataStore.load(tmp_path, list(HEADERS))
+
+
+def test_filters(store):
+    assert store.documents(MetadataFilter()) is None
+    assert store.documents(MetadataFilter(courts=("пловдив",))) == {"caps.pdf", "rs.pdf"}
+    assert store.documents(MetadataFilter(courts=("административен",))) == {"caps.pdf", "mixed.pdf", "vas.pdf"}
+    assert store.documents(MetadataFilter(courts=("административен",), year_to=2020)) == {"mixed.pdf"}
+    assert store.documents(MetadataFilter(act_types=("Определение",))) == {"rs.pdf"}
+    assert store.documents(MetadataFilter(laws=("зздр",))) == {"caps.pdf"}
+    assert store.documents(MetadataFilter(laws=("ЗЗдр", "АПК"))) == set()
+    # документи без година не минават ограничение по година
+    assert "none.pdf" not in store.documents(MetadataFilter(year_to=2030))
@@ -0,0 +1,70 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from document_store import DocumentManifest, RangeNotSatisfiable, document_response, parse_range
+
+
+@pytest.mark.parametrize("header, size, expected", [
+    ("bytes=0-9", 100, (0, 9)),
+    ("bytes=90-", 100, (90, 99)),
+    ("bytes=90-500", 100, (90, 99)),
+    ("bytes=-10", 100, (90, 99)),
+    ("bytes=-500", 100, (0, 99)),
+    ("BYTES = 5-5", 100, (5, 5)),
+    # игнорират се – целият файл
+    ("bytes=0-1,5-6", 100, None),
+    ("bytes=9-0", 100, None),
+    ("bytes=a-b", 100, None),
+    ("items=0-1", 100, None),
+    ("bytes=5", 100, None),
+])
+def test_parse_range(header, size, expected):
+    assert parse_range(header, size) == expected
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=100-", 100),
+    ("bytes=100-200", 100),
+    ("bytes=-0", 100),
+    # празен файл: няма байт, който да се върне
+    ("bytes=-10", 0),
+    ("bytes=0-", 0),
+    ("bytes=0-0", 0),
+])
+def test_parse_range_not_satisfiable(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, size)
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / "empty.pdf").write_bytes(b"")
+    (tmp_path / "doc.pdf").write_bytes(bytes(range(100)))
+    manifest = DocumentManifest(tmp_path)
+    manifest.refresh()
+
+    app = FastAPI()
+
+    @app.api_route("/documents/{filename}", methods=["GET", "HEAD"])
+    def get_document(filename: str, request: Request):
+        return document_response(request, manifest.resolve(filename))
+
+    return TestClient(app)
+
+
+def test_ranges_over_http(client):
+    r = client.get("/documents/doc.pdf", headers={"Range": "bytes=-10"})
+    assert r.status_code == 206
+    assert r.headers["content-range"] == "bytes 90-99/100"
+    assert r.content == bytes(range(90, 100))
+
+    r = client.get("/documents/doc.pdf")
+    assert r.status_code == 200 and len(r.content) == 100
+
+    r = client.get("/documents/empty.pdf", headers={"Range": "bytes=-10"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == "bytes */0"
+
+    r = client.get("/documents/empty.pdf")
+    assert r.status_code == 200 and r.content == b""
@@ -0,0 +1,121 @@
+# Всеки engine срещу dict engine-а (TfidfSearchEngine) върху един и същ корпус:
+# търсене, оценяване на избрани документи, batch и подрязване на заявката/индекса.
+import pytest
+
+from compact_store import CompactTfidfEngine
+from query_pruning import QueryPruning, prune_query_tokens
+from tf_idf_engine import TfidfSearchEngine
+
+# postings пазят uint8 impact-и – score-ът е приблизителен
+TOLERANCE = {"dict": 1e-9, "compact": 1e-6, "postings": 5e-3, "segments": 1e-6}
+
+
+def _assert_scores(got, expected, tolerance):
+    expected = dict(expected)
+    for doc_id, score in got:
+        assert score == pytest.approx(expected[doc_id], abs=tolerance)
+
+
+@pytest.mark.parametrize("name", list(TOLERANCE))
+def test_search_matches_dict_engine(name, engines, dict_engine, corpus):
+    docs, queries = corpus
+    engine = engines[name]
+    for text, legal in queries:
+        expected = dict_engine.search(text, legal, top_k=len(docs))
+        got = engine.search(text, legal, top_k=10)
+        assert len(got) == 10
+        _assert_scores(got, expected, TOLERANCE[name])
+        if name != "postings":
+            assert [d for d, _ in got] == [d for d, _ in expected[:10]]
+
+
+@pytest.mark.parametrize("name", list(TOLERANCE))
+def test_score_documents_and_batch(name, engines, dict_engine, corpus):
+    docs, queries = corpus
+    engine = engines[name]
+    doc_ids = sorted(docs)[::7] + ["not_indexed.pdf"]
+    for text, legal in queries:
+        vectors = dict_engine.vectorize_query(text, legal)
+        expected, _ = dict_engine.score_documents(*vectors, doc_ids)
+        got, _ = engine.score_documents(*engine.vectorize_query(text, legal), doc_ids)
+        assert list(got) == pytest.approx(list(expected), abs=TOLERANCE[name])
+        assert got[-1] == 0
+
+    batch = engine.search_batch(queries, top_k=5)
+    assert [[d for d, _ in r] for r in batch] == [[d for d, _ in engine.search(t, lg, top_k=5)] for t, lg in queries]
+
+
+@pytest.mark.parametrize("name", list(TOLERANCE))
+def test_legal_candidates(name, engines, dict_engine, corpus):
+    _, queries = corpus
+    for _, legal in queries:
+        assert engines[name].legal_candidates(legal) == dict_engine.legal_candidates(legal)
+    assert engines[name].legal_candidates(["LEGAL:чл:999_НЯМА"]) is None
+
+
+@pytest.mark.parametrize("name", list(TOLERANCE))
+def test_query_pruning(name, engines, corpus):
+    docs, queries = corpus
+    engine = engines[name]
+    for text, legal in queries:
+        full = engine.search(text, legal, top_k=10)
+
+        # без подрязване и при mass=1.0 – същото търсене
+        assert prune_query_tokens(engine, text, legal, QueryPruning()) == (text, legal, None)
+        t, lg, norms = prune_query_tokens(engine, text, legal, QueryPruning(text_mass=1.0, legal_mass=1.0))
+        got = engine.search(t, lg, top_k=10, query_norms=norms)
+        assert [d for d, _ in got] == [d for d, _ in full]
+        assert [s for _, s in got] == pytest.approx([s for _, s in full], abs=1e-9)
+
+        # подрязване само на text: legal частта на score-а не се надува
+        stats = {}
+        t, lg, norms = prune_query_tokens(engine, text, legal, QueryPruning(text_top_n=3), stats)
+        assert lg == legal and stats["query_terms_kept"] < stats["query_terms"]
+        exact = dict(engine.search(text, legal, top_k=len(docs)))
+        for doc_id, score in engine.search(t, lg, top_k=len(docs), query_norms=norms):
+            assert score <= exact[doc_id] + 1e-9
+
+
+def test_query_pruning_same_across_engines(engines, corpus):
+    _, queries = corpus
+    pruning = QueryPruning(text_top_n=5, legal_mass=0.8)
+    for text, legal in queries:
+        t, lg, norms = prune_query_tokens(engines["dict"], text, legal, pruning)
+        expected = engines["dict"].search(t, lg, top_k=10, query_norms=norms)
+        for name in ("compact", "segments"):
+            t2, lg2, norms2 = prune_query_tokens(engines[name], text, legal, pruning)
+            assert (t2, lg2) == (t, lg)
+            got = engines[name].search(t2, lg2, top_k=10, query_norms=norms2)
+            assert [d for d, _ in got] == [d for d, _ in expected]
+            assert [s for _, s in got] == pytest.approx([s for _, s in expected], abs=1e-6)
+
+
+def _pruned(docs, **options) -> TfidfSearchEngine:
+    engine = TfidfSearchEngine()
+    engine.build_index({d: t for d, (t, _) in docs.items()}, {d: lg for d, (_, lg) in docs.items()})
+    engine.prune_documents(**options)
+    return engine
+
+
+def test_static_pruning(dict_engine, corpus):
+    docs, queries = corpus
+    longest = max(len(v) for v in dict_engine.tfidf_docs_text.values())
+
+    # граница над най-дългия вектор – нищо не се маха
+    untouched = _pruned(docs, max_terms=longest)
+    assert untouched.tfidf_docs_text == dict_engine.tfidf_docs_text
+    assert not untouched.doc_norms_text
+
+    pruned = _pruned(docs, max_terms=10)
+    assert max(len(v) for v in pruned.tfidf_docs_text.values()) == 10
+    compact = CompactTfidfEngine.from_engine(pruned)
+    for text, legal in queries:
+        expected = pruned.search(text, legal, top_k=10)
+        # нормите отпреди подрязването минават и в компактния индекс
+        got = compact.search(text, legal, top_k=10)
+        assert [d for d, _ in got] == [d for d, _ in expected]
+        assert [s for _, s in got] == pytest.approx([s for _, s in expected], abs=1e-6)
+        # подрязаният документ никога не печели – липсващите термини само отнемат
+        exact = dict(dict_engine.search(text, legal, top_k=len(docs)))
+        for doc_id, score in expected:
+            assert score <= exact[doc_id] + 1e-9
@@ -0,0 +1,72 @@
+import pytest
+
+from legal_trie import LegalReferenceTrie, parse_cites, path_token
+
+DOCS = [
+    ("a.pdf", ["LEGAL:чл:5_ЗЗдр", "LEGAL:чл:145_ал:1_АПК"]),
+    ("b.pdf", ["LEGAL:чл:5_ал:2_ЗЗдр", "LEGAL:§:1_ИЗоБ"]),
+    ("c.pdf", ["LEGAL:чл:146_АПК"]),
+]
+
+
+@pytest.fixture
+def trie():
+    return LegalReferenceTrie.from_documents(DOCS)
+
+
+def cited(trie, spec):
+    return trie.documents(trie.citing(parse_cites(spec)))
+
+
+def test_parse_cites_forms():
+    assert parse_cites("АПК:чл:145:ал:1") == ("АПК", "чл:145", "ал:1")
+    assert parse_cites("LEGAL:чл:145_ал:1_АПК") == ("АПК", "чл:145", "ал:1")
+    assert parse_cites(" АПК : ЧЛ : 145 ") == ("АПК", "чл:145")
+    for bad in ("", "чл:145", "АПК:чл", "АПК:ал:1:чл:2", "АПК:чл:x", "АПК:гл:1"):
+        with pytest.raises(ValueError):
+            parse_cites(bad)
+
+
+@pytest.mark.parametrize("spec", ["ЗЗдр:чл:5", "ЗЗДР:чл:5", "зздр:чл:5", "чл:5_ЗЗдр", "LEGAL:чл:5_ЗЗДР"])
+def test_mixed_case_law_matches(trie, spec):
+    assert cited(trie, spec) == {"a.pdf", "b.pdf"}
+
+
+def test_subtree_exact_and_and(trie):
+    assert cited(trie, "АПК") == {"a.pdf", "c.pdf"}
+    assert cited(trie, "ИЗоБ:§:1") == {"b.pdf"}
+    assert trie.documents(trie.citing(parse_cites("ЗЗдр:чл:5"), exact=True)) == {"a.pdf"}
+    both = trie.citing_all([parse_cites("ЗЗдр"), parse_cites("АПК")])
+    assert trie.documents(both) == {"a.pdf"}
+
+
+def test_references_use_indexed_spelling(trie):
+    assert trie.children(parse_cites("зздр")) == [("LEGAL:чл:5_ЗЗдр", 2)]
+    assert trie.ancestors(parse_cites("ЗЗДР:чл:5:ал:2")) == ["LEGAL:чл:5_ЗЗдр"]
+    assert trie.descendants(parse_cites("ЗЗДР:чл:5")) == ["LEGAL:чл:5_ЗЗдр", "LEGAL:чл:5_ал:2_ЗЗдр"]
+    assert ("LEGAL:ИЗоБ", 1) in trie.children(())
+
+
+def test_token_round_trip(corpus):
+    docs, _ = corpus
+    tokens = {t for _, legal in docs.values() for t in legal}
+    for token in tokens:
+        path = parse_cites(token)
+        assert path_token(path) == token
+        # и във вида LAW:ниво:номер
+        assert parse_cites(":".join(path[:1] + tuple(p for level in path[1:] for p in level.split(":")))) == path
+
+
+def test_trie_from_engine_matches_tokens(dict_engine, corpus):
+    docs, _ = corpus
+    trie = LegalReferenceTrie.from_engine(dict_engine)
+    for token in {t for _, legal in docs.values() for t in legal}:
+        path = parse_cites(token)
+        # документите, цитиращи точно този токен или негово подниво
+        expected = {
+            d for d, (_, legal) in docs.items()
+            if any(parse_cites(t)[:len(path)] == path for t in legal)
+        }
+        assert trie.documents(trie.citing(path)) == expected
+        exact = {d for d, (_, legal) in docs.items() if token in legal}
+        assert trie.documents(trie.citing(path, exact=True)) == exact
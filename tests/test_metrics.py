@@ -0,0 +1,49 @@
+# Броячи от няколко процеса (gunicorn worker-и) през PROMETHEUS_MULTIPROC_DIR.
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import metrics
+
+ROOT = Path(__file__).resolve().parent.parent
+
+WORKER = """
+import metrics
+metrics.QUERIES.inc()
+metrics.REQUEST_SECONDS.observe(0.02, endpoint="/search/pdf")
+metrics.flush()
+"""
+
+
+def _sample(text: str, name: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[-1])
+    # серия без наблюдения още не се рендира
+    return 0.0
+
+
+def test_render_sums_all_processes(tmp_path, monkeypatch):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", WORKER], cwd=ROOT, env=env, check=True)
+    assert len(list(tmp_path.glob("*.json"))) == 2
+
+    monkeypatch.setattr(metrics, "MULTIPROC_DIR", str(tmp_path))
+    before = _sample(metrics.render_prometheus(), "legal_search_queries_total")
+    metrics.QUERIES.inc()
+    text = metrics.render_prometheus()
+
+    assert _sample(text, "legal_search_queries_total") == before + 1
+    assert before >= 2
+    count = _sample(text, 'legal_search_request_seconds_count{endpoint="/search/pdf"}')
+    assert count >= 2
+    assert _sample(text, 'legal_search_request_seconds_bucket{endpoint="/search/pdf",le="0.025"}') >= 2
+
+
+def test_render_without_dir_is_local(monkeypatch):
+    monkeypatch.setattr(metrics, "MULTIPROC_DIR", None)
+    before = _sample(metrics.render_prometheus(), "legal_search_queries_total")
+    metrics.QUERIES.inc(3)
+    assert _sample(metrics.render_prometheus(), "legal_search_queries_total") == before + 3
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from postings_store import (
+    BLOCK_SIZE,
+    CODECS,
+    PostingsTfidfEngine,
+    block_decode,
+    block_encode,
+    varint_decode,
+    varint_encode,
+)
+
+EDGE_VALUES = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 31 - 1, 2 ** 32, 2 ** 40 + 5]
+
+
+@pytest.mark.parametrize("values", [
+    [],
+    EDGE_VALUES,
+    np.random.default_rng(0).integers(0, 5000, size=1000).tolist(),
+])
+def test_varint_round_trip(values):
+    buf = varint_encode(np.array(values, dtype=np.int64))
+    assert buf.dtype == np.uint8
+    assert varint_decode(buf).tolist() == values
+
+
+def test_varint_lengths():
+    # 7 бита на байт
+    assert [len(varint_encode(np.array([v]))) for v in (0, 127, 128, 16383, 16384)] == [1, 1, 2, 2, 3]
+
+
+@pytest.mark.parametrize("n", [0, 1, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE + 1, 3 * BLOCK_SIZE + 7])
+def test_block_round_trip(n):
+    rng = np.random.default_rng(n)
+    values = rng.integers(0, 300, size=n)
+    if n:
+        values[0] = 0
+    buf = block_encode(values)
+    assert block_decode(buf, n).tolist() == values.tolist()
+
+
+def test_block_all_zero_and_wide_values():
+    zeros = np.zeros(BLOCK_SIZE + 3, dtype=np.int64)
+    assert block_decode(block_encode(zeros), len(zeros)).tolist() == zeros.tolist()
+    wide = np.array([2 ** 40, 1, 2 ** 33 + 7], dtype=np.int64)
+    assert block_decode(block_encode(wide), 3).tolist() == wide.tolist()
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_save_load_round_trip(codec, dict_engine, corpus, tmp_path):
+    docs, queries = corpus
+    engine = PostingsTfidfEngine.from_engine(dict_engine, codec=codec)
+    engine.save(tmp_path)
+    loaded = PostingsTfidfEngine.load(tmp_path, mmap_mode="r")
+    assert loaded.codec == codec
+
+    for text, legal in queries:
+        # записът не променя нищо
+        assert loaded.search(text, legal, top_k=10) == engine.search(text, legal, top_k=10)
+
+        # impact-ите са uint8 с мащаб на термин – score-ът е близък до точния
+        exact = dict(dict_engine.search(text, legal, top_k=len(docs)))
+        got = loaded.search(text, legal, top_k=10)
+        for doc_id, score in got:
+            assert score == pytest.approx(exact[doc_id], abs=5e-3)
+        top = {d for d, _ in dict_engine.search(text, legal, top_k=10)}
+        assert len(top & {d for d, _ in got}) >= 8
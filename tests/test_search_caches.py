@@ -0,0 +1,35 @@
+import gc
+import time
+
+from engine_holder import IndexVersion
+from search import legal_trie
+from snippets import SnippetStore
+
+
+class SnapshotEngine:
+    """
+    Като SegmentedTfidfEngine за кешовете в search.py: engine, чийто snapshot се сменя.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.snapshot = object()
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+
+def test_trie_follows_snapshot_identity(dict_engine, tmp_path):
+    engine = SnapshotEngine(dict_engine)
+    current = IndexVersion(engine, SnippetStore(tmp_path), 1, time.time(), 0.0)
+
+    first = legal_trie(current)
+    assert legal_trie(current) is first
+
+    # старият snapshot е освободен; кешът държи своя и не може да го обърка с нов
+    engine.snapshot = object()
+    gc.collect()
+    second = legal_trie(current)
+    assert second is not first
+    assert current.cache["legal_trie"][0] is engine.snapshot
+    assert legal_trie(current) is second
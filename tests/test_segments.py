@@ -0,0 +1,150 @@
+# Сегментиран индекс срещу JSON индекса на tf_idf_index_builder върху малък
+# ръчно написан counts spool и срещу dict engine-а при изтривания и сливания.
+import json
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+import tf_idf_index_builder
+from conftest import counts_records, make_corpus
+from index_store import load_engine, load_json_engine
+from segments import SegmentedIndex, SegmentedTfidfEngine, manifest_stale_reason, read_manifest
+from tf_idf_engine import TfidfSearchEngine
+from tf_idf_index_builder import COUNTS_DIR_NAME, write_index_from_counts
+
+DOCS = {
+    "a.pdf": ({"данък": 3, "декларация": 1, "срок": 2}, {"ДОПК:чл:107": 2}),
+    "b.pdf": ({"данък": 1, "ревизия": 4, "акт": 2}, {"ДОПК:чл:107": 1, "ЗДДС:чл:70": 1}),
+    "c.pdf": ({"обезщетение": 2, "вреда": 3, "акт": 1}, {"ЗОДОВ:чл:1": 2}),
+    "d.pdf": ({"строеж": 2, "разрешение": 2, "срок": 1}, {"ЗУТ:чл:225": 1}),
+    "e.pdf": ({"данък": 2, "срок": 1, "лихва": 1}, {"ЗДДС:чл:70": 1}),
+}
+
+
+def write_counts(index_dir: Path, part: str, docs: dict) -> None:
+    counts_dir = index_dir / COUNTS_DIR_NAME
+    counts_dir.mkdir(parents=True, exist_ok=True)
+    with (counts_dir / f"{part}.jsonl").open("w", encoding="utf-8") as f:
+        for doc_id, (text, legal) in docs.items():
+            f.write(json.dumps({"doc": doc_id, "text": text, "legal": legal}, ensure_ascii=False) + "\n")
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    write_counts(tmp_path, "base", DOCS)
+    return tmp_path
+
+
+def build_json(index_dir: Path, duplicates: dict, monkeypatch) -> None:
+    # duplicates_pass е MinHash; тук групите са зададени ръчно
+    monkeypatch.setattr(tf_idf_index_builder, "duplicates_pass", lambda _: duplicates)
+    write_index_from_counts(index_dir)
+
+
+def test_seed_skips_duplicates_and_matches_json(index_dir, monkeypatch):
+    build_json(index_dir, {"a.pdf": ["e.pdf"]}, monkeypatch)
+    SegmentedIndex(index_dir).seed_from_counts()
+
+    segmented = SegmentedTfidfEngine(index_dir, refresh_interval=None)
+    json_engine = load_json_engine(index_dir)
+    assert sorted(segmented.snapshot.doc_ids) == sorted(json_engine.tfidf_docs_text) == ["a.pdf", "b.pdf", "c.pdf", "d.pdf"]
+
+    query = (["данък", "срок"], ["ДОПК:чл:107"])
+    expected = json_engine.search(*query, top_k=4)
+    got = segmented.search(*query, top_k=4)
+    assert [d for d, _ in got] == [d for d, _ in expected]
+    assert [s for _, s in got] == pytest.approx([s for _, s in expected])
+
+
+def test_rebuild_makes_segments_stale(index_dir, capsys, monkeypatch):
+    build_json(index_dir, {}, monkeypatch)
+    SegmentedIndex(index_dir).seed_from_counts()
+    assert manifest_stale_reason(index_dir) is None
+    assert isinstance(load_engine(index_dir), SegmentedTfidfEngine)
+
+    write_counts(index_dir, "seg_extra", {"f.pdf": ({"ревизия": 1}, {})})
+    build_json(index_dir, {}, monkeypatch)
+    assert manifest_stale_reason(index_dir) is not None
+    assert "segmented index is now stale" in capsys.readouterr().out
+
+    engine = load_engine(index_dir)
+    assert not isinstance(engine, SegmentedTfidfEngine)
+    assert "f.pdf" in engine.tfidf_docs_text
+
+    # init наново – сегментите пак отговарят на JSON индекса
+    SegmentedIndex(index_dir).seed_from_counts()
+    assert manifest_stale_reason(index_dir) is None
+    assert "f.pdf" in SegmentedTfidfEngine(index_dir, refresh_interval=None).snapshot.doc_ids
+
+
+def test_seed_refuses_static_pruning(index_dir, monkeypatch):
+    monkeypatch.setattr(tf_idf_index_builder, "PRUNE_MAX_TERMS", 2)
+    with pytest.raises(ValueError):
+        SegmentedIndex(index_dir).seed_from_counts()
+
+
+def _dict_engine(docs: dict) -> TfidfSearchEngine:
+    engine = TfidfSearchEngine()
+    engine.build_index({d: t for d, (t, _) in docs.items()}, {d: lg for d, (_, lg) in docs.items()})
+    return engine
+
+
+def _assert_same_scores(engine, reference, queries, n_docs):
+    for text, legal in queries:
+        expected = dict(reference.search(text, legal, top_k=n_docs))
+        got = dict(engine.search(text, legal, top_k=n_docs))
+        assert got.keys() == expected.keys()
+        for doc_id, score in expected.items():
+            assert got[doc_id] == pytest.approx(score, abs=1e-9)
+
+
+def test_tombstones_and_merge_match_dict_engine(tmp_path):
+    docs, queries = make_corpus(n_docs=40, seed=3)
+    records = counts_records(docs)
+    index = SegmentedIndex(tmp_path, merge_factor=3)
+    for s in range(0, 40, 10):
+        index.add_documents(records[s:s + 10])
+    engine = SegmentedTfidfEngine(tmp_path, refresh_interval=None)
+
+    # изтрити документи изчезват и от idf-а (df по живите документи)
+    deleted = ["doc_003.pdf", "doc_017.pdf", "doc_025.pdf"]
+    assert index.delete(deleted + ["missing.pdf"]) == 3
+    assert index.delete(deleted) == 0
+    # повторно добавен документ заменя старото си копие
+    replaced_text = docs["doc_030.pdf"][0][:5]
+    index.add_documents([("doc_030.pdf", Counter(replaced_text), Counter())])
+
+    live = {d: v for d, v in docs.items() if d not in deleted}
+    live["doc_030.pdf"] = (replaced_text, [])
+    assert engine.refresh()
+    assert sorted(engine.snapshot.doc_ids) == sorted(live)
+    _assert_same_scores(engine, _dict_engine(live), queries, len(docs))
+
+    # сливане: същите резултати, tombstones на слетите сегменти изчезват
+    manifest = read_manifest(tmp_path)
+    merged = index.merge([e["name"] for e in manifest["segments"][:4]])
+    manifest = read_manifest(tmp_path)
+    assert [e["name"] for e in manifest["segments"]][0] == merged
+    assert len(manifest["segments"]) == 2
+    assert merged not in manifest["tombstones"]
+    assert engine.refresh()
+    _assert_same_scores(engine, _dict_engine(live), queries, len(docs))
+
+    # изтриване след сливането – tombstone в новия сегмент
+    index.delete(["doc_000.pdf"])
+    del live["doc_000.pdf"]
+    assert engine.refresh()
+    _assert_same_scores(engine, _dict_engine(live), queries, len(docs))
+
+
+def test_pick_merge_by_tier(tmp_path):
+    docs, _ = make_corpus(n_docs=12, seed=4)
+    records = counts_records(docs)
+    index = SegmentedIndex(tmp_path, merge_factor=3)
+    assert index.maybe_merge() is None
+    for s in range(0, 9, 3):
+        index.add_documents(records[s:s + 3])
+    # три сегмента от едно ниво -> сливат се в един
+    assert index.maybe_merge() is not None
+    assert [e["n_docs"] for e in read_manifest(tmp_path)["segments"]] == [9]
@@ -0,0 +1,34 @@
+from snippets import SnippetStore, SnippetStoreWriter
+
+TOKEN = "LEGAL:чл:145_ал:1_АПК"
+
+
+def write_part(index_dir, part, doc_id, text="Съдът прилага чл. 145, ал. 1 от АПК в случая."):
+    start = text.index("чл.")
+    with SnippetStoreWriter(index_dir, part) as writer:
+        writer.add(doc_id, text, {TOKEN: [[start, start + 20]]})
+
+
+def test_highlight_window(tmp_path):
+    write_part(tmp_path, "base", "a.pdf")
+    [hit] = SnippetStore(tmp_path).highlights("a.pdf", [TOKEN], window=5)
+    assert hit["reference"] == "чл. 145, ал. 1 АПК"
+    start, end = hit["highlight"]
+    assert hit["snippet"].startswith("…")
+    assert hit["snippet"][start:end] == "чл. 145, ал. 1 от АП"
+
+
+def test_sync_loads_parts_of_new_segments(tmp_path):
+    write_part(tmp_path, "base", "a.pdf")
+    store = SnippetStore(tmp_path)
+    store.sync(1)
+    assert store.highlights("a.pdf", [TOKEN])
+
+    # сегмент, публикуван след зареждането (ingest_pipeline --segmented)
+    write_part(tmp_path, "seg_1", "b.pdf")
+    store.sync(1)
+    assert store.highlights("b.pdf", [TOKEN]) == []
+
+    store.sync(2)
+    assert store.highlights("b.pdf", [TOKEN])[0]["token"] == TOKEN
+    assert store.highlights("a.pdf", [TOKEN])
@@ -1,20 +1,42 @@
+from dataclasses import dataclass, field
 from pathlib import Path
 
 import unicodedata
 import json
 import re
+import threading
 
 from domain_entities_extraction import extract_domain_entities
 from domain_entities_normalization import extract_text_from_pdf
+from metrics import span
 
 from stemmer.bulgarian_stemmer import BulgarianStemmer
 
 BASE_DIR = Path(__file__).resolve().parent
 DATA_DIR = BASE_DIR / "Data"
 
-stemmer = BulgarianStemmer(
-    r"C:\Projects\PycharmProjects\legal_docs_search\stemmer\stem_rules_context_1.txt"
-)
+STEM_RULES_PATH = BASE_DIR / "stemmer" / "stem_rules_context_1.txt"
+
+# правилата се четат при първата нужда, а не при import (вж. get_stemmer)
+_stemmer = None
+_stemmer_lock = threading.Lock()
+
+
+def get_stemmer() -> BulgarianStemmer:
+    global _stemmer
+    if _stemmer is None:
+        with _stemmer_lock:
+            if _stemmer is None:
+                _stemmer = BulgarianStemmer(str(STEM_RULES_PATH))
+    return _stemmer
+
+
+def stemmer_loaded() -> bool:
+    return _stemmer is not None
+
+
+def stemmer(token: str) -> str:
+    return get_stemmer()(token)
 
 SENSITIVE_MARKERS = [
     "еик",
@@ -51,6 +73,27 @@ DATE_REGEX = re.compile(
     re.VERBOSE
 )
 
+# метаданни от заглавната част на акта (вж. extract_metadata)
+METADATA_HEADER_CHARS = 600
+
+# "РЕШЕНИЕ", но и разредено "Р Е Ш Е Н И Е"
+ACT_TYPES = ["тълкувателно решение", "решение", "определение", "разпореждане", "присъда"]
+ACT_TYPE_REGEX = re.compile(
+    r"\b(" + "|".join(r"\s?".join(word.replace(" ", "")) for word in ACT_TYPES) + r")\b",
+    re.IGNORECASE
+)
+ACT_TYPE_NAMES = {word.replace(" ", ""): word for word in ACT_TYPES}
+
+# "Административен съд София-град", "Върховен административен съд", "Районен съд - Пловдив",
+# и изцяло с главни: "АДМИНИСТРАТИВЕН СЪД – ПЛОВДИВ". Главна е задължителна само
+# първата буква (иначе "настоящият съд" от текста също би минал), името е на един
+# ред, а видът акт след него не е град. Стойността се нормализира с normalize_court.
+COURT_REGEX = re.compile(
+    r"\b([А-Я](?i:[а-я]+(?:[ \t]+[а-я]+)?[ \t]+съд))\b(?:\s*[-–]\s*|[ \t]+)?"
+    r"(?!(?i:" + "|".join(w for w in ACT_TYPES if " " not in w) + r")\b)"
+    r"([А-Я](?i:[а-я]+(?:-[а-я]+)?))?"
+)
+
 MONEY_REGEX = r"""
 (?:€|\$|лв\.?|лева|bgn)\s*\d{1,3}(?:[ .]\d{3})*(?:[,.]\d+)?
 |
@@ -117,20 +160,106 @@ def preprocess(text: str) -> list[str]:
 
 
 def _finalize_text_tokens(text: str) -> list[str]:
-    tokens = preprocess(text)
-    tokens = [t for t in tokens if len(t) > 2 and not t.isdigit()]
-    tokens = [stemmer(t) for t in tokens]
+    with span("finalize_text_tokens"):
+        tokens = preprocess(text)
+        tokens = [t for t in tokens if len(t) > 2 and not t.isdigit()]
+        with span("stemming"):
+            stem = get_stemmer()
+            tokens = [stem(t) for t in tokens]
     return tokens
 
 
+# колко срещания на един LEGAL токен пазим за snippets
+MAX_SPANS_PER_TOKEN = 8
+
+
+@dataclass
+class ProcessedDocument:
+    text_tokens: list[str]
+    legal_tokens: list[str]
+    # изчистеният текст (свити whitespace-и), към който сочат legal_spans
+    display_text: str = ""
+    # LEGAL токен -> [(start, end), ...]
+    legal_spans: dict[str, list[tuple[int, int]]] = field(default_factory=dict)
+    # court / act_type / year / laws (вж. extract_metadata)
+    metadata: dict = field(default_factory=dict)
+
+
+def normalize_court(name: str, city: str | None = None) -> str:
+    """
+    "АДМИНИСТРАТИВЕН  СЪД", "ПЛОВДИВ" -> "Административен съд Пловдив":
+    главна само първата буква на името и на града (София-град).
+    """
+    name = re.sub(r"\s+", " ", name).lower()
+    court = name[:1].upper() + name[1:]
+    if city:
+        court += " " + city[:1].upper() + city[1:].lower()
+    return court
+
+
+def extract_metadata(raw_text: str, legal_tokens: list[str]) -> dict:
+    """
+    Съд, вид акт и година – от заглавната част (преди "следното:"), цитираните
+    закони – от LEGAL токените (LEGAL:чл:145_ал:1_АПК -> АПК). None, ако липсват.
+    """
+    header = raw_text[:METADATA_HEADER_CHARS]
+
+    act_type = ACT_TYPE_REGEX.search(header)
+    if act_type is not None:
+        act_type = ACT_TYPE_NAMES[re.sub(r"\s+", "", act_type.group(1).lower())]
+
+    court = COURT_REGEX.search(header)
+    if court is not None:
+        court = normalize_court(*court.groups())
+
+    year = None
+    date = DATE_REGEX.search(header)
+    if date is not None:
+        year = int(re.findall(r"(?:19|20)\d{2}", date.group())[-1])
+
+    laws = sorted({token.rsplit("_", 1)[-1].removeprefix("LEGAL:") for token in legal_tokens})
+    return {"court": court, "act_type": act_type, "year": year, "laws": laws}
+
+
+def process_text_document(raw_text: str) -> ProcessedDocument:
+    trimmed_text = remove_text_before_marker_safe(raw_text)
+
+    spans = []
+    with span("extract_domain_entities"):
+        text, legal_tokens = extract_domain_entities(trimmed_text, spans=spans)
+
+    legal_spans: dict[str, list[tuple[int, int]]] = {}
+    for start, end, reference_tokens in spans:
+        for token in reference_tokens:
+            token_spans = legal_spans.setdefault(token, [])
+            if len(token_spans) < MAX_SPANS_PER_TOKEN:
+                token_spans.append((start, end))
+
+    return ProcessedDocument(
+        text_tokens=_finalize_text_tokens(text),
+        legal_tokens=legal_tokens,
+        display_text=re.sub(r"\s+", " ", trimmed_text),
+        legal_spans=legal_spans,
+        metadata=extract_metadata(raw_text, legal_tokens),
+    )
+
+
+def process_pdf_document(pdf_file: Path) -> ProcessedDocument:
+    with span("extract_text_from_pdf"):
+        raw_text = extract_text_from_pdf(pdf_file)
+    return process_text_document(raw_text)
+
+
 def process_pdf(pdf_file: Path) -> tuple[list[str], list[str]]:
     """
     Returns: (text_tokens, legal_tokens)
     """
-    raw_text = extract_text_from_pdf(pdf_file)
+    with span("extract_text_from_pdf"):
+        raw_text = extract_text_from_pdf(pdf_file)
     trimmed_text = remove_text_before_marker_safe(raw_text)
 
-    text, legal_tokens = extract_domain_entities(trimmed_text)
+    with span("extract_domain_entities"):
+        text, legal_tokens = extract_domain_entities(trimmed_text)
 
     text_tokens = _finalize_text_tokens(text)
 
@@ -1,7 +1,8 @@
+import heapq
 import math
 import re
 from collections import Counter, defaultdict
-from typing import Dict, List, Tuple
+from typing import Collection, Dict, Iterator, List, Optional, Set, Tuple, Union
 
 
 # Колко тежи legal similarity спрямо text similarity
@@ -13,6 +14,11 @@ W_LEGAL = LEGAL_LAMBDA / (1.0 + LEGAL_LAMBDA)
 
 # boost по специфичност за LEGAL:* токени
 LEGAL_SPEC_LOG_WEIGHT = 0.8
+
+# build_index през numpy (vectorized_index.py) – същите тегла, ~1.2-1.9x по-бързо
+# според корпуса (етап "build_index" в benchmark.py); False – чистият Python път.
+# Streaming builder-ът (tf_idf_index_builder.py) смята теглата по документ.
+VECTORIZED_BUILD = True
 _LEGAL_LEVEL_RE = re.compile(r"(чл:|§:|ал:|т:)")
 
 
@@ -28,7 +34,13 @@ def compute_tf(tokens: List[str]) -> Dict[str, float]:
     """
     TF = 1 + log10(freq)
     """
-    freq = Counter(tokens)
+    return compute_tf_from_counts(Counter(tokens))
+
+
+def compute_tf_from_counts(freq: Dict[str, int]) -> Dict[str, float]:
+    """
+    TF = 1 + log10(freq), от вече преброени честоти
+    """
     tf = {}
     for token, count in freq.items():
         tf[token] = 1 + math.log10(count)
@@ -46,6 +58,13 @@ def compute_idf(documents_tokens: Dict[str, List[str]]) -> Dict[str, float]:
         for token in set(tokens):
             df[token] += 1
 
+    return compute_idf_from_df(df, N)
+
+
+def compute_idf_from_df(df: Dict[str, int], N: int) -> Dict[str, float]:
+    """
+    IDF = log10(N / df), от вече събрани document frequencies
+    """
     idf = {}
     for token, doc_freq in df.items():
         # защита при doc_freq==0 не е нужна, но пазим формулата стабилна
@@ -63,7 +82,19 @@ def compute_tfidf_vector(
     """
     TF-IDF sparse vector: token -> weight
     """
-    tf = compute_tf(tokens)
+    return compute_tfidf_vector_from_counts(Counter(tokens), idf, is_legal_field=is_legal_field)
+
+
+def compute_tfidf_vector_from_counts(
+    freq: Dict[str, int],
+    idf: Dict[str, float],
+    *,
+    is_legal_field: bool = False
+) -> Dict[str, float]:
+    """
+    TF-IDF sparse vector от term counts: token -> weight
+    """
+    tf = compute_tf_from_counts(freq)
     tfidf = {}
 
     for token, tf_value in tf.items():
@@ -76,17 +107,145 @@ def compute_tfidf_vector(
     return tfidf
 
 
+def prune_document_vector(
+    vec: Dict[str, float],
+    min_relative_weight: Optional[float] = None,
+    max_terms: Optional[int] = None
+) -> Dict[str, float]:
+    """
+    Статично подрязване: без термините с тегло под min_relative_weight * нормата
+    на вектора и извън max_terms най-тежките. Нормата на резултата вече не е
+    нормата на документа – пази се отделно (вж. TfidfSearchEngine.prune_documents).
+    """
+    if min_relative_weight is None and max_terms is None:
+        return dict(vec)
+
+    items = vec.items()
+    if min_relative_weight is not None:
+        cutoff = min_relative_weight * math.sqrt(sum(v ** 2 for v in vec.values()))
+        items = [(t, w) for t, w in items if abs(w) >= cutoff]
+    if max_terms is not None and len(items) > max_terms:
+        items = heapq.nlargest(max_terms, items, key=lambda x: (abs(x[1]), x[0]))
+    return dict(items)
+
+
+def l2_normalize(vec: Dict[str, float]) -> Dict[str, float]:
+    norm = math.sqrt(sum(v ** 2 for v in vec.values()))
+    if norm == 0:
+        return dict(vec)
+    return {t: v / norm for t, v in vec.items()}
+
+
 def cosine_similarity_sparse(v1: Dict[str, float], v2: Dict[str, float]) -> float:
+    return _cosine_with_overlap(v1, v2)[0]
+
+
+def _cosine_with_overlap(
+    v1: Dict[str, float],
+    v2: Dict[str, float],
+    norm_v2: Optional[float] = None,
+    norm_v1: Optional[float] = None
+) -> Tuple[float, int]:
+    """
+    (cosine, брой общи токени); norm_v2 – нормата на v2 преди статично подрязване,
+    norm_v1 – нормата на заявката преди подрязване (query_pruning.py)
+    """
     common_tokens = set(v1.keys()) & set(v2.keys())
     numerator = sum(v1[t] * v2[t] for t in common_tokens)
 
-    norm_v1 = math.sqrt(sum(v ** 2 for v in v1.values()))
-    norm_v2 = math.sqrt(sum(v ** 2 for v in v2.values()))
+    if norm_v1 is None:
+        norm_v1 = math.sqrt(sum(v ** 2 for v in v1.values()))
+    if norm_v2 is None:
+        norm_v2 = math.sqrt(sum(v ** 2 for v in v2.values()))
 
     if norm_v1 == 0 or norm_v2 == 0:
-        return 0.0
+        return 0.0, len(common_tokens)
+
+    return numerator / (norm_v1 * norm_v2), len(common_tokens)
+
+
+def _field_cosines(
+    q_vec: Dict[str, float],
+    postings: Dict[str, List[Tuple[int, float]]],
+    norms: List[float],
+    q_norm: Optional[float] = None
+) -> Tuple[Dict[int, float], int]:
+    """
+    Term-at-a-time cosine на заявка срещу postings на едно поле:
+    ({doc_idx: cosine}, брой обходени postings); q_norm – вж. _cosine_with_overlap
+    """
+    if q_norm is None:
+        q_norm = math.sqrt(sum(v ** 2 for v in q_vec.values()))
+    if q_norm == 0:
+        return {}, 0
+
+    dots = defaultdict(float)
+    touched = 0
+    for token, q_w in q_vec.items():
+        for idx, d_w in postings.get(token, ()):
+            dots[idx] += q_w * d_w
+            touched += 1
+
+    cosines = {}
+    for idx, dot in dots.items():
+        d_norm = norms[idx]
+        if d_norm:
+            cosines[idx] = dot / (q_norm * d_norm)
+    return cosines, touched
+
+
+# (text, legal) нормите на заявката преди подрязване; None – от самите вектори
+QueryNorms = Optional[Tuple[Optional[float], Optional[float]]]
+BatchQuery = Union[Tuple[List[str], List[str]], Tuple[List[str], List[str], QueryNorms]]
 
-    return numerator / (norm_v1 * norm_v2)
+
+def split_batch_query(query: BatchQuery) -> Tuple[List[str], List[str], QueryNorms]:
+    if len(query) == 3:
+        return query
+    return query[0], query[1], None
+
+
+def iter_bits(bits: int) -> Iterator[int]:
+    """
+    Индексите на вдигнатите битове, от най-младшия
+    """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def two_stage_search(
+    engine,
+    query_text_tokens: List[str],
+    query_legal_tokens: List[str],
+    top_k: int = 5,
+    min_score: float = 0.0,
+    stats: Optional[Dict[str, int]] = None,
+    candidates: Optional[Collection[str]] = None,
+    query_norms: QueryNorms = None
+) -> List[Tuple[str, float]]:
+    """
+    Етап 1: кандидати по общи LEGAL токени (engine.legal_candidates);
+    етап 2: пълният score само върху тях (engine.search(..., candidates=)).
+    Без legal токени (или с по-малко от top_k кандидата) – пълно търсене.
+    Документи без обща препратка не могат да влязат в резултата.
+    candidates (cites/метаданни) ограничава и двата етапа: LEGAL кандидатите
+    се пресичат с тях, а резервното пълно търсене е само върху тях.
+    """
+    restrict = candidates
+    candidates = engine.legal_candidates(query_legal_tokens)
+    if candidates is not None and restrict is not None:
+        candidates = candidates & set(restrict)
+    if candidates is not None and len(candidates) < top_k:
+        candidates = None
+    if candidates is None:
+        candidates = restrict
+
+    if stats is not None:
+        stats["candidates"] = len(engine.tfidf_docs_text) if candidates is None else len(candidates)
+
+    return engine.search(query_text_tokens, query_legal_tokens, top_k, min_score, stats, candidates, query_norms)
 
 
 class TfidfSearchEngine:
@@ -103,26 +262,74 @@ class TfidfSearchEngine:
         self.tfidf_docs_text: Dict[str, Dict[str, float]] = {}
         self.tfidf_docs_legal: Dict[str, Dict[str, float]] = {}
 
+        # doc_id -> норма на text вектора преди статичното подрязване (само за
+        # подрязаните документи; за останалите нормата се смята от вектора)
+        self.doc_norms_text: Dict[str, float] = {}
+
+        # inverted postings за search_batch; строят се мързеливо от векторите
+        self._postings = None
+        # LEGAL токен -> bitset (Python int) по реда на документите
+        self._legal_bitsets = None
+        # ann_index.AnnIndex за search_approximate; строи се при първото извикване
+        self._ann = None
+
     def build_index(
         self,
         documents_text_tokens: Dict[str, List[str]],
-        documents_legal_tokens: Dict[str, List[str]]
+        documents_legal_tokens: Dict[str, List[str]],
+        prune_min_relative_weight: Optional[float] = None,
+        prune_max_terms: Optional[int] = None,
+        vectorized: Optional[bool] = None
     ):
+        """
+        prune_*: статично подрязване на text векторите (вж. prune_documents).
+        vectorized: None – VECTORIZED_BUILD.
+        """
         self.documents_text_tokens = documents_text_tokens
         self.documents_legal_tokens = documents_legal_tokens
 
-        self.idf_text = compute_idf(documents_text_tokens)
-        self.idf_legal = compute_idf(documents_legal_tokens)
-
-        self.tfidf_docs_text = {
-            doc_id: compute_tfidf_vector(tokens, self.idf_text, is_legal_field=False)
-            for doc_id, tokens in documents_text_tokens.items()
-        }
-
-        self.tfidf_docs_legal = {
-            doc_id: compute_tfidf_vector(tokens, self.idf_legal, is_legal_field=True)
-            for doc_id, tokens in documents_legal_tokens.items()
-        }
+        if VECTORIZED_BUILD if vectorized is None else vectorized:
+            from vectorized_index import tfidf_field
+
+            self.idf_text, self.tfidf_docs_text = tfidf_field(documents_text_tokens, is_legal_field=False)
+            self.idf_legal, self.tfidf_docs_legal = tfidf_field(documents_legal_tokens, is_legal_field=True)
+        else:
+            self.idf_text = compute_idf(documents_text_tokens)
+            self.idf_legal = compute_idf(documents_legal_tokens)
+
+            self.tfidf_docs_text = {
+                doc_id: compute_tfidf_vector(tokens, self.idf_text, is_legal_field=False)
+                for doc_id, tokens in documents_text_tokens.items()
+            }
+
+            self.tfidf_docs_legal = {
+                doc_id: compute_tfidf_vector(tokens, self.idf_legal, is_legal_field=True)
+                for doc_id, tokens in documents_legal_tokens.items()
+            }
+        self.doc_norms_text = {}
+        self.prune_documents(prune_min_relative_weight, prune_max_terms)
+        self.invalidate_postings()
+
+    def prune_documents(self, min_relative_weight: Optional[float] = None, max_terms: Optional[int] = None) -> int:
+        """
+        Маха нискотежестните термини от text векторите (prune_document_vector).
+        Нормите отпреди подрязването остават в doc_norms_text, така че косинусът
+        се нормира както при пълния вектор. Връща броя махнати термина.
+        """
+        if min_relative_weight is None and max_terms is None:
+            return 0
+
+        removed = 0
+        for doc_id, vec in self.tfidf_docs_text.items():
+            pruned = prune_document_vector(vec, min_relative_weight, max_terms)
+            if len(pruned) == len(vec):
+                continue
+            removed += len(vec) - len(pruned)
+            self.doc_norms_text.setdefault(doc_id, math.sqrt(sum(w ** 2 for w in vec.values())))
+            self.tfidf_docs_text[doc_id] = pruned
+
+        self.invalidate_postings()
+        return removed
 
     def vectorize_query(self, text_tokens: List[str], legal_tokens: List[str]) -> Tuple[Dict[str, float], Dict[str, float]]:
         q_text = compute_tfidf_vector(text_tokens, self.idf_text, is_legal_field=False)
@@ -134,22 +341,245 @@ class TfidfSearchEngine:
         query_text_tokens: List[str],
         query_legal_tokens: List[str],
         top_k: int = 5,
-        min_score: float = 0.0
+        min_score: float = 0.0,
+        stats: Optional[Dict[str, int]] = None,
+        candidates: Optional[Collection[str]] = None,
+        query_norms: QueryNorms = None
     ) -> List[Tuple[str, float]]:
+        """
+        Ако е подаден речник stats, в него се записват documents_scored и
+        postings_touched (общи query/document токени) за тази заявка.
+        candidates ограничава оценяването до тези документи (редът се запазва).
+        query_norms: (text, legal) нормите на заявката преди подрязване
+        (query_pruning.prune_query_tokens); None – от самите вектори.
+        """
         q_text_vec, q_legal_vec = self.vectorize_query(query_text_tokens, query_legal_tokens)
+        q_text_norm, q_legal_norm = query_norms or (None, None)
+
+        doc_ids = self.tfidf_docs_text.keys()
+        if candidates is not None:
+            doc_ids = [doc_id for doc_id in doc_ids if doc_id in candidates]
 
         scores = []
-        for doc_id in self.tfidf_docs_text.keys():
+        postings_touched = 0
+        for doc_id in doc_ids:
             d_text_vec = self.tfidf_docs_text.get(doc_id, {})
             d_legal_vec = self.tfidf_docs_legal.get(doc_id, {})
 
-            s_text = cosine_similarity_sparse(q_text_vec, d_text_vec)
-            s_legal = cosine_similarity_sparse(q_legal_vec, d_legal_vec)
+            s_text, n_text = _cosine_with_overlap(q_text_vec, d_text_vec, self.doc_norms_text.get(doc_id), q_text_norm)
+            s_legal, n_legal = _cosine_with_overlap(q_legal_vec, d_legal_vec, None, q_legal_norm)
+            postings_touched += n_text + n_legal
 
             score = (W_TEXT * s_text) + (W_LEGAL * s_legal)
 
             if score >= min_score:
                 scores.append((doc_id, score))
 
+        if stats is not None:
+            stats["documents_scored"] = len(doc_ids)
+            stats["postings_touched"] = postings_touched
+
         scores.sort(key=lambda x: x[1], reverse=True)
         return scores[:top_k]
+
+    def score_documents(
+        self,
+        q_text_vec: Dict[str, float],
+        q_legal_vec: Dict[str, float],
+        doc_ids: List[str],
+        query_norms: QueryNorms = None
+    ) -> Tuple[List[float], int]:
+        """
+        Точният score на вече векторизирана заявка само за doc_ids (без обхождане
+        на целия индекс) и брой общи токени; непознатите документи получават 0.
+        """
+        q_text_norm, q_legal_norm = query_norms or (None, None)
+        scores = []
+        postings_touched = 0
+        for doc_id in doc_ids:
+            s_text, n_text = _cosine_with_overlap(
+                q_text_vec, self.tfidf_docs_text.get(doc_id, {}), self.doc_norms_text.get(doc_id), q_text_norm
+            )
+            s_legal, n_legal = _cosine_with_overlap(
+                q_legal_vec, self.tfidf_docs_legal.get(doc_id, {}), None, q_legal_norm
+            )
+            postings_touched += n_text + n_legal
+            scores.append((W_TEXT * s_text) + (W_LEGAL * s_legal))
+        return scores, postings_touched
+
+    def _ensure_legal_bitsets(self) -> Tuple[List[str], Dict[str, int]]:
+        if self._legal_bitsets is not None:
+            return self._legal_bitsets
+
+        doc_ids = list(self.tfidf_docs_text.keys())
+        bitsets = defaultdict(int)
+        for idx, doc_id in enumerate(doc_ids):
+            bit = 1 << idx
+            for token in self.tfidf_docs_legal.get(doc_id, {}):
+                bitsets[token] |= bit
+
+        self._legal_bitsets = (doc_ids, dict(bitsets))
+        return self._legal_bitsets
+
+    def legal_candidates(self, query_legal_tokens: List[str]) -> Optional[Set[str]]:
+        """
+        Документите с поне един общ LEGAL токен със заявката (OR на bitset-ите).
+        None, ако никой от токените на заявката не е в индекса.
+        """
+        doc_ids, bitsets = self._ensure_legal_bitsets()
+        found = False
+        bits = 0
+        for token in set(query_legal_tokens):
+            token_bits = bitsets.get(token)
+            if token_bits is not None:
+                bits |= token_bits
+                found = True
+
+        if not found:
+            return None
+        return {doc_ids[idx] for idx in iter_bits(bits)}
+
+    def search_two_stage(
+        self,
+        query_text_tokens: List[str],
+        query_legal_tokens: List[str],
+        top_k: int = 5,
+        min_score: float = 0.0,
+        stats: Optional[Dict[str, int]] = None,
+        candidates: Optional[Collection[str]] = None,
+        query_norms: QueryNorms = None
+    ) -> List[Tuple[str, float]]:
+        return two_stage_search(
+            self, query_text_tokens, query_legal_tokens, top_k, min_score, stats, candidates, query_norms
+        )
+
+    def build_ann(self, **options):
+        """
+        (Пре)строява ANN индекса; options – text_dim, legal_dim, nlist, ... на AnnIndex.from_engine.
+        """
+        from ann_index import AnnIndex
+
+        self._ann = AnnIndex.from_engine(self, **options)
+        return self._ann
+
+    def search_approximate(
+        self,
+        query_text_tokens: List[str],
+        query_legal_tokens: List[str],
+        top_k: int = 5,
+        min_score: float = 0.0,
+        stats: Optional[Dict[str, int]] = None,
+        nprobe: Optional[int] = None,
+        rerank: Optional[int] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Кандидати от ANN индекса, точен score върху тях (вж. ann_index.py).
+        nprobe: None – калибрираният nprobe на ANN индекса; rerank: None – ann_index.RERANK.
+        """
+        import ann_index
+
+        if self._ann is None:
+            self.build_ann()
+        return ann_index.approximate_search(
+            self, self._ann, query_text_tokens, query_legal_tokens, top_k, min_score, stats,
+            nprobe=nprobe,
+            rerank=ann_index.RERANK if rerank is None else rerank,
+        )
+
+    def _ensure_postings(self):
+        """
+        term -> [(doc_idx, weight)] за двете полета плюс нормите на документите.
+        Ако векторите се подменят след първото търсене, викай invalidate_postings().
+        """
+        if self._postings is not None:
+            return self._postings
+
+        doc_ids = list(self.tfidf_docs_text.keys())
+        fields = []
+        for vectors, stored_norms in ((self.tfidf_docs_text, self.doc_norms_text), (self.tfidf_docs_legal, {})):
+            postings = defaultdict(list)
+            norms = [0.0] * len(doc_ids)
+            for idx, doc_id in enumerate(doc_ids):
+                vec = vectors.get(doc_id, {})
+                for token, w in vec.items():
+                    postings[token].append((idx, w))
+                norm = stored_norms.get(doc_id)
+                norms[idx] = norm if norm is not None else math.sqrt(sum(w ** 2 for w in vec.values()))
+            fields.append((dict(postings), norms))
+
+        self._postings = (doc_ids, fields)
+        return self._postings
+
+    def invalidate_postings(self):
+        self._postings = None
+        self._legal_bitsets = None
+        self._ann = None
+
+    def field_similarities(
+        self,
+        query_text_tokens: List[str],
+        query_legal_tokens: List[str]
+    ) -> Tuple[List[str], Dict[int, float], Dict[int, float]]:
+        """
+        (doc_ids, text cosine по doc index, legal cosine по doc index) –
+        само за документите с общ токен; останалите имат 0.
+        """
+        doc_ids, (text_field, legal_field) = self._ensure_postings()
+        q_text_vec, q_legal_vec = self.vectorize_query(query_text_tokens, query_legal_tokens)
+        text_cos, _ = _field_cosines(q_text_vec, *text_field)
+        legal_cos, _ = _field_cosines(q_legal_vec, *legal_field)
+        return doc_ids, text_cos, legal_cos
+
+    def search_batch(
+        self,
+        queries: List[BatchQuery],
+        top_k: int = 5,
+        min_score: float = 0.0,
+        stats: Optional[Dict[str, int]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Term-at-a-time оценяване върху inverted postings: обхождат се само
+        документите с общ токен, а нормите се смятат веднъж за всички заявки.
+        Резултатите съвпадат със search() (с точност до закръгляне).
+        queries: (text, legal) или (text, legal, query_norms) – изходът на prune_query_tokens.
+        """
+        doc_ids, fields = self._ensure_postings()
+        weights = (W_TEXT, W_LEGAL)
+
+        all_results = []
+        documents_scored = 0
+        postings_touched = 0
+
+        for query in queries:
+            query_text_tokens, query_legal_tokens, query_norms = split_batch_query(query)
+            q_vecs = self.vectorize_query(query_text_tokens, query_legal_tokens)
+
+            scores = defaultdict(float)
+            for q_vec, q_norm, (postings, norms), field_weight in zip(q_vecs, query_norms or (None, None), fields, weights):
+                cosines, touched = _field_cosines(q_vec, postings, norms, q_norm)
+                postings_touched += touched
+                for idx, cos in cosines.items():
+                    scores[idx] += field_weight * cos
+
+            documents_scored += len(scores)
+
+            # същата подредба като search(): score desc, после реда на документите
+            candidates = [(score, idx) for idx, score in scores.items() if score >= min_score]
+            top = heapq.nsmallest(top_k, candidates, key=lambda x: (-x[0], x[1]))
+
+            # документи без общ токен имат score 0 – допълваме по реда на документите
+            if len(top) < top_k and min_score <= 0.0:
+                top = [t for t in top if t[0] > 0.0]
+                for idx in range(len(doc_ids)):
+                    if len(top) >= top_k:
+                        break
+                    if scores.get(idx, 0.0) == 0.0:
+                        top.append((0.0, idx))
+
+            all_results.append([(doc_ids[idx], score) for score, idx in top])
+
+        if stats is not None:
+            stats["documents_scored"] = documents_scored
+            stats["postings_touched"] = postings_touched
+
+        return all_results
@@ -1,47 +1,271 @@
 import json
+import os
+from collections import Counter, defaultdict
 from pathlib import Path
-from tf_idf_engine import TfidfSearchEngine
-from text_preprocessing import process_pdf
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from tf_idf_engine import (
+    compute_idf_from_df,
+    compute_tfidf_vector_from_counts,
+    l2_normalize,
+    prune_document_vector,
+)
+from document_metadata import MetadataWriter
+from near_duplicates import DUPLICATES_FILE, find_duplicates
+from segments import has_segments, manifest_stale_reason
+from snippets import SnippetStoreWriter
+from text_preprocessing import process_pdf_document
 
 PDF_DIR = Path("Data/Documents")
 INDEX_DIR = Path("index")
-INDEX_DIR.mkdir(exist_ok=True)
 
-documents_text_tokens = {}
-documents_legal_tokens = {}
+# per-document term counts (pass 1), по един JSON ред на документ
+COUNTS_DIR_NAME = "counts"
+BASE_PART = "base"
+
+# почти еднаквите документи (near_duplicates.py) се индексират веднъж;
+# останалите са в duplicates.json под представителя си
+COLLAPSE_DUPLICATES = True
+
+# статично подрязване на text векторите (вж. TfidfSearchEngine.prune_documents);
+# None – без подрязване. Оценка: evaluation.py --index_prune_report
+PRUNE_MIN_RELATIVE_WEIGHT: Optional[float] = None
+PRUNE_MAX_TERMS: Optional[int] = None
+
+
+class JsonObjectStream:
+    """
+    Пише голям JSON обект ключ по ключ, без да го държи в паметта.
+    Файлът се появява под крайното си име едва при close().
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.tmp_path = path.with_name(path.name + ".tmp")
+        self._f = self.tmp_path.open("w", encoding="utf-8")
+        self._f.write("{")
+        self._first = True
+
+    def write(self, key: str, value) -> None:
+        if not self._first:
+            self._f.write(",")
+        self._first = False
+        self._f.write(json.dumps(key, ensure_ascii=False))
+        self._f.write(":")
+        self._f.write(json.dumps(value, ensure_ascii=False))
+
+    def close(self) -> None:
+        self._f.write("}")
+        self._f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+            self.tmp_path.unlink(missing_ok=True)
+
+
+def counts_files(index_dir: Path) -> List[Path]:
+    return sorted((index_dir / COUNTS_DIR_NAME).glob("*.jsonl"))
+
+
+def iter_counts(index_dir: Path) -> Iterator[Tuple[str, Dict[str, int], Dict[str, int]]]:
+    """
+    Чете spool-а от pass 1 ред по ред: (doc_id, text_counts, legal_counts)
+    """
+    for path in counts_files(index_dir):
+        yield from iter_counts_file(path)
+
+
+def iter_counts_file(path: Path) -> Iterator[Tuple[str, Dict[str, int], Dict[str, int]]]:
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            yield row["doc"], row["text"], row["legal"]
+
+
+def write_counts_record(f, doc_id: str, text_tokens: List[str], legal_tokens: List[str]) -> None:
+    row = {
+        "doc": doc_id,
+        "text": Counter(text_tokens),
+        "legal": Counter(legal_tokens),
+    }
+    f.write(json.dumps(row, ensure_ascii=False))
+    f.write("\n")
+
+
+def count_pass(pdf_dir: Path, index_dir: Path) -> int:
+    """
+    Pass 1: process_pdf_document за всеки документ и запис на term counts на диска,
+    заедно със snippet записа (текст + позиции на LEGAL препратките) и метаданните.
+    В паметта е само текущият документ.
+    """
+    counts_dir = index_dir / COUNTS_DIR_NAME
+    counts_dir.mkdir(parents=True, exist_ok=True)
+
+    out_path = counts_dir / f"{BASE_PART}.jsonl"
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+
+    counter = 0
+    with tmp_path.open("w", encoding="utf-8") as f, SnippetStoreWriter(index_dir, BASE_PART) as snippets, \
+            MetadataWriter(index_dir, BASE_PART) as metadata:
+        for pdf_file in sorted(pdf_dir.glob("*.pdf")):
+            doc = process_pdf_document(pdf_file)
+            write_counts_record(f, pdf_file.name, doc.text_tokens, doc.legal_tokens)
+            snippets.add(pdf_file.name, doc.display_text, doc.legal_spans)
+            metadata.add(pdf_file.name, doc.metadata)
+
+            counter += 1
+            print(counter)
+
+    os.replace(tmp_path, out_path)
+    return counter
+
+
+def duplicates_pass(index_dir: Path) -> Dict[str, List[str]]:
+    """
+    MinHash/LSH върху множествата текстови токени от spool-а.
+    В паметта са само сигнатурите (NUM_PERM uint32 на документ).
+    """
+    stats = {}
+    clusters = find_duplicates(
+        ((doc_id, text_counts.keys()) for doc_id, text_counts, _ in iter_counts(index_dir)),
+        stats=stats,
+    )
+    print(f"Near-duplicates: {stats.get('duplicates', 0)} documents in {stats.get('clusters', 0)} clusters")
+    return clusters
+
+
+def document_frequency_pass(index_dir: Path, skip: Optional[Set[str]] = None) -> Tuple[int, Dict[str, int], Dict[str, int]]:
+    """
+    DF pass: само речникът (term -> df) е в паметта, не документите.
+    """
+    df_text = defaultdict(int)
+    df_legal = defaultdict(int)
+    N = 0
+
+    for doc_id, text_counts, legal_counts in iter_counts(index_dir):
+        if skip and doc_id in skip:
+            continue
+        N += 1
+        for token in text_counts:
+            df_text[token] += 1
+        for token in legal_counts:
+            df_legal[token] += 1
+
+    return N, df_text, df_legal
+
+
+def _iter_vectors(
+    index_dir: Path,
+    idf_text: Dict[str, float],
+    idf_legal: Dict[str, float],
+    skip: Optional[Set[str]],
+) -> Iterator[Tuple[str, Dict[str, float], Dict[str, float]]]:
+    """
+    (doc_id, нормализиран text вектор, нормализиран legal вектор) по реда на counts файловете.
+    """
+    for doc_id, text_counts, legal_counts in iter_counts(index_dir):
+        if skip and doc_id in skip:
+            continue
+        yield (
+            doc_id,
+            l2_normalize(compute_tfidf_vector_from_counts(text_counts, idf_text, is_legal_field=False)),
+            l2_normalize(compute_tfidf_vector_from_counts(legal_counts, idf_legal, is_legal_field=True)),
+        )
+
+
+def vector_pass(
+    index_dir: Path,
+    idf_text: Dict[str, float],
+    idf_legal: Dict[str, float],
+    skip: Optional[Set[str]] = None,
+    prune_min_relative_weight: Optional[float] = PRUNE_MIN_RELATIVE_WEIGHT,
+    prune_max_terms: Optional[int] = PRUNE_MAX_TERMS,
+) -> None:
+    """
+    Pass 2: нормализирани TF-IDF вектори директно в индекса на диска.
+    Косинусът не зависи от мащаба, така че резултатите от търсенето са същите.
+    При подрязване нормата отпреди него (1.0) отива в doc_norms_text.json.
+    """
+    norms_path = index_dir / "doc_norms_text.json"
+    with JsonObjectStream(index_dir / "tfidf_docs_text.json") as text_out, \
+            JsonObjectStream(index_dir / "tfidf_docs_legal.json") as legal_out, \
+            JsonObjectStream(norms_path) as norms_out:
+        pruned_docs = 0
+        for doc_id, text_vec, legal_vec in _iter_vectors(index_dir, idf_text, idf_legal, skip):
+            pruned = prune_document_vector(text_vec, prune_min_relative_weight, prune_max_terms)
+            if len(pruned) < len(text_vec):
+                norms_out.write(doc_id, 1.0)
+                pruned_docs += 1
+
+            text_out.write(doc_id, pruned)
+            legal_out.write(doc_id, legal_vec)
+
+    # без подрязани документи файлът не е нужен (и load_json_engine не го чете)
+    if not pruned_docs:
+        norms_path.unlink()
+
+
+def write_json(path: Path, obj) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
 
-counter = 1
 
-for pdf_file in PDF_DIR.glob("*.pdf"):
-    text_tokens, legal_tokens = process_pdf(pdf_file)
+def write_index_from_counts(
+    index_dir: Path = INDEX_DIR,
+    collapse_duplicates: bool = COLLAPSE_DUPLICATES,
+    prune_min_relative_weight: Optional[float] = PRUNE_MIN_RELATIVE_WEIGHT,
+    prune_max_terms: Optional[int] = PRUNE_MAX_TERMS,
+) -> int:
+    """
+    (duplicates pass) + DF pass + pass 2 върху всички spool файлове в index/counts.
+    Връща броя индексирани документи (без дубликатите).
+    """
+    duplicates = duplicates_pass(index_dir) if collapse_duplicates else {}
+    write_json(index_dir / DUPLICATES_FILE, duplicates)
+    skip = {doc_id for dups in duplicates.values() for doc_id in dups}
 
-    documents_text_tokens[pdf_file.name] = text_tokens
-    documents_legal_tokens[pdf_file.name] = legal_tokens
+    N, df_text, df_legal = document_frequency_pass(index_dir, skip)
 
-    print(counter)
-    counter += 1
+    idf_text = compute_idf_from_df(df_text, N)
+    idf_legal = compute_idf_from_df(df_legal, N)
+    del df_text, df_legal
 
-print(f"Indexed {len(documents_text_tokens)} documents")
+    write_json(index_dir / "idf_text.json", idf_text)
+    write_json(index_dir / "idf_legal.json", idf_legal)
 
-engine = TfidfSearchEngine()
-engine.build_index(documents_text_tokens, documents_legal_tokens)
+    vector_pass(index_dir, idf_text, idf_legal, skip, prune_min_relative_weight, prune_max_terms)
 
-with open(INDEX_DIR / "documents_text_tokens.json", "w", encoding="utf-8") as f:
-    json.dump(documents_text_tokens, f, ensure_ascii=False)
+    # сегментите вече не отговарят на индекса и load_engine ще ги пропуска
+    if has_segments(index_dir) and manifest_stale_reason(index_dir) is not None:
+        print("The segmented index is now stale; re-seed it with segments.py init or delete index/segments")
+    return N
 
-with open(INDEX_DIR / "documents_legal_tokens.json", "w", encoding="utf-8") as f:
-    json.dump(documents_legal_tokens, f, ensure_ascii=False)
 
-with open(INDEX_DIR / "idf_text.json", "w", encoding="utf-8") as f:
-    json.dump(engine.idf_text, f, ensure_ascii=False)
+def build_index_streaming(
+    pdf_dir: Path = PDF_DIR,
+    index_dir: Path = INDEX_DIR,
+    collapse_duplicates: bool = COLLAPSE_DUPLICATES,
+) -> int:
+    index_dir.mkdir(parents=True, exist_ok=True)
 
-with open(INDEX_DIR / "idf_legal.json", "w", encoding="utf-8") as f:
-    json.dump(engine.idf_legal, f, ensure_ascii=False)
+    count_pass(pdf_dir, index_dir)
+    N = write_index_from_counts(index_dir, collapse_duplicates)
 
-with open(INDEX_DIR / "tfidf_docs_text.json", "w", encoding="utf-8") as f:
-    json.dump(engine.tfidf_docs_text, f, ensure_ascii=False)
+    print(f"Indexed {N} documents")
+    return N
 
-with open(INDEX_DIR / "tfidf_docs_legal.json", "w", encoding="utf-8") as f:
-    json.dump(engine.tfidf_docs_legal, f, ensure_ascii=False)
 
-print("TF-IDF index saved (text + legal).")
+if __name__ == "__main__":
+    build_index_streaming()
+    print("TF-IDF index saved (text + legal).")
@@ -1,13 +1,7 @@
 from pathlib import Path
-import PyPDF2
+
+from pdf_extraction import extract_text
 
 
 def extract_text_from_pdf(pdf_path: Path) -> str:
-    chunks = []
-    with open(pdf_path, "rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        for page in reader.pages:
-            text = page.extract_text()
-            if text:
-                chunks.append(text)
-    return "\n".join(chunks)
+    return extract_text(pdf_path, sep="\n")
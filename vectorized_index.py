@@ -0,0 +1,84 @@
+# Векторизиран TF-IDF за build_index (tfidf_field):
+#   1. TF counts на документ с Counter (C), двойките (документ, term) в реда на
+#      първото срещане се събират в плоски масиви;
+#   2. термините -> id-та (един речник за полето);
+#   3. DF = bincount по term id; IDF, log-TF и legal boost – операции върху масиви.
+# log10 се смята с math.log10 само върху различните стойности (броячи, N/df) и
+# се разпръсква по масива – np.log10 се разминава с math.log10 в последния бит.
+# Теглата се умножават в реда на compute_tfidf_vector, така че build_index дава
+# идентични вектори с Python пътя – и по стойности, и по реда на термините.
+# np.unique върху (doc * V + term) дава същите броячи, но сортирането и
+# картирането на всеки токен излизат по-скъпи от Counter, който и без това е на C.
+# Измерено (етап "build_index" в benchmark.py): ~1.2-1.9x според корпуса.
+# Остатъкът е строенето на dict на документ, който engine-ите изискват.
+# Streaming builder-ът няма масивен път: pass 2 пише JSON dict на документ, така
+# че по-бързите тегла не променяха времето на целия builder.
+from collections import Counter
+from itertools import chain
+from typing import Dict, List, Sequence, Tuple
+import math
+
+import numpy as np
+
+from tf_idf_engine import token_boost_legal
+
+
+def _log10_map(values: np.ndarray, offset: float = 0.0) -> np.ndarray:
+    """
+    offset + math.log10(v) за всеки елемент, смятано веднъж на различна стойност.
+    """
+    uniq, inverse = np.unique(values, return_inverse=True)
+    table = np.array([offset + math.log10(v) for v in uniq.tolist()], dtype=np.float64)
+    return table[inverse]
+
+
+def _legal_boosts(terms: Sequence[str], cache: Dict[str, float]) -> np.ndarray:
+    def boost(term: str) -> float:
+        value = cache.get(term)
+        if value is None:
+            value = cache[term] = token_boost_legal(term)
+        return value
+
+    return np.fromiter(map(boost, terms), dtype=np.float64, count=len(terms))
+
+
+def _split(terms: List[str], values: List[float], bounds: np.ndarray) -> List[Dict[str, float]]:
+    bounds = bounds.tolist()
+    return [
+        dict(zip(terms[bounds[i]:bounds[i + 1]], values[bounds[i]:bounds[i + 1]]))
+        for i in range(len(bounds) - 1)
+    ]
+
+
+def tfidf_field(
+    documents_tokens: Dict[str, List[str]],
+    *,
+    is_legal_field: bool = False
+) -> Tuple[Dict[str, float], Dict[str, Dict[str, float]]]:
+    """
+    (idf, doc_id -> tfidf вектор) – същото като compute_idf + compute_tfidf_vector
+    за всеки документ.
+    """
+    doc_ids = list(documents_tokens)
+    N = len(doc_ids)
+    counters = list(map(Counter, documents_tokens.values()))
+    terms = list(chain.from_iterable(counters))
+    if not terms:
+        return {}, {doc_id: {} for doc_id in doc_ids}
+
+    counts = np.fromiter(chain.from_iterable(c.values() for c in counters), dtype=np.int64, count=len(terms))
+    vocab = list(dict.fromkeys(terms))
+    term_id = {t: i for i, t in enumerate(vocab)}
+    pair_term = np.fromiter(map(term_id.__getitem__, terms), dtype=np.int64, count=len(terms))
+
+    df = np.bincount(pair_term, minlength=len(vocab))
+    idf = _log10_map(N / df)
+
+    weights = _log10_map(counts, 1.0) * idf[pair_term]
+    if is_legal_field:
+        weights *= _legal_boosts(vocab, {})[pair_term]
+
+    bounds = np.zeros(len(counters) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in counters], out=bounds[1:])
+    vectors = dict(zip(doc_ids, _split(terms, weights.tolist(), bounds)))
+    return dict(zip(vocab, idf.tolist())), vectors
@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import json
+import math
+
+import numpy as np
+
+from evaluation import (
+    DEFAULT_CACHE_PATH,
+    EvaluationCache,
+    _cached_map,
+    _decision_worker,
+    _query_worker,
+    weighted_jaccard,
+)
+from tf_idf_engine import (
+    LEGAL_LAMBDA,
+    LEGAL_SPEC_LOG_WEIGHT,
+    TfidfSearchEngine,
+    _LEGAL_LEVEL_RE,
+    compute_tfidf_vector,
+)
+
+# колко кандидата на поле пазим за всяка заявка
+DEFAULT_CANDIDATES = 200
+
+
+def legal_depth_log(token: str) -> float:
+    """
+    log1p(depth) – boost-ът е 1 + LEGAL_SPEC_LOG_WEIGHT * това
+    """
+    if not token.startswith("LEGAL:"):
+        return 0.0
+    return math.log1p(len(_LEGAL_LEVEL_RE.findall(token[6:])))
+
+
+def _moments(weights: Dict[str, float]) -> np.ndarray:
+    """
+    [Σ r², Σ r² L, Σ r² L²] – квадратът на нормата е A0 + 2wA1 + w²A2
+    """
+    out = np.zeros(3)
+    for token, r in weights.items():
+        L = legal_depth_log(token)
+        r2 = r * r
+        out += (r2, r2 * L, r2 * L * L)
+    return out
+
+
+@dataclass
+class QueryComponents:
+    """
+    Всичко нужно за да се преизчисли score-ът на кандидатите при произволни
+    LEGAL_LAMBDA / LEGAL_SPEC_LOG_WEIGHT без да се пипа индексът.
+    """
+    query_doc: str
+    candidates: List[str]
+    s_text: np.ndarray       # (C,)
+    dot: np.ndarray          # (C, 3): Σ q_r d_r [1, L, L²]
+    doc_moments: np.ndarray  # (C, 3)
+    query_moments: np.ndarray  # (3,)
+    wj: np.ndarray           # (C,) weighted Jaccard спрямо заявката
+
+
+class SweepComponents:
+    def __init__(self, engine: TfidfSearchEngine, boost_weight: float = LEGAL_SPEC_LOG_WEIGHT):
+        self.engine = engine
+        self.boost_weight = boost_weight
+        # документните legal вектори без boost (и без мащаба на нормализацията)
+        self._raw_legal: Dict[str, Dict[str, float]] = {}
+        self._doc_moments: Dict[str, np.ndarray] = {}
+
+    def raw_legal(self, doc_id: str) -> Dict[str, float]:
+        raw = self._raw_legal.get(doc_id)
+        if raw is None:
+            vec = self.engine.tfidf_docs_legal.get(doc_id, {})
+            raw = {t: w / (1.0 + self.boost_weight * legal_depth_log(t)) for t, w in vec.items()}
+            self._raw_legal[doc_id] = raw
+            self._doc_moments[doc_id] = _moments(raw)
+        return raw
+
+    def candidates(
+        self,
+        text_tokens: List[str],
+        legal_tokens: List[str],
+        n_candidates: int,
+    ) -> Tuple[List[str], np.ndarray]:
+        """
+        Обединението на top-N по text и top-N по legal cosine, с text cosine-а им.
+        """
+        doc_ids, text_cos, legal_cos = self.engine.field_similarities(text_tokens, legal_tokens)
+
+        top_text = sorted(text_cos, key=text_cos.get, reverse=True)[:n_candidates]
+        top_legal = sorted(legal_cos, key=legal_cos.get, reverse=True)[:n_candidates]
+        idxs = sorted(set(top_text) | set(top_legal))
+
+        return [doc_ids[i] for i in idxs], np.array([text_cos.get(i, 0.0) for i in idxs])
+
+    def components(
+        self,
+        query_doc: str,
+        legal_tokens: List[str],
+        candidates: List[str],
+        s_text: np.ndarray,
+        q_decision: set,
+        decisions: Dict[str, List[str]],
+    ) -> QueryComponents:
+        q_raw = compute_tfidf_vector(legal_tokens, self.engine.idf_legal, is_legal_field=False)
+
+        dot = np.zeros((len(candidates), 3))
+        doc_moments = np.zeros((len(candidates), 3))
+        for row, doc_id in enumerate(candidates):
+            d_raw = self.raw_legal(doc_id)
+            doc_moments[row] = self._doc_moments[doc_id]
+            for token in q_raw.keys() & d_raw.keys():
+                L = legal_depth_log(token)
+                p = q_raw[token] * d_raw[token]
+                dot[row] += (p, p * L, p * L * L)
+
+        wj = np.array([
+            weighted_jaccard(q_decision, set(decisions[d])) if d in decisions else 0.0
+            for d in candidates
+        ])
+
+        return QueryComponents(
+            query_doc=query_doc,
+            candidates=candidates,
+            s_text=s_text,
+            dot=dot,
+            doc_moments=doc_moments,
+            query_moments=_moments(q_raw),
+            wj=wj,
+        )
+
+
+def _quadratic(moments: np.ndarray, boosts: np.ndarray) -> np.ndarray:
+    """
+    moments (..., 3), boosts (B,) -> (B, ...): m0 + 2w m1 + w² m2
+    """
+    w = boosts.reshape((-1,) + (1,) * (moments.ndim - 1))
+    return moments[..., 0] + 2.0 * w * moments[..., 1] + (w * w) * moments[..., 2]
+
+
+def sweep_query(comp: QueryComponents, lambdas: np.ndarray, boosts: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Най-добрият weighted Jaccard в top_k за всяка точка от мрежата: (L, B)
+    """
+    if len(comp.candidates) == 0:
+        return np.zeros((len(lambdas), len(boosts)))
+
+    dot = _quadratic(comp.dot, boosts)                  # (B, C)
+    d_norm2 = _quadratic(comp.doc_moments, boosts)      # (B, C)
+    q_norm2 = _quadratic(comp.query_moments, boosts)    # (B,)
+
+    denom = np.sqrt(d_norm2 * q_norm2[:, None])
+    s_legal = np.divide(dot, denom, out=np.zeros_like(dot), where=denom > 0)
+
+    lam = lambdas[:, None, None]
+    scores = (comp.s_text[None, None, :] + lam * s_legal[None, :, :]) / (1.0 + lam)  # (L, B, C)
+
+    k = min(top_k, scores.shape[-1])
+    top = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    return comp.wj[top].max(axis=-1).clip(min=0.0)
+
+
+def build_components(
+    engine: TfidfSearchEngine,
+    queries_dir: Path,
+    documents_dir: Path,
+    n_candidates: int = DEFAULT_CANDIDATES,
+    workers: Optional[int] = None,
+    cache_path: Optional[Path] = DEFAULT_CACHE_PATH,
+) -> List[QueryComponents]:
+    query_files = sorted(queries_dir.glob("*.pdf"))
+    if not query_files:
+        raise RuntimeError(f"No PDFs found in {queries_dir}")
+
+    sweep = SweepComponents(engine)
+    cache = EvaluationCache(cache_path)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        queries = _cached_map(cache, "query", query_files, _query_worker, pool)
+
+        candidates = {
+            q.name: sweep.candidates(queries[q.name]["text_tokens"], queries[q.name]["legal_tokens"], n_candidates)
+            for q in query_files
+        }
+
+        doc_paths = sorted({
+            documents_dir / d
+            for cands, _ in candidates.values()
+            for d in cands
+            if (documents_dir / d).exists()
+        })
+        decisions = _cached_map(cache, "decision", doc_paths, _decision_worker, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        cache.save()
+
+    out = []
+    for q in query_files:
+        cands, s_text = candidates[q.name]
+        out.append(sweep.components(
+            q.name,
+            queries[q.name]["legal_tokens"],
+            cands,
+            s_text,
+            set(queries[q.name]["decision"]),
+            decisions,
+        ))
+    return out
+
+
+def run_sweep(
+    components: List[QueryComponents],
+    lambdas: np.ndarray,
+    boosts: np.ndarray,
+    top_k: int = 10,
+) -> np.ndarray:
+    """
+    Средният най-добър weighted Jaccard за всяка (lambda, boost) точка: (L, B)
+    """
+    total = np.zeros((len(lambdas), len(boosts)))
+    for comp in components:
+        total += sweep_query(comp, lambdas, boosts, top_k)
+    return total / max(len(components), 1)
+
+
+def parse_grid(spec: str) -> np.ndarray:
+    """
+    "start:stop:num" или списък "a,b,c"
+    """
+    if ":" in spec:
+        start, stop, num = spec.split(":")
+        return np.linspace(float(start), float(stop), int(num))
+    return np.array([float(x) for x in spec.split(",") if x.strip()])
+
+
+def sweep_report(lambdas: np.ndarray, boosts: np.ndarray, grid: np.ndarray) -> Dict:
+    best = np.unravel_index(np.argmax(grid), grid.shape)
+    return {
+        "lambdas": lambdas.tolist(),
+        "boosts": boosts.tolist(),
+        "mean_weighted_jaccard": grid.tolist(),
+        "best": {
+            "legal_lambda": float(lambdas[best[0]]),
+            "legal_spec_log_weight": float(boosts[best[1]]),
+            "mean_weighted_jaccard": float(grid[best]),
+        },
+    }
+
+
+def print_sweep(lambdas: np.ndarray, boosts: np.ndarray, grid: np.ndarray) -> None:
+    print("lambda \\ boost\t" + "\t".join(f"{b:.2f}" for b in boosts))
+    for i, lam in enumerate(lambdas):
+        print(f"{lam:.2f}\t\t" + "\t".join(f"{v:.4f}" for v in grid[i]))
+
+    report = sweep_report(lambdas, boosts, grid)["best"]
+    print(
+        f"\nBest: LEGAL_LAMBDA={report['legal_lambda']:.3f} "
+        f"LEGAL_SPEC_LOG_WEIGHT={report['legal_spec_log_weight']:.3f} "
+        f"mean WJ={report['mean_weighted_jaccard']:.4f} "
+        f"(current: {LEGAL_LAMBDA}, {LEGAL_SPEC_LOG_WEIGHT})"
+    )
+
+
+def save_sweep(path: Path, lambdas: np.ndarray, boosts: np.ndarray, grid: np.ndarray) -> None:
+    path.write_text(
+        json.dumps(sweep_report(lambdas, boosts, grid), ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )